@@ -0,0 +1,74 @@
+"""
+Compares the string work of one send_all broadcast to discord and matrix before and after BroadcastMessage.
+Before: the head is concatenated per chat, discord strips the irc colours when sending,
+the matrix room queue formats every message twice (once to size the event, once to send it).
+After: every chat format is rendered once, the room queue gets the formatted text.
+Both paths are checked to produce the same texts before timing.
+
+Usage: python benchmarks/broadcast_benchmark.py [--runs 20000] [--players 8]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from broadcast import BroadcastMessage
+from chattype import ChatType
+from matrixconnection import format_matrix_message
+from xonotic.utils import irc_colors, matrix_colors, strip_irc_colors
+
+def build_samples(players: int) -> dict[str, tuple]:
+    #(message, ircmessage, matrixmessage, messagehead, matrix_html)
+    random.seed(42)
+    names = ["^%d%s^7|^x%03XClan" % (random.randint(1, 8), "Player%d" % index, random.randint(0, 0xFFF)) for index in range(players)]
+    half = players // 2
+    def team_text(colors) -> str:
+        return "\n".join(["4v4ctf ready! Players are: ",
+                          "Team 1: " + " ".join(colors(name) for name in names[:half]),
+                          "Team 2: " + " ".join(colors(name) for name in names[half:]),
+                          "Captains are: " + colors(names[0]) + " " + colors(names[half])])
+    return {
+        "team": (team_text(lambda name: name), team_text(irc_colors), team_text(matrix_colors), None, True),
+        "bridged": ("gg <3 -> next map?", None, None, "<player1> ", False),
+        "pickups": ("Pickups: duel (1/2) 2v2tdm (3/4) 4v4ctf (7/8)", None, None, None, False),
+    }
+
+def send_all_before(message, ircmessage, matrixmessage, messagehead, matrix_html) -> tuple:
+    messagehead = messagehead or ""
+    matrix_text = messagehead + (matrixmessage if matrixmessage is not None else message)
+    discord_text = strip_irc_colors(messagehead + message).strip()
+    #sized in the room queue and formatted again for the event
+    format_matrix_message(matrix_text, matrix_html)
+    formatted = format_matrix_message(matrix_text, matrix_html)
+    return discord_text, formatted
+
+def send_all_after(message, ircmessage, matrixmessage, messagehead, matrix_html) -> tuple:
+    broadcast = BroadcastMessage(message, {ChatType.IRC.value: ircmessage, ChatType.MATRIX.value: matrixmessage}, messagehead, matrix_html)
+    discord_text = broadcast.get_discord()
+    body, formatted = broadcast.get_matrix()
+    return discord_text, formatted
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20000)
+    parser.add_argument("--players", type=int, default=8, help="players in the team announcement")
+    args = parser.parse_args()
+
+    samples = build_samples(args.players)
+    print("%-10s %8s %12s %12s %8s" % ("sample", "chars", "before us", "after us", "speedup"))
+    for name, sample in samples.items():
+        assert send_all_before(*sample) == send_all_after(*sample), name
+        timings = []
+        for function in (send_all_before, send_all_after):
+            started = time.perf_counter()
+            for _ in range(args.runs):
+                function(*sample)
+            timings.append((time.perf_counter() - started) / args.runs * 1e6)
+        print("%-10s %8d %12.2f %12.2f %7.1fx" % (name, len(sample[0]), timings[0], timings[1], timings[0] / timings[1]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Drives the ExpiryScheduler with a virtual clock and compares it with the old pugtimer loop,
+which scanned every active entry on each tick to find the next warning or expiry.
+Entries are added over an evening, some of them renew or remove before they expire.
+
+Usage: python benchmarks/expiry_scheduler_benchmark.py [--entries 2000] [--window 14400] [--renew 0.3] [--remove 0.2] [--skip-scan]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from expiryscheduler import ExpiryScheduler, VirtualClock
+from pickupstate import ActiveEntry
+
+WARNTIME = 2400
+DELETETIME = 3600
+
+def build_events(entries: int, window: int, renew: float, remove: float) -> list[tuple]:
+    #(time offset, action, entry id), sorted by time
+    random.seed(42)
+    events = []
+    for entry_id in range(entries):
+        added = random.uniform(0, window)
+        events.append((added, "add", entry_id))
+        roll = random.random()
+        if roll < renew:
+            events.append((added + random.uniform(WARNTIME, DELETETIME), "renew", entry_id))
+        elif roll < renew + remove:
+            events.append((added + random.uniform(0, DELETETIME), "remove", entry_id))
+    events.sort()
+    return events
+
+def run_heap(events: list[tuple]) -> dict:
+    clock = VirtualClock()
+    start = clock.now()
+    scheduler = ExpiryScheduler(WARNTIME, DELETETIME, clock.now)
+    active: dict[int, ActiveEntry] = {}
+    ticks = warned = expired = 0
+    started = time.perf_counter()
+
+    def tick():
+        nonlocal ticks, warned, expired
+        ticks += 1
+        warn_entries, expire_entries = scheduler.pop_due()
+        for entry in warn_entries:
+            entry.isWarned = True
+        for entry in expire_entries:
+            del active[entry.id]
+        warned += len(warn_entries)
+        expired += len(expire_entries)
+
+    for offset, action, entry_id in events:
+        #sleep until the next deadline as long as it is before the next command
+        deadline = scheduler.next_deadline()
+        while deadline is not None and (deadline - start).total_seconds() <= offset:
+            clock.current = deadline
+            tick()
+            deadline = scheduler.next_deadline()
+        clock.current = start + timedelta(seconds=offset)
+        if action == "add":
+            active[entry_id] = ActiveEntry(entry_id, None, None, "irc", clock.now())
+            scheduler.schedule(active[entry_id])
+        elif entry_id in active:
+            if action == "renew":
+                active[entry_id].addedDate = clock.now()
+                active[entry_id].isWarned = False
+                scheduler.schedule(active[entry_id])
+            else:
+                del active[entry_id]
+                scheduler.unschedule(entry_id)
+    while scheduler.next_deadline() is not None:
+        clock.current = scheduler.next_deadline()
+        tick()
+    return {"seconds": time.perf_counter() - started, "ticks": ticks, "inspected": warned + expired, "warned": warned, "expired": expired}
+
+def run_scan(events: list[tuple]) -> dict:
+    #the old algorithm: every tick walks all entries and computes the next sleep (mindiff)
+    clock = VirtualClock()
+    start = clock.now()
+    active: dict[int, ActiveEntry] = {}
+    ticks = inspected = warned = expired = 0
+    started = time.perf_counter()
+
+    def tick() -> float:
+        nonlocal ticks, inspected, warned, expired
+        ticks += 1
+        mindiff = WARNTIME
+        for entry in list(active.values()):
+            inspected += 1
+            pugdiff = (clock.now() - entry.addedDate).total_seconds()
+            if pugdiff >= DELETETIME:
+                del active[entry.id]
+                expired += 1
+            elif pugdiff >= WARNTIME:
+                mindiff = min(mindiff, DELETETIME - pugdiff)
+                if not entry.isWarned:
+                    entry.isWarned = True
+                    warned += 1
+            else:
+                mindiff = min(mindiff, WARNTIME - pugdiff)
+        return mindiff
+
+    next_tick = None
+    for offset, action, entry_id in events:
+        while next_tick is not None and next_tick <= offset and active:
+            clock.current = start + timedelta(seconds=next_tick)
+            next_tick += tick()
+        clock.current = start + timedelta(seconds=offset)
+        if action == "add":
+            active[entry_id] = ActiveEntry(entry_id, None, None, "irc", clock.now())
+            if next_tick is None or not active:
+                next_tick = offset
+        elif entry_id in active:
+            if action == "renew":
+                active[entry_id].addedDate = clock.now()
+                active[entry_id].isWarned = False
+            else:
+                del active[entry_id]
+    while active:
+        clock.current = start + timedelta(seconds=next_tick)
+        next_tick += tick()
+    return {"seconds": time.perf_counter() - started, "ticks": ticks, "inspected": inspected, "warned": warned, "expired": expired}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--window", type=int, default=14400, help="seconds over which the entries are added")
+    parser.add_argument("--renew", type=float, default=0.3, help="share of entries that renew")
+    parser.add_argument("--remove", type=float, default=0.2, help="share of entries that remove themselves")
+    parser.add_argument("--skip-scan", action="store_true", help="only run the heap, the scan is quadratic")
+    args = parser.parse_args()
+
+    events = build_events(args.entries, args.window, args.renew, args.remove)
+    results = [("heap", run_heap(events))]
+    if not args.skip_scan:
+        results.append(("scan", run_scan(events)))
+
+    print("%-6s %10s %8s %12s %8s %8s" % ("", "seconds", "ticks", "inspected", "warned", "expired"))
+    for name, result in results:
+        print("%-6s %10.3f %8d %12d %8d %8d" % (name, result["seconds"], result["ticks"], result["inspected"], result["warned"], result["expired"]))
+
+if __name__ == "__main__":
+    main()
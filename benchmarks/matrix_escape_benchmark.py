@@ -0,0 +1,73 @@
+"""
+Compares the old four-pass MatrixConnector.__replace_tags (placeholders, two escapes, restore)
+with the single-pass escape_matrix_html on colourised team announcements and bridged chat lines.
+Both implementations are checked to return the same html before timing.
+
+Usage: python benchmarks/matrix_escape_benchmark.py [--runs 20000] [--players 8]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from matrixconnection import escape_matrix_html
+from xonotic.utils import matrix_colors
+
+def replace_tags_regex(text):
+    #the implementation before the single-pass escaper
+    placeholders = []
+    def replace_font_tag(match):
+        placeholders.append(match.group(0))
+        return f'__FONT_TAG_{len(placeholders) - 1}__'
+
+    text = re.sub(r'<font[^>]*>.*?</font>', replace_font_tag, text, flags=re.DOTALL)
+    text = re.sub(r'<', '&lt;', text)
+    text = re.sub(r'>', '&gt;', text)
+
+    def restore_font_tag(match):
+        index = int(match.group(1))
+        return placeholders[index]
+
+    text = re.sub(r'__FONT_TAG_(\d+)__', restore_font_tag, text)
+    text = text.replace("\n", "<br>")
+    return text
+
+def build_samples(players: int) -> dict[str, str]:
+    random.seed(42)
+    names = [matrix_colors("^%d%s^7|^x%03X%s" % (random.randint(1, 8), "Player%d" % index, random.randint(0, 0xFFF), "Clan")) for index in range(players)]
+    half = players // 2
+    team = "\n".join([
+        "<font color=\"red\">Red team</font>: " + " ".join("<%s>" % name for name in names[:half]),
+        "<font color=\"blue\">Blue team</font>: " + " ".join("<%s>" % name for name in names[half:]),
+        "Captains: " + names[0] + " and " + names[half]])
+    return {
+        "team": team,
+        "pickups": "Pickups: duel (1/2) 2v2tdm (3/4) 4v4ctf (7/8)",
+        "bridged": "<@player1 (Player One)> gg <3 -> next map?",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20000)
+    parser.add_argument("--players", type=int, default=8, help="players in the team announcement")
+    args = parser.parse_args()
+
+    samples = build_samples(args.players)
+    print("%-10s %8s %12s %12s %8s" % ("sample", "chars", "regex us", "onepass us", "speedup"))
+    for name, text in samples.items():
+        assert replace_tags_regex(text) == escape_matrix_html(text), name
+        timings = []
+        for function in (replace_tags_regex, escape_matrix_html):
+            started = time.perf_counter()
+            for _ in range(args.runs):
+                function(text)
+            timings.append((time.perf_counter() - started) / args.runs * 1e6)
+        print("%-10s %8d %12.2f %12.2f %7.1fx" % (name, len(text), timings[0], timings[1], timings[0] / timings[1]))
+
+if __name__ == "__main__":
+    main()
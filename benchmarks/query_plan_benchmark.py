@@ -0,0 +1,125 @@
+"""
+Loads a synthetic pickup history into a temporary SQLite database and reports the
+EXPLAIN QUERY PLAN output and timings of the hot queries in dbconnection.py,
+before and after the index migration (004_migrations).
+
+Usage: python benchmarks/query_plan_benchmark.py [--years 3] [--games-per-day 40] [--players 800] [--runs 50]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.chdir(REPO_DIR)  # migrations read gametypes.json from the working directory
+
+from peewee import fn, SQL
+from peewee_migrate import Router
+from model import db, Players, GameTypes, PickupGames, PickupEntries, Subscriptions
+
+def load_history(years: int, games_per_day: int, player_count: int, active_games: int):
+    random.seed(42)
+    gametypes = list(GameTypes.select())
+    with db.atomic():
+        Players.insert_many([{"ircName": "player%d" % i, "statsName": "player%d" % i, "statsId": i} for i in range(player_count)]).execute()
+    player_ids = [player.id for player in Players.select(Players.id)]
+
+    start = datetime.now() - timedelta(days=365 * years)
+    for day in range(365 * years):
+        games = []
+        for _ in range(games_per_day):
+            games.append({"createdDate": start + timedelta(days=day, minutes=random.randint(0, 1439)),
+                          "gametypeId": random.choice(gametypes).id,
+                          "isPlayed": True})
+        with db.atomic():
+            first_id = PickupGames.insert_many(games).execute() - len(games) + 1
+            entries = []
+            for game_id, game in zip(range(first_id, first_id + len(games)), games):
+                playercount = next(g.playerCount for g in gametypes if g.id == game["gametypeId"])
+                for player_id in random.sample(player_ids, playercount):
+                    entries.append({"addedDate": game["createdDate"], "addedFrom": "irc", "playerId": player_id, "gameId": game_id})
+            for index in range(0, len(entries), 500):
+                PickupEntries.insert_many(entries[index:index + 500]).execute()
+
+    with db.atomic():
+        for gametype in gametypes[:active_games]:
+            game = PickupGames.create(gametypeId=gametype.id, isPlayed=False)
+            for player_id in random.sample(player_ids, gametype.playerCount - 1):
+                PickupEntries.create(playerId=player_id, gameId=game.id, addedFrom="irc")
+        Subscriptions.insert_many([{"playerId": random.choice(player_ids), "gametypeId": random.choice(gametypes).id} for _ in range(player_count)]).execute()
+
+def hot_queries() -> dict:
+    gametype = GameTypes.select().where(GameTypes.title == "2v2tdm").first()
+    player = Players.select().order_by(Players.id.desc()).first()
+    active_game = PickupGames.select().where(PickupGames.isPlayed == False).first()
+    thirty_days_ago = datetime.now() - timedelta(days=30)
+    titles = [gt.title for gt in GameTypes.select()]
+    return {
+        "active game by gametype": PickupGames.select().where(PickupGames.gametypeId == gametype.id, PickupGames.isPlayed == False),
+        "entry by player and game": PickupEntries.select().where(PickupEntries.playerId == player.id, PickupEntries.gameId == active_game.id),
+        "active entries of player": PickupEntries.select().join(PickupGames).where(PickupGames.isPlayed == False).where(PickupEntries.playerId == player.id),
+        "gametype by title": GameTypes.select().where(GameTypes.title == "2v2tdm"),
+        "subscription check": Subscriptions.select().where(Subscriptions.playerId == player.id, Subscriptions.gametypeId == gametype.id),
+        "last played game": PickupGames.select().where(PickupGames.isPlayed == True).order_by(PickupGames.createdDate.desc()).limit(1),
+        "top10 last 30 days": (Players
+                               .select(Players, fn.COUNT(PickupEntries.gameId).alias('game_count'))
+                               .join(PickupEntries)
+                               .join(PickupGames)
+                               .join(GameTypes)
+                               .where(PickupGames.createdDate >= thirty_days_ago, PickupGames.isPlayed == True, GameTypes.title << titles)
+                               .group_by(Players).order_by(SQL('game_count').desc())),
+    }
+
+def report(label: str, runs: int) -> dict:
+    timings = {}
+    print("\n=== %s ===" % label)
+    for name, query in hot_queries().items():
+        sql, params = query.sql()
+        plan = db.execute_sql("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        started = time.perf_counter()
+        for _ in range(runs):
+            db.execute_sql(sql, params).fetchall()
+        timings[name] = (time.perf_counter() - started) / runs * 1000
+        print("\n%s: %.3f ms" % (name, timings[name]))
+        for row in plan:
+            print("    " + row[-1])
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--games-per-day", type=int, default=40)
+    parser.add_argument("--players", type=int, default=800)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, "benchmark.db")
+    db.init(filename, pragmas={'foreign_keys': 1})
+    router = Router(db, migrate_dir=os.path.join(REPO_DIR, "migrations"))
+    router.run("003_migrations")
+
+    started = time.perf_counter()
+    load_history(args.years, args.games_per_day, args.players, active_games=5)
+    print("Loaded %d games and %d entries in %.1f s" % (PickupGames.select().count(), PickupEntries.select().count(), time.perf_counter() - started))
+    db.execute_sql("ANALYZE")
+
+    before = report("before 004_migrations", args.runs)
+    router.run("004_migrations")
+    db.execute_sql("ANALYZE")
+    after = report("after 004_migrations", args.runs)
+
+    print("\n=== summary (ms per query) ===")
+    for name in before:
+        print("%-28s %10.3f %10.3f %8.1fx" % (name, before[name], after[name], before[name] / after[name] if after[name] else float("inf")))
+
+    db.close()
+    os.remove(filename)
+    os.rmdir(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+from chattype import ChatType
+from xonotic.utils import strip_irc_colors
+from matrixconnection import format_matrix_message, matrix_plain_text
+
+DISCORD = ChatType.DISCORD.value
+MATRIX = ChatType.MATRIX.value
+
+class BroadcastMessage:
+    """
+    One message for all chats, every chat format is rendered on first use and memoized.
+        text is used for the chats without an own variant in texts (e.g. irc colours or matrix html),
+        head is the "<nick> " prefix of bridged messages.
+        IRC gets text and head separately, the irc connector splits the message and puts the head in front of every line.
+    """
+    def __init__(self, text: str, texts: dict[str, str] = None, head: str = None, matrix_html: bool = False):
+        self.text = text
+        self.texts = texts or {}
+        self.head = head or ""
+        self.matrix_html = matrix_html
+        self.discord: str = None
+        self.matrix: tuple[str, str] = None
+
+    def get_text(self, chattype: str) -> str:
+        #source text of the chat without the head
+        text = self.texts.get(chattype)
+        return self.text if text is None else text
+
+    def get_discord(self) -> str:
+        #irc colour codes removed
+        if self.discord is None:
+            self.discord = strip_irc_colors(self.head + self.get_text(DISCORD)).strip()
+        return self.discord
+
+    def get_matrix(self) -> tuple[str, str]:
+        #(plain text body, formatted_body)
+        if self.matrix is None:
+            text = self.head + self.get_text(MATRIX)
+            formatted = format_matrix_message(text, self.matrix_html)
+            self.matrix = (matrix_plain_text(text) if self.matrix_html else text, formatted)
+        return self.matrix
@@ -1,4 +1,8 @@
 from model import *
+from pickupstate import PickupState, ActiveGame
+from playercache import PlayerCache
+from gametypecatalog import GametypeCatalog
+from expiryscheduler import ExpiryScheduler
 from xonotic.utils import *
 from chattype import ChatType
 from datetime import datetime, timedelta
@@ -9,27 +13,114 @@ from collections import Counter
 
 db_logger = create_logger("dbConnector")
 
+#stats name field per target chat, the team lists show the plain stats name on discord
+MATCH_STATS_FIELDS = {ChatType.IRC.value: "statsIRCName", ChatType.DISCORD.value: "statsDiscordName", ChatType.MATRIX.value: "statsMatrixName"}
+TEAM_STATS_FIELDS = {ChatType.IRC.value: "statsIRCName", ChatType.DISCORD.value: "statsName", ChatType.MATRIX.value: "statsMatrixName"}
+
+#the connector lives on the DatabaseExecutor writer thread and keeps its one connection open,
+#WAL with synchronous=normal only syncs on checkpoints instead of every commit
+DB_PRAGMAS = {
+    'foreign_keys': 1,
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -16384,       # negative value means KiB instead of pages
+    'busy_timeout': 5000,
+    'temp_store': 'memory',
+}
+
 class DatabaseConnector:
     
-    def __init__(self, filename):
+    def __init__(self, filename, archive_age: int = 0, warm_start: bool = False):
         db_logger.info("Initialize db connection")
-        db.init(filename, pragmas={'foreign_keys': 1})
-        db.close()
+        self.archive_age = archive_age
+        self.last_archive: datetime = None
+        db.init(filename, pragmas=DB_PRAGMAS)
+        db.connect(reuse_if_open=True)
         router = Router(db)
         router.run()
-        db.close()
-        self.delete_active_games()
-
-    def __get_active_games(self) -> PickupGames:
-        games = PickupGames.select().where(PickupGames.isPlayed == False)
-        return games
-
-    def __get_active_player_entries(self, player) -> PickupEntries:
-        if player is not None:
-            return PickupEntries.select().join(PickupGames).where(PickupGames.isPlayed == False).where(PickupEntries.playerId == player)
+        self.gametypes = GametypeCatalog()
+        self.gametypes.load()
+        self.state = PickupState()
+        self.players = PlayerCache()
+        #warm start keeps the unplayed games of the last run, see restore_active_games
+        if not warm_start:
+            self.delete_active_games()
+        self.state.load()
+        self.__archive_if_due()
+
+    def __add_pickupentries(self, pending: list[tuple]):
+        #inserts all pending (player, game, addedfrom) entries with a single statement
+        if not pending:
+            return
+        pickentries = [PickupEntries(playerId=player.id, gameId=game.id, addedFrom=addedfrom) for player, game, addedfrom in pending]
+        rows = [{"addedDate": pickentry.addedDate, "addedFrom": pickentry.addedFrom, "playerId": pickentry.playerId_id, "gameId": pickentry.gameId_id, "isWarned": pickentry.isWarned}
+                for pickentry in pickentries]
+        inserted = PickupEntries.insert_many(rows).returning(PickupEntries.id).execute()
+        for pickentry, row, (player, game, addedfrom) in zip(pickentries, inserted, pending):
+            pickentry.id = row.id
+            self.state.add_entry(pickentry, player, game.title)
+        pending.clear()
+
+    def __get_addedfrom(self, player, chattype, recipient=None) -> str:
+        #pushed players count as added from their own chat
+        if recipient is None:
+            return chattype
+        if player.ircName:
+            return ChatType.IRC.value
+        elif player.discordName:
+            return ChatType.DISCORD.value
+        elif player.matrixName:
+            return ChatType.MATRIX.value
+        db_logger.error("No chattype found for player: %s", player)
+        return "unknown"
+
+    def __archive_if_due(self):
+        #archives at most once a day, at startup and from the pugtimer (never on the command path), in its own transaction
+        if self.archive_age and (self.last_archive is None or datetime.now() - self.last_archive >= timedelta(days=1)):
+            try:
+                self.archive_played_games()
+            except Exception as e:
+                db_logger.error("Something wrong with archive_played_games: %s", e)
+
+    def __seconds_until_archive(self) -> float:
+        #None if archiving is off
+        if not self.archive_age:
+            return None
+        if self.last_archive is None:
+            return 0.0
+        return max(0.0, (self.last_archive + timedelta(days=1) - datetime.now()).total_seconds())
+
+    def __count_played_game(self, puggame: ActiveGame, pugplayers: list):
+        #keeps the daily roll-up for !top10 up to date, one upsert for all players
+        rows = [{"day": puggame.createdDate.date(), "playerId": pugplayer.playerId.id, "gametypeId": puggame.gametypeId.id, "gameCount": 1}
+                for pugplayer in pugplayers]
+        if rows:
+            (PlayerDailyCounts
+             .insert_many(rows)
+             .on_conflict(conflict_target=[PlayerDailyCounts.day, PlayerDailyCounts.playerId, PlayerDailyCounts.gametypeId],
+                          update={PlayerDailyCounts.gameCount: PlayerDailyCounts.gameCount + 1})
+             .execute())
+
+    def __get_chat_name(self, pugentry, discord_mention: bool = False) -> str:
+        #name of the player in the chat the entry was added from
+        if pugentry.addedFrom == ChatType.IRC.value:
+            return pugentry.playerId.ircName
+        elif pugentry.addedFrom == ChatType.DISCORD.value:
+            return pugentry.playerId.discordMention if discord_mention else pugentry.playerId.discordName
+        elif pugentry.addedFrom == ChatType.MATRIX.value:
+            return pugentry.playerId.matrixName
+        db_logger.error("Unknown chattype: %s", pugentry.addedFrom)
         return None
+
+    def __get_or_create_active_game(self, gtype: GameTypes) -> ActiveGame:
+        game = self.state.get_game(gtype.title)
+        if game is None:
+            pickupgame = PickupGames(gametypeId=gtype.id, isPlayed=False)
+            pickupgame.save()
+            game = self.state.add_game(pickupgame, gtype)
+        return game
     
-    def __get_found_matchtext(self, puggame:PickupGames, forcedstart: bool = False) -> dict:
+    def __get_found_matchtext(self, puggame:ActiveGame, forcedstart: bool = False) -> dict:
         #excutes in case match is found and sends notification to all players
         result = {}
         has_teams: bool = False
@@ -37,49 +128,59 @@ class DatabaseConnector:
         discordresult: str = ""
         matrixresult: str = ""
 
-        db_logger.info("found_match: puggame=%s", puggame)
-        pugplayers = PickupEntries.select().where(PickupEntries.gameId == puggame.id)
-        db_logger.info("found_match: pugplayers.count()=%s", pugplayers.count())
-        if pugplayers.count() == puggame.gametypeId.playerCount or forcedstart:
-            puggame.isPlayed = True
-            puggame.save()
+        db_logger.info("found_match: puggame=%s", puggame.id)
+        pugplayers = puggame.get_entries()
+        db_logger.info("found_match: len(pugplayers)=%s", len(pugplayers))
+        if len(pugplayers) == puggame.gametypeId.playerCount or forcedstart:
+            PickupGames.update(isPlayed=True).where(PickupGames.id == puggame.id).execute()
+            self.__count_played_game(puggame, pugplayers)
+            self.state.remove_game(puggame.title)
             if puggame.gametypeId.playerCount == puggame.gametypeId.teamCount or puggame.gametypeId.statsName is None:
                 ircresult = puggame.gametypeId.title + " ready! Players are: "
                 discordresult = puggame.gametypeId.title + " ready! Players are: "
                 matrixresult = puggame.gametypeId.title + " ready! Players are: "
                 for pugplayer in pugplayers:
-                    if pugplayer.addedFrom == ChatType.IRC.value:
-                        discordresult += pugplayer.playerId.ircName + " (" + pugplayer.playerId.statsDiscordName + ") "
-                        ircresult += pugplayer.playerId.ircName + " (" + pugplayer.playerId.statsIRCName + ") "
-                        matrixresult += pugplayer.playerId.ircName + " (" + pugplayer.playerId.statsMatrixName + ") "
-                    elif pugplayer.addedFrom == ChatType.DISCORD.value:
-                        discordresult += pugplayer.playerId.discordMention + " (" + pugplayer.playerId.statsDiscordName + ") "
-                        ircresult += pugplayer.playerId.discordName + " (" + pugplayer.playerId.statsIRCName + ") "
-                        matrixresult += pugplayer.playerId.discordName + " (" + pugplayer.playerId.statsMatrixName + ") "
-                    elif pugplayer.addedFrom == ChatType.MATRIX.value:
-                        discordresult += pugplayer.playerId.matrixName + " (" + pugplayer.playerId.statsDiscordName + ") "
-                        ircresult += pugplayer.playerId.matrixName + " (" + pugplayer.playerId.statsIRCName + ") "
-                        matrixresult += pugplayer.playerId.matrixName + " (" + pugplayer.playerId.statsMatrixName + ") "
-                    else:
-                        db_logger.error("Unknown chattype: %s", pugplayer.addedFrom)
-                    self.__withdraw_player_from_all(pugplayer.playerId)
+                    player_texts = self.__get_player_texts(pugplayer, MATCH_STATS_FIELDS)
+                    if player_texts:
+                        ircresult += player_texts[ChatType.IRC.value]
+                        discordresult += player_texts[ChatType.DISCORD.value]
+                        matrixresult += player_texts[ChatType.MATRIX.value]
+                self.__withdraw_players_from_all([pugplayer.playerId for pugplayer in pugplayers])
             else:
+                #the team text needs the elo from XonStats, it is built by __add_teamtext after the transaction
                 has_teams = True
-                team_result = self.__get_teamtext(pugplayers, puggame.gametypeId.teamCount, puggame.gametypeId.statsName)
-                ircresult = team_result[ChatType.IRC.value]
-                discordresult = team_result[ChatType.DISCORD.value]
-                matrixresult = team_result[ChatType.MATRIX.value]
-                ircresult.insert(0, puggame.gametypeId.title + " ready! Players are: ")
-                discordresult.insert(0, puggame.gametypeId.title + " ready! Players are: ")                
-                matrixresult.insert(0, puggame.gametypeId.title + " ready! Players are: ")
+                self.__withdraw_players_from_all([pugplayer.playerId for pugplayer in pugplayers])
             result = {"has_teams": has_teams, ChatType.IRC.value: ircresult, ChatType.DISCORD.value: discordresult, ChatType.MATRIX.value: matrixresult, "playercount": puggame.gametypeId.playerCount}
+            if has_teams:
+                result["teams"] = (pugplayers, puggame.gametypeId)
             self.__delete_all_pickupgames_without_entries()
         return result
+
+    def __add_teamtext(self, found_match: dict):
+        #fills in the team text of a found team match, runs outside of the transaction because of the http lookups
+        if "teams" not in found_match:
+            return
+        pugplayers, gametype = found_match.pop("teams")
+        team_result = self.__get_teamtext(pugplayers, gametype.teamCount, gametype.statsName)
+        for chattype in (ChatType.IRC.value, ChatType.DISCORD.value, ChatType.MATRIX.value):
+            team_result[chattype].insert(0, gametype.title + " ready! Players are: ")
+            found_match[chattype] = team_result[chattype]
     
+    def __queue_pickupentry(self, player, game: ActiveGame, addedfrom: str, pending: list[tuple]) -> dict:
+        #entries are collected until the player fills up a game, then written and checked for a match
+        pending.append((player, game, addedfrom))
+        if game.gametypeId.playerCount is None or len(game.addedplayers) + 1 < game.gametypeId.playerCount:
+            return {}
+        self.__add_pickupentries(pending)
+        return self.__get_found_matchtext(game)
+
     def __get_player(self, user, chattype=None) -> Players:
         db_logger.debug("__get_player: user=%s, chattype=%s", user, chattype)
         player = None
         user = user if type(user)==str else user.name
+        found, player = self.players.lookup(chattype, user)
+        if found:
+            return player
         if chattype is None:
             player = Players.select().where((Players.ircName == user)|(Players.discordName == user)).first()
         elif chattype == ChatType.IRC.value:
@@ -90,6 +191,8 @@ class DatabaseConnector:
             player = Players.select().where(Players.matrixName == user).first()
         else:
             db_logger.error("Unknown chattype: %s", chattype)
+            return player
+        self.players.store(chattype, user, player)
         return player
     
     def __get_player_subscriptions(self, player) -> Subscriptions:
@@ -105,7 +208,6 @@ class DatabaseConnector:
         players_with_elo = []
 
         for player_entry in players:
-            self.__withdraw_player_from_all(player_entry.playerId)
             if player_entry.playerId.statsId:
                 players_with_elo.append({"player": player_entry, "elo": get_gamestats(player_entry.playerId.statsId, xongametype)})
             else:
@@ -145,20 +247,11 @@ class DatabaseConnector:
             captain = team['captain']
             for team_member in team['team']:
                 #self.__withdraw_player_from_all(team_member['player'].playerId)
-                if team_member['player'].addedFrom == ChatType.IRC.value:
-                    discord_entry += team_member['player'].playerId.ircName + " (" + team_member['player'].playerId.statsName + ") "
-                    irc_entry += team_member['player'].playerId.ircName + " (" + team_member['player'].playerId.statsIRCName + ") "
-                    matrix_entry += team_member['player'].playerId.ircName + " (" + team_member['player'].playerId.statsMatrixName + ") "
-                elif team_member['player'].addedFrom == ChatType.DISCORD.value:
-                    discord_entry += team_member['player'].playerId.discordMention + " (" + team_member['player'].playerId.statsName + ") "
-                    irc_entry += team_member['player'].playerId.discordName + " (" + team_member['player'].playerId.statsIRCName + ") "
-                    matrix_entry += team_member['player'].playerId.discordName + " (" + team_member['player'].playerId.statsMatrixName + ") "
-                elif team_member['player'].addedFrom == ChatType.MATRIX.value:
-                    discord_entry += team_member['player'].playerId.matrixName + " (" + team_member['player'].playerId.statsName + ") "
-                    irc_entry += team_member['player'].playerId.matrixName + " (" + team_member['player'].playerId.statsIRCName + ") "
-                    matrix_entry += team_member['player'].playerId.matrixName + " (" + team_member['player'].playerId.statsMatrixName + ") "
-                else:
-                    db_logger.error("Unknown chattype: %s", team_member['player'].addedFrom)
+                player_texts = self.__get_player_texts(team_member['player'], TEAM_STATS_FIELDS)
+                if player_texts:
+                    irc_entry += player_texts[ChatType.IRC.value]
+                    discord_entry += player_texts[ChatType.DISCORD.value]
+                    matrix_entry += player_texts[ChatType.MATRIX.value]
 
             captains_discord += f"{captain['player'].playerId.statsDiscordName} ({captain['elo']:.2f}) "
             discord_entry += f"Average Elo: {team['average_elo']:.2f} "
@@ -174,58 +267,84 @@ class DatabaseConnector:
         matchtext[ChatType.DISCORD.value].append(captains_discord)
         matchtext[ChatType.MATRIX.value].append(captains_matrix)
         return matchtext
+
+    def __get_player_texts(self, pugentry, stats_fields: dict[str, str]) -> dict[str, str]:
+        #"name (statsname) " of a player for every chat, the stats name in the format of the target chat
+        name = self.__get_chat_name(pugentry)
+        if name is None:
+            return None
+        texts = {}
+        for chattype, stats_field in stats_fields.items():
+            shown = self.__get_chat_name(pugentry, True) if chattype == ChatType.DISCORD.value else name
+            texts[chattype] = shown + " (" + getattr(pugentry.playerId, stats_field) + ") "
+        return texts
     
     def __delete_all_pickupgames_without_entries(self):
-        games: list[PickupGames] = self.__get_active_games()
+        games: list[ActiveGame] = self.state.get_empty_games()
 
-        for game in games:
-            if len(game.addedplayers) == 0:
-                game.delete_instance()
+        if games:
+            PickupGames.delete().where(PickupGames.id << [game.id for game in games]).execute()
+            for game in games:
+                self.state.remove_game(game.title)
+
+    def __refresh_active_players(self):
+        #reloads the player snapshots of all added players (e.g. after a registration moved names around)
+        player_ids = self.state.get_player_ids()
+        if player_ids:
+            for player in Players.select().where(Players.id << player_ids):
+                self.state.update_player(player)
+
+    def __renew_entries(self, gameentries):
+        if not gameentries:
+            return
+        renewdate = datetime.now()
+        PickupEntries.update(isWarned=False, addedDate=renewdate).where(PickupEntries.id << [gameentry.id for gameentry in gameentries]).execute()
+        for gameentry in gameentries:
+            self.state.renew_entry(gameentry, renewdate)
 
     def __renew_all_player_entries(self, player):
         if player is not None:
-            gameentries = self.__get_active_player_entries(player)
-        
-        for gameentry in gameentries:
-            gameentry.isWarned = False
-            gameentry.addedDate = datetime.now()
-            gameentry.save()        
+            self.__renew_entries(self.state.get_player_entries(player.id))
         
     def __withdraw_player_from_all(self, player) -> bool:
-        #check if player is already in database
-        if player is not None:
-            gameentries = self.__get_active_player_entries(player)
+        return self.__withdraw_players_from_all([player])
 
-        if player is None or not gameentries.exists():
+    def __withdraw_players_from_all(self, players) -> bool:
+        #removes the players from all active pickup games with a single statement
+        #check if players are already in a pickup game
+        players = [player for player in players if player is not None and self.state.get_player_entries(player.id)]
+        if not players:
             return False
-        
-        for gameentry in gameentries:
-            self.__withdraw_player_from_gametype(player, gameentry.gameId.gametypeId.title)
+
+        game_ids = [game.id for game in self.state.get_games()]
+        PickupEntries.delete().where(PickupEntries.playerId << [player.id for player in players], PickupEntries.gameId << game_ids).execute()
+        for player in players:
+            for gameentry in self.state.get_player_entries(player.id):
+                self.state.remove_entry(player.id, gameentry.gameId.title)
         return True
     
     def __withdraw_player_from_gametype(self, player, gametypetitle) -> bool:
         if player is None:
             return False
         
-        gtype = GameTypes.select().where(GameTypes.title == gametypetitle).first()
-        if gtype is not None: 
-            games = PickupGames.select().where(PickupGames.gametypeId == gtype.id, PickupGames.isPlayed == False)
-            for game in games:
-                PickupEntries.delete().where(PickupEntries.playerId == player, PickupEntries.gameId == game.id).execute()
+        game = self.state.get_game(gametypetitle)
+        if game is not None and player.id in game.addedplayers:
+            PickupEntries.delete().where(PickupEntries.playerId == player, PickupEntries.gameId == game.id).execute()
+            self.state.remove_entry(player.id, gametypetitle)
         return True
     
     def add_gametypes(self, gt_title, gt_playercount, gt_teamcount, gt_xonstatname) -> str:
         message = ""
 
-        db.connect()
         try:
             game = GameTypes(title=gt_title, playerCount=gt_playercount, teamCount=gt_teamcount, statsName=gt_xonstatname)
             game.save()
+            #re-read the row, the command passes the counts as strings
+            self.gametypes.add(GameTypes.get_by_id(game.id))
             message = "Gametype " + gt_title + " added."
         except:
             message = "Gametype already registered!"
         
-        db.close()
         return message
 
     def add_player_to_games(self, user, gametypes:list[str], chattype, recipient=None) -> tuple[bool, list[str], dict]:
@@ -234,7 +353,6 @@ class DatabaseConnector:
         error_message = []
         found_match = {}
 
-        db.connect()
         
         #check where user added from
         if recipient is not None:
@@ -243,82 +361,96 @@ class DatabaseConnector:
             player = self.__get_player(user,chattype)
             
         try:
-            #!add without gametype
-            if player:
-                if len(gametypes) == 0:
-                    games = self.__get_active_games()
-
-                    #no pickup game found and show possible gametypes
-                    if not games.exists():
-                        gametype_result = []
-                        for gametype in GameTypes:
-                            gametype_result.append(gametype.title)
-                        error_message.append("No game found! Possible gametypes: " + ", ".join(gametype_result))
-                    #adds to all current active pickup games
+            #the whole command is one transaction: entries are inserted in bulk and only flushed early
+            #when the player fills up a game, so the match check sees the same state as before
+            with db.atomic():
+                if player:
+                    addedfrom: str = self.__get_addedfrom(player, chattype, recipient)
+                    started = datetime.now()
+                    pending: list[tuple] = []
+                    games: list[ActiveGame] = []
+
+                    #!add without gametype
+                    if len(gametypes) == 0:
+                        games = self.state.get_games()
+
+                        #no pickup game found and show possible gametypes
+                        if not games:
+                            error_message.append("No game found! Possible gametypes: " + ", ".join(self.gametypes.get_titles()))
+                    #add with gametypes
+                    #example: !add duel 2v2tdm
                     else:
-                        for game in games:
-                            pickentry = PickupEntries.select().where(PickupEntries.playerId == player.id, PickupEntries.gameId == game.id).first()
-                            if pickentry is None:
-                                __addedFrom: str = chattype
-                                if recipient is not None:
-                                    if player.ircName:
-                                        __addedFrom = ChatType.IRC.value
-                                    elif player.discordName:
-                                        __addedFrom = ChatType.DISCORD.value
-                                    elif player.matrixName:
-                                        __addedFrom = ChatType.MATRIX.value
-                                    else:
-                                        db_logger.error("No chattype found for player: %s", player)
-                                        __addedFrom = "unknown"
-                                pickentry = PickupEntries(playerId=player.id, gameId=game.id, addedFrom=__addedFrom)
-                                pickentry.save()
-                                result = True
-                                found = self.__get_found_matchtext(game)
+                        for gtypeentries in gametypes:
+                            gtype = self.gametypes.get(gtypeentries)
+                            if gtype is not None:
+                                games.append(gtype)
+                            else:
+                                error_message.append("No gametype found with the name: " + gtypeentries)
+
+                    #adds to all current active pickup games or the given gametypes
+                    for game in games:
+                        if isinstance(game, GameTypes):
+                            game = self.__get_or_create_active_game(game)
+                        elif self.state.get_game(game.title) is not game:
+                            #a match found earlier in this loop emptied and deleted the game
+                            continue
+                        if self.state.get_entry(player.id, game.title) is None and game not in [x[1] for x in pending]:
+                            result = True
+                            found = self.__queue_pickupentry(player, game, addedfrom, pending)
+                            if found:
                                 if not found_match or (found["playercount"] > found_match["playercount"]):
                                     found_match = deepcopy(found)
-                            else:
-                                error_message.append("Already added for " + pickentry.gameId.gametypeId.title)
-                        self.__renew_all_player_entries(player)
-                #add with gametypes
-                #example: !add duel 2v2tdm
-                else:
-                    for gtypeentries in gametypes:
-                        gtype = GameTypes.select().where(GameTypes.title == gtypeentries).first()
-                        if gtype is not None:
-                            game = PickupGames.select().where(PickupGames.gametypeId == gtype.id, PickupGames.isPlayed == False).first()
-                            if game is None:
-                                game = PickupGames(gametypeId=gtype.id, isPlayed=False)
-                                game.save()
-                            pickentry = PickupEntries.select().where(PickupEntries.playerId == player.id, PickupEntries.gameId == game.id).first()
-                            if pickentry is None:
-                                __addedFrom: str = chattype
-                                if recipient is not None:
-                                    if player.ircName:
-                                        __addedFrom = "irc"
-                                    else:
-                                        __addedFrom = "discord"
-                                pickentry = PickupEntries(playerId=player.id, gameId=game.id, addedFrom=__addedFrom)
-                                pickentry.save()
-                                result = True
-                                found = self.__get_found_matchtext(game)
-                                if found:
-                                    if not found_match or (found["playercount"] > found_match["playercount"]):
-                                        found_match = deepcopy(found)
-                            else:
-                                error_message.append("Already added for " + pickentry.gameId.gametypeId.title)
                         else:
-                            error_message.append("No gametype found with the name: " + gtypeentries)
-                    self.__renew_all_player_entries(player)
-            else:
-                if recipient is not None:
-                    error_message.append(recipient + " needs to register first (!register) to be added for games!")
+                            error_message.append("Already added for " + game.title)
+                    self.__add_pickupentries(pending)
+                    #entries added by this command are already fresh, only renew the older ones
+                    self.__renew_entries([entry for entry in self.state.get_player_entries(player.id) if entry.addedDate < started])
                 else:
-                    error_message.append("You need to register first (!register) to add for games!")
+                    if recipient is not None:
+                        error_message.append(recipient + " needs to register first (!register) to be added for games!")
+                    else:
+                        error_message.append("You need to register first (!register) to add for games!")
         except Exception as e:
-            db_logger.error("Something wrong with add_player_to_games: ", e)
-        db.close()
+            db_logger.error("Something wrong with add_player_to_games: %s", e)
+            #transaction got rolled back, so roll back the in-memory state too
+            self.state.load()
+            result = False
+            found_match = {}
+            #nothing of the command was kept, the user has to know
+            error_message.append("Something went wrong, nothing was added. Please try again!")
+        self.__add_teamtext(found_match)
         return result, error_message, found_match
     
+    def archive_played_games(self, max_age_days: int = None) -> int:
+        #moves played games older than max_age_days (default: archiveage from settings) into the archive tables
+        #returns the number of archived games
+        max_age_days = self.archive_age if max_age_days is None else max_age_days
+        self.last_archive = datetime.now()
+        if not max_age_days:
+            return 0
+
+        cutoff = datetime.now() - timedelta(days=max_age_days)
+        old_games = PickupGames.select(PickupGames.id).where(PickupGames.isPlayed == True, PickupGames.createdDate < cutoff)
+        with db.atomic():
+            last_archived_id = ArchivedGames.select(fn.MAX(ArchivedGames.id)).scalar() or 0
+            ArchivedGames.insert_from(
+                PickupGames
+                .select(PickupGames.id, PickupGames.createdDate, PickupGames.gametypeId)
+                .where(PickupGames.id << old_games)
+                .order_by(PickupGames.id),
+                fields=[ArchivedGames.originalId, ArchivedGames.createdDate, ArchivedGames.gametypeId]).execute()
+            ArchivedEntries.insert_from(
+                PickupEntries
+                .select(ArchivedGames.id, PickupEntries.playerId, PickupEntries.addedFrom)
+                .join(ArchivedGames, on=(ArchivedGames.originalId == PickupEntries.gameId))
+                .where(ArchivedGames.id > last_archived_id)
+                .order_by(PickupEntries.id),
+                fields=[ArchivedEntries.gameId, ArchivedEntries.playerId, ArchivedEntries.addedFrom]).execute()
+            PickupEntries.delete().where(PickupEntries.gameId << old_games).execute()
+            archived = PickupGames.delete().where(PickupGames.isPlayed == True, PickupGames.createdDate < cutoff).execute()
+        db_logger.info("Archived %d played games older than %d days", archived, max_age_days)
+        return archived
+
     def add_server(self, servername: str, serveraddressIPv4: str, serveraddressIPv6: str) -> str:
         message = ""
         db_logger.info("add_server: servername=%s, serveraddressIPv4=%s, serveraddressIPv6=%s", servername, serveraddressIPv4, serveraddressIPv6)
@@ -330,7 +462,6 @@ class DatabaseConnector:
             db_logger.error("add_server: missing data: serveraddressIPv4=%s, serveraddressIPv6=%s", serveraddressIPv4, serveraddressIPv6)
             return "Missing data! serveraddressIPv4 or serveraddressIPv6 is required!"
             
-        db.connect()
         try:
             serv = Servers(serverName=servername, serverIPv4=serveraddressIPv4, serverIPv6=serveraddressIPv6)
             serv.save()
@@ -338,7 +469,6 @@ class DatabaseConnector:
         except:
             message = "Server already registered!" 
 
-        db.close() 
         return message
     
     def add_subscription(self, user, gametypetitle, chattype) -> str:
@@ -346,13 +476,12 @@ class DatabaseConnector:
         message: str = ""
         result: bool = False
 
-        db.connect()
         player = self.__get_player(user, chattype)
         if not player:
             message = "You need to register first (!register) to subscribe!"
         else:
             subscriptions = self.__get_player_subscriptions(player)
-            gametype = GameTypes.select().where(GameTypes.title == gametypetitle).first()
+            gametype = self.gametypes.get(gametypetitle)
             if gametype and (not subscriptions or not subscriptions.where(Subscriptions.gametypeId == gametype).exists()):
                 result = True
                 playersub = Subscriptions(playerId=player,gametypeId=gametype)
@@ -361,47 +490,44 @@ class DatabaseConnector:
                     discord_name = player.discordName
             else:
                 message = "You can't subscribe to: " + gametypetitle
-        db.close()
         return result, message, discord_name
 
+    def close(self):
+        #closes the database connection (e.g. on shutdown)
+        if not db.is_closed():
+            db.close()
+
     def delete_active_games(self):
         #Delete pickgames that were not played
-        db.connect()
         if PickupGames.table_exists():
             games = PickupGames.delete().where(PickupGames.isPlayed == False)
             games.execute()
-        db.close()
+        self.state.clear()
     
     def delete_games_without_player(self):
-        db.connect()
-        games = self.__get_active_games()
-        for game in games:
-            if len(game.addedplayers) == 0:
-                game.delete_instance() 
-        db.close()
+        self.__delete_all_pickupgames_without_entries()
     
     def delete_gametypes(self, gametypes) -> list[str]:
         messages = []
 
-        db.connect()
         if gametypes:
             for gametypeentry in gametypes:
-                gtype = GameTypes.select().where(GameTypes.title == gametypeentry).first()
+                gtype = self.gametypes.get(gametypeentry)
                 if gtype is not None:
                     gtype.delete_instance()
+                    self.state.remove_game(gtype.title)
+                    self.gametypes.remove(gtype)
                     messages.append(gametypeentry + " deleted.")
                 else:
                     messages.append(gametypeentry + " not found.")
         else:
             messages.append("To delete gametype: !removegametype [<gametypename>]")
         
-        db.close()
         return messages
 
     def delete_server(self, serverlist) -> list[str]:
         messages = []
 
-        db.connect()
         if serverlist:
             for serverentry in serverlist:
                 gserver = Servers.select().where(Servers.serverName == serverentry).first()
@@ -413,19 +539,20 @@ class DatabaseConnector:
         else:
             messages.append("To delete server: !removeserver [<servername>]")
 
-        db.close()
         return messages
 
     def delete_subscription(self, user, gametypetitle, chattype) -> list[str]:
         discord_name: str = ""
         message: str = ""
 
-        db.connect()
         player = self.__get_player(user, chattype)
         if not player:
             message = "You need to register first (!register) to subscribe!"            
         else:
-            sub_entry = Subscriptions.select().join(GameTypes).where(GameTypes.title == gametypetitle, Subscriptions.playerId == player).first()
+            gametype = self.gametypes.get(gametypetitle)
+            sub_entry = None
+            if gametype:
+                sub_entry = Subscriptions.select().where(Subscriptions.gametypeId == gametype.id, Subscriptions.playerId == player).first()
             if sub_entry:
                 sub_entry.delete_instance()
                 if player.discordName:
@@ -433,7 +560,6 @@ class DatabaseConnector:
             else:
                 message = "You are not subscribed to: " + gametypetitle
 
-        db.close()
         return message, discord_name
     
     def get_active_games_and_players(self) -> dict:
@@ -442,12 +568,11 @@ class DatabaseConnector:
         result: dict = {}
         inner_result: dict = {ChatType.IRC.value:[], ChatType.DISCORD.value:[], ChatType.MATRIX.value:[], "playercount":""}
 
-        db.connect()
-        games: list[PickupGames] = self.__get_active_games()
-        if games.exists():
+        games: list[ActiveGame] = self.state.get_games()
+        if games:
             for game in games:
                 result.update({game.gametypeId.title : deepcopy(inner_result) })
-                playerentries: list[PickupEntries] = game.addedplayers
+                playerentries: list = game.get_entries()
                 result[game.gametypeId.title]["playercount"] = "(" + str(len(playerentries)) + "/" + str(game.gametypeId.playerCount) + ")"
                 for playerentry in playerentries:
                     if playerentry.addedFrom == ChatType.IRC.value:
@@ -458,7 +583,6 @@ class DatabaseConnector:
                         result[game.gametypeId.title][ChatType.MATRIX.value].append(playerentry.playerId.matrixName)
                     else:
                         db_logger.error("Unknown chattype: %s", playerentry.addedFrom)
-        db.close()
         return result
     
     def get_full_stats(self, player_name: str, chattype: str) -> dict:
@@ -466,17 +590,15 @@ class DatabaseConnector:
         skill_stats: list[dict] = []
         stats = {}
         stats_id: int = -1
-        db.connect()
         player: Players = None
 
-        player = Players.select().where((Players.ircName == player_name)|(Players.discordName == player_name)).first()
+        player = self.__get_player(player_name)
 
         if player is None:
             if player_name.isdigit():
                 stats_id = int(player_name)
         else:
             stats_id = player.statsId
-        db.close()
     
         db_logger.info("get_skill_stats: player=%s, stats_id=%d", player, stats_id)
 
@@ -496,23 +618,42 @@ class DatabaseConnector:
             
         return stats
 
+    def add_gametype_listener(self, listener):
+        #listener(event, gametype) is called in the database thread after a gametype was added or removed
+        self.gametypes.add_listener(listener)
+
     def get_gametype_list(self) -> list[str]:
         #Get a list of strings of all possible gametypes
-        result = []
-
-        db.connect()
-        for gametype in GameTypes:
-            result.append(gametype.title)
-
-        db.close()
-        return result
+        return self.gametypes.get_titles()
 
     def get_lastgame(self, chattype) -> str:
         result_text: str = ""
-        db.connect()
-        lastPickupGame = PickupGames.select().where(PickupGames.isPlayed == True).order_by(PickupGames.createdDate.desc()).first()
+        lastPickupGame = (PickupGames
+                          .select(PickupGames, GameTypes)
+                          .join(GameTypes)
+                          .where(PickupGames.isPlayed == True)
+                          .order_by(PickupGames.createdDate.desc())
+                          .first())
+        if lastPickupGame:
+            lastPickupGamePlayers = (PickupEntries
+                                     .select(PickupEntries, Players)
+                                     .join(Players)
+                                     .where(PickupEntries.gameId == lastPickupGame.id)
+                                     .order_by(PickupEntries.id))
+        else:
+            #all played games are archived already
+            lastPickupGame = (ArchivedGames
+                              .select(ArchivedGames, GameTypes)
+                              .join(GameTypes)
+                              .order_by(ArchivedGames.createdDate.desc())
+                              .first())
+            if lastPickupGame:
+                lastPickupGamePlayers = (ArchivedEntries
+                                         .select(ArchivedEntries, Players)
+                                         .join(Players)
+                                         .where(ArchivedEntries.gameId == lastPickupGame.id)
+                                         .order_by(ArchivedEntries.id))
         if lastPickupGame:
-            lastPickupGamePlayers = lastPickupGame.addedplayers
             result_text = lastPickupGame.gametypeId.title + ", played on " + lastPickupGame.createdDate.strftime("%Y-%m-%d") + " was played with: "
             for player in lastPickupGamePlayers:
                 if chattype == ChatType.IRC.value:
@@ -528,30 +669,28 @@ class DatabaseConnector:
                     db_logger.error("Unknown chattype: %s", chattype)
         else:
             result_text = "No game played!"
-        db.close()
         return result_text
 
     def get_pickuptext(self) -> str:
         #Get string of active pickups with gametype and number of players/player needed 
         #example: "2v2tdm (2/4)"
         db_logger.info("Build pickuptext")
-        result: str = ""
+        result: str = self.state.get_pickuptext()
+        return result.rstrip() #blamepacker and never delete this comment
 
-        db.connect()
-        games: list[PickupGames] = self.__get_active_games()
+    def get_pickuptext_version(self) -> tuple[int, str]:
+        #version changes whenever the pickup text changes, example: (12, "duel (1/2) 2v2tdm (3/4)")
+        return self.state.get_pickuptext_version()
 
-        for game in games:
-            result += game.gametypeId.title + " (" + str(len(game.addedplayers)) + "/" + str(game.gametypeId.playerCount) + ") "
-        
-        db.close()
-        return result.rstrip() #blamepacker and never delete this comment
+    def get_player_cache_stats(self) -> dict:
+        #example: {"hits": 120, "misses": 8, "size": 8, "hitrate": 0.94}
+        return self.players.get_stats()
 
     def get_server(self, servername = None) -> tuple[bool, str]:
         db_logger.info("get_server: servername=%s", servername)
         result: str = ""
         wrong_server: bool = False
 
-        db.connect()
         if not servername:
             serverresult = []
             for gameserver in Servers:
@@ -570,7 +709,6 @@ class DatabaseConnector:
                 wrong_server = True
                 result = "Server: " + servername + " not found!"
 
-        db.close()
         return wrong_server, result
     
     def get_server_info(self, servername) -> tuple[bool, list[str]]:
@@ -580,7 +718,6 @@ class DatabaseConnector:
         wrong_server: bool = False
         result: bool = False
 
-        db.connect()
         server: Servers = Servers.select().where(Servers.serverName == servername).first()
         if server is not None:
             if server.serverIPv4:
@@ -593,30 +730,39 @@ class DatabaseConnector:
         else:
             wrong_server = True
             messages = "Server: " + servername + " not found!"
-        db.close()
         return wrong_server, messages
     
     def get_subscribed_players(self, gametypetitle:str) -> list[str]:
         db_logger.info("get_subscribed_players: gametypetitle=%s", gametypetitle)
         result: list[str] = []
 
-        db.connect()
-        subscripts = Subscriptions.select().join(GameTypes).where(GameTypes.title == gametypetitle)
+        gametype = self.gametypes.get(gametypetitle)
+        if gametype is None:
+            return result
+
+        subscripts = (Subscriptions
+                      .select(Subscriptions, Players)
+                      .join(Players)
+                      .where(Subscriptions.gametypeId == gametype.id)
+                      .order_by(Subscriptions.id))
         for subscript in subscripts:
             result.append(subscript.playerId.ircName)
-        db.close()
         return result
 
     def get_subscriptions(self, user, chattype) -> list[str]:        
         db_logger.info("get_subscriptions: user=%s, chattype=%s", user, chattype)
         subs: list[str] = []
 
-        db.connect()
         player = self.__get_player(user, chattype)
         if player:
-            for subscription in Subscriptions.select().where(Subscriptions.playerId == player):
-                subs.append(subscription.gametypeId.title)
-        db.close()
+            subscriptions = (Subscriptions
+                             .select(Subscriptions.gametypeId)
+                             .where(Subscriptions.playerId == player)
+                             .order_by(Subscriptions.id))
+            for subscription in subscriptions:
+                gametype = self.gametypes.get_by_id(subscription.gametypeId_id)
+                if gametype is not None:
+                    subs.append(gametype.title)
         return subs
     
     def get_top_ten(self, gametypes: list[str]) -> str:
@@ -634,22 +780,20 @@ class DatabaseConnector:
                 message += " (" + ", ".join(real_gametypes) + "):"
             else:
                 message += " (all games):"
-            db.connect()
-            thirty_days_ago = datetime.now() - timedelta(days=30)
+            #answered from the daily roll-up, so the cost only depends on the last 30 days
+            thirty_days_ago = (datetime.now() - timedelta(days=30)).date()
             players_with_game_count = (
                 Players
-                .select(Players, fn.COUNT(PickupEntries.gameId).alias('game_count'))
-                .join(PickupEntries)
-                .join(PickupGames)
-                .join(GameTypes)
-                .where(PickupGames.createdDate >= thirty_days_ago, PickupGames.isPlayed == True, GameTypes.title << real_gametypes)
+                .select(Players, fn.SUM(PlayerDailyCounts.gameCount).alias('game_count'))
+                .join(PlayerDailyCounts)
+                .where(PlayerDailyCounts.day >= thirty_days_ago,
+                       PlayerDailyCounts.gametypeId << [self.gametypes.get(title).id for title in real_gametypes])
                 .group_by(Players).order_by(SQL('game_count').desc()))
             if len(players_with_game_count) > 0:
                 for player in players_with_game_count:
                     message +=  f" {player.statsName}: {player.game_count}"
             else:
                 message = "No Games the last 30 days!"
-            db.close()
         else:
             message = "Wrong gametype!"
         return message
@@ -660,9 +804,7 @@ class DatabaseConnector:
         muted_irc_users = []
         muted_matrix_users = []
 
-        db.connect()
         if not Players.table_exists():
-            db.close()
             return muted_discord_users, muted_irc_users
         
         players: list[Players] = Players.select().where(Players.shouldBridge == False)
@@ -673,60 +815,62 @@ class DatabaseConnector:
                 muted_irc_users.append(player.ircName)
             if player.matrixName:
                 muted_matrix_users.append(player.matrixName)
-        db.close()
         return muted_discord_users, muted_irc_users, muted_matrix_users
     
     def has_active_games(self) -> bool:
-        result: bool = False
-
-        db.connect()
-        games: list[PickupGames] = self.__get_active_games()
-        result = games.exists()
-        db.close()
-        return result
+        return self.state.has_active_games()
     
-    def pugtimer_step(self, mindiff, currenttime, deletetime, warntime) -> tuple[int, bool, bool, dict]:
+    def pugtimer_step(self, currenttime: datetime = None) -> tuple[float, bool, list[dict], list[str]]:
+        #handles all warn and expire deadlines of the expiry scheduler that are due with a constant number of statements
         #return values 
-        # mindiff as int: new min-difference, 
-        # has_break as bool: timer should take a break, 
+        # delay as float: seconds until the next deadline or archive pass, None if nothing is scheduled
         # has_new_text as bool: should send pickuptext
-        # warn_user as dict: {"user": "usernameToWarn", "chattype": "irc"/"discord"} 
-        has_break: bool = False
-        has_new_text: bool = False
-        warn_user: dict = {}
-
-        db.connect()
-        pugentries = PickupEntries.select().join(PickupGames).where(PickupGames.isPlayed == False).order_by(PickupEntries.addedDate.asc())
-        for pugentry in pugentries:
-            pugdiff = round((currenttime - pugentry.addedDate).total_seconds())
-            if pugdiff >= deletetime:
-                gid = pugentry.gameId
-                pugentry.delete_instance()
-                game = PickupGames.select().where(PickupGames.id == gid).first()
-                if len(game.addedplayers) == 0:
-                    game.delete_instance()
-                has_new_text = True
-            elif pugdiff >= warntime:
-                if mindiff > deletetime - pugdiff:
-                    mindiff = deletetime - pugdiff  
-                if not pugentry.isWarned:
-                    pugentry.isWarned = True
-                    pugentry.save()
-                    if pugentry.addedFrom == ChatType.IRC.value:
-                        warn_user = {"user": pugentry.playerId.ircName, "chattype": pugentry.addedFrom}
-                    elif pugentry.addedFrom == ChatType.DISCORD.value:
-                        warn_user = {"user": pugentry.playerId.discordMention, "chattype": pugentry.addedFrom}
-                    elif pugentry.addedFrom == ChatType.MATRIX.value:
-                        warn_user = {"user": pugentry.playerId.matrixName, "chattype": pugentry.addedFrom}
-                    else:
-                        db_logger.error("Unknown chattype: ", pugentry.addedFrom)
-            else:
-                if mindiff > warntime - pugdiff:
-                    mindiff = warntime - pugdiff
-                # else:
-                #     has_break = True
-        db.close()
-        return mindiff, has_break, has_new_text, warn_user
+        # warn_users as list: [{"user": "usernameToWarn", "chattype": "irc"/"discord"/"matrix"}], one per player and chat
+        # expired_players as list: names of the players that got removed, for one broadcast
+        warn_users: list[dict] = []
+        expired_players: list[str] = []
+
+        self.__archive_if_due()
+        scheduler: ExpiryScheduler = self.state.scheduler
+        warn_entries, expire_entries = scheduler.pop_due(currenttime)
+        if not warn_entries and not expire_entries:
+            return self.__next_delay(), False, warn_users, expired_players
+
+        try:
+            with db.atomic():
+                if expire_entries:
+                    PickupEntries.delete().where(PickupEntries.id << [pugentry.id for pugentry in expire_entries]).execute()
+                    games: dict[int, ActiveGame] = {}
+                    for pugentry in expire_entries:
+                        self.state.remove_entry(pugentry.playerId.id, pugentry.gameId.title)
+                        games[pugentry.gameId.id] = pugentry.gameId
+                        name = self.__get_chat_name(pugentry)
+                        if name and name not in expired_players:
+                            expired_players.append(name)
+                    empty_games = [game for game in games.values() if not game.addedplayers and self.state.get_game(game.title) is game]
+                    if empty_games:
+                        PickupGames.delete().where(PickupGames.id << [game.id for game in empty_games]).execute()
+                        for game in empty_games:
+                            self.state.remove_game(game.title)
+
+                if warn_entries:
+                    PickupEntries.update(isWarned=True).where(PickupEntries.id << [pugentry.id for pugentry in warn_entries]).execute()
+                    for pugentry in warn_entries:
+                        self.state.warn_entry(pugentry)
+                        warn_user = {"user": self.__get_chat_name(pugentry, True), "chattype": pugentry.addedFrom}
+                        if warn_user["user"] and warn_user not in warn_users:
+                            warn_users.append(warn_user)
+        except Exception as e:
+            db_logger.error("Something wrong with pugtimer_step: %s", e)
+            #transaction got rolled back, reload the state (and the schedule)
+            self.state.load()
+            return self.__next_delay(), False, [], []
+        return self.__next_delay(), bool(expire_entries), warn_users, expired_players
+
+    def __next_delay(self) -> float:
+        #the pugtimer also wakes up for the daily archive pass
+        delays = [delay for delay in (self.state.scheduler.seconds_until_next(), self.__seconds_until_archive()) if delay is not None]
+        return min(delays) if delays else None
     
     def register_player(self, user, xonstatId, chattype) -> tuple[str, str, str, str]:
         db_logger.info("register_player: user=%s, xonstatId=%s, chattype=%s", user, xonstatId, chattype)
@@ -735,12 +879,11 @@ class DatabaseConnector:
         discord_name: str = ""
         matrix_name: str = ""
 
-        db.connect()
         if xonstatId and xonstatId.isdigit():
+            pl: Players = None
             try:
                 xonstatscoloredname, xonstatsname = get_statsnames(xonstatId)
                 
-                pl = None
                 if xonstatsname is None:
                     error_result = "No Player with this ID"
                 else:
@@ -853,9 +996,11 @@ class DatabaseConnector:
             except Exception as e:
                 db_logger.error("Error in command_register: ", e, "Reason: ", e.args)
                 error_result = "Problem with XonStats"
+            self.players.invalidate_name(chattype, user if type(user)==str else user.name)
+            self.players.invalidate_player(pl)
+            self.__refresh_active_players()
         else:
             error_result = "No ID given!"
-        db.close()
         db_logger.info("statsMatrixName=%s", matrix_name)
         return error_result, discord_name, irc_name, matrix_name
     
@@ -865,47 +1010,68 @@ class DatabaseConnector:
         player = None
         error_result: str = ""
 
-        db.connect()
         #check where user renewed from
         player = self.__get_player(user, chattype)
 
-        #check if player is already in database
+        #check if player is already in a pickup game
         if player is not None:
-            gameentries = PickupEntries.select().join(PickupGames).where(PickupGames.isPlayed == False).where(PickupEntries.playerId == player)
+            gameentries = self.state.get_player_entries(player.id)
         
         #send message if theres is no active pickup game
-        if player is None or not gameentries.exists():
+        if not gameentries:
             error_result = "No game added!"
 
         #!renew without gametype, renew all pickups of player
-        if not gametypes:
-            for gameentry in gameentries:
-                gameentry.isWarned = False
-                gameentry.addedDate = datetime.now()
-                gameentry.save()
+        elif not gametypes:
+            self.__renew_entries(gameentries)
 
         #just renews gametypes that are given
         #example: !renew duel
         else:
-            for gtypeentries in gametypes:
-                gtype = GameTypes.select().where(GameTypes.title == gtypeentries).first()
-                if gtype is not None: 
-                    gameentry = gameentries.select().where(PickupEntries.gameId == gtype.id).first()
-                    gameentry.isWarned = False
-                    gameentry.addedDate = datetime.now()
-                    gameentry.save()
-
-        db.close()
+            self.__renew_entries([gameentry for gameentry in gameentries if gameentry.gameId.title in gametypes])
+
         return error_result
     
     def set_irc_nickname(self, oldnick:str, newnick:str):
         db_logger.info("set_irc_nickname: oldnick=%s, newnick=%s", oldnick, newnick)
-        db.connect()
         pl = Players.select().where(Players.ircName == oldnick).first()
         if pl is not None:
             pl.ircName = newnick
             pl.save()
-        db.close()
+            self.state.update_player(pl)
+        self.players.invalidate_name(ChatType.IRC.value, oldnick)
+        self.players.invalidate_name(ChatType.IRC.value, newnick)
+        self.players.invalidate_player(pl)
+
+    def start_expiry_scheduler(self, warntime: int, deletetime: int, clock=datetime.now) -> ExpiryScheduler:
+        #warntime/deletetime in seconds (settings: pugtimewarning, pugtimeout), clock can be a VirtualClock.now
+        scheduler = ExpiryScheduler(warntime, deletetime, clock)
+        self.state.attach_scheduler(scheduler)
+        return scheduler
+
+    def restore_active_games(self, deletetime: int) -> list[str]:
+        #warm start: removes the entries that timed out while the bot was offline and the games left empty
+        #returns the names of the removed players, the remaining entries keep their place and added time
+        db_logger.info("restore_active_games: deletetime=%s", deletetime)
+        cutoff = datetime.now() - timedelta(seconds=deletetime)
+        expired_players: list[str] = []
+
+        with db.atomic():
+            stale_entries = [entry for entry in self.state.get_entries() if entry.addedDate <= cutoff]
+            if stale_entries:
+                PickupEntries.delete().where(PickupEntries.id << [entry.id for entry in stale_entries]).execute()
+                for entry in stale_entries:
+                    self.state.remove_entry(entry.playerId.id, entry.gameId.title)
+                    name = self.__get_chat_name(entry)
+                    if name and name not in expired_players:
+                        expired_players.append(name)
+            self.__delete_all_pickupgames_without_entries()
+        db_logger.info("restore_active_games: %d games restored, %d entries expired", len(self.state.get_games()), len(stale_entries))
+        return expired_players
+
+    def set_expiry_listener(self, listener):
+        #listener() is called when the next warn or expire deadline changed (entries added, renewed or removed)
+        self.state.scheduler.set_listener(listener)
 
     def start_pickupgame(self, gametypetitle:str) -> str:
         db_logger.info("start_pickupgame: gametypetitle=%s", gametypetitle)
@@ -913,19 +1079,25 @@ class DatabaseConnector:
         error_message: str = ""
         found_match = {}
 
-        db.connect()
-        active_games: PickupGames = self.__get_active_games()
-        if active_games.exists():
-            starting_game = active_games.join(GameTypes).where(GameTypes.title == gametypetitle).first()
+        if self.state.has_active_games():
+            starting_game = self.state.get_game(gametypetitle)
             if starting_game:
-                result = True
-                found_match = self.__get_found_matchtext(starting_game, True)
+                try:
+                    with db.atomic():
+                        found_match = self.__get_found_matchtext(starting_game, True)
+                    result = True
+                except Exception as e:
+                    db_logger.error("Something wrong with start_pickupgame: %s", e)
+                    #transaction got rolled back, so roll back the in-memory state too
+                    self.state.load()
+                    found_match = {}
+                    error_message = "Something went wrong, the game was not started. Please try again!"
+                self.__add_teamtext(found_match)
             else:
                 error_message = "No active pickup game found for gametype: " + gametypetitle
         else:
             error_message = "No active pickup game found!"
 
-        db.close()
         return result, error_message, found_match
 
     def withdraw_player_from_pickup(self, user, gametypes:list[str] = None, chattype = None) -> bool:
@@ -933,7 +1105,6 @@ class DatabaseConnector:
         player = None
         result: bool = False
 
-        db.connect()
 
         #check where user removed from
         player = self.__get_player(user, chattype)
@@ -948,7 +1119,6 @@ class DatabaseConnector:
             for gametype in gametypes:
                 result = self.__withdraw_player_from_gametype(player, gametype)
 
-        db.close()
         if result:
             self.delete_games_without_player()
         return result
@@ -960,7 +1130,6 @@ class DatabaseConnector:
         discord_name: str = ""
         matrix_name: str = ""
 
-        db.connect
         player: Players = self.__get_player(user, chattype)
         if player:
             irc_name = player.ircName
@@ -968,6 +1137,7 @@ class DatabaseConnector:
             matrix_name = player.matrixName
             player.shouldBridge = not player.shouldBridge
             player.save()
-        db.close()
+            self.state.update_player(player)
+            self.players.invalidate_player(player)
         return irc_name, discord_name, matrix_name
             
\ No newline at end of file
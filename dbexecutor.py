@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import wraps
+from utils import create_logger
+
+executor_logger = create_logger("dbExecutor")
+
+class DatabaseExecutor:
+    """
+    Runs all database work on one dedicated writer thread.
+        The IRC and timer threads block on the returned future, the asyncio transports (Discord, Matrix)
+        await it, so every operation is serialized in submit order and the event loop never waits on SQLite
+        or XonStats. Calls coming from the writer thread itself run inline instead of deadlocking on the queue.
+    """
+    def __init__(self, name: str = "dbWriter"):
+        self.__pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.__thread_id: int = self.__pool.submit(threading.get_ident).result()
+
+    def in_writer_thread(self) -> bool:
+        return threading.get_ident() == self.__thread_id
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if not self.in_writer_thread():
+            return self.__pool.submit(fn, *args, **kwargs)
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        #blocking call for threads (IRC, timer)
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run(self, fn, *args, **kwargs):
+        #awaitable call for the asyncio transports
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        executor_logger.info("Shutting down database executor")
+        self.__pool.shutdown(wait=wait)
+
+class DatabaseProxy:
+    """
+    Stands in for an object that lives on the writer thread, usually the DatabaseConnector.
+        The object is created on the writer thread (so its SQLite connection belongs there) and
+        every method call is forwarded through DatabaseExecutor.call.
+    """
+    def __init__(self, executor: DatabaseExecutor, factory, *args, **kwargs):
+        self.executor = executor
+        self.target = executor.call(factory, *args, **kwargs)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+
+        @wraps(attribute)
+        def forward(*args, **kwargs):
+            return self.executor.call(attribute, *args, **kwargs)
+        return forward
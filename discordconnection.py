@@ -4,6 +4,8 @@ import asyncio
 from chattype import ChatType
 from utils import create_logger
 from xonotic.utils import strip_irc_colors
+from memberindex import MentionIndex, OnlineMembers, NameCache
+from gametypecatalog import GametypeCatalog
 
 # Based on discordc.py from https://github.com/milandamen/Discord-IRC-Python
 
@@ -21,6 +23,10 @@ client = discord.Client(intents=intents)
 server = None
 channel = None
 bot = None
+mention_index = MentionIndex()
+online_members = OnlineMembers()
+role_cache = NameCache()
+member_cache = NameCache()
 
 class DiscordConnector:
     def __init__(self, sett, fbot):
@@ -33,17 +39,23 @@ class DiscordConnector:
         if not settings["token"]:
             logger.error("[Discord] No token given. Get a token at https://discordapp.com/developers/applications/me")
             exit()
+
+        #roles for new gametypes are created right away, see create_gametype_roles_async
+        bot.dbconnect.add_gametype_listener(self.on_gametype_change)
+
+    def on_gametype_change(self, event, gametype):
+        global client
+        if event == GametypeCatalog.ADDED and server is not None:
+            asyncio.run_coroutine_threadsafe(create_gametype_roles_async([gametype.title]), client.loop)
     
     def send_my_message(self, message):
         global client
-        asyncio.run_coroutine_threadsafe(send_my_message_async(message), client.loop)
+        return asyncio.run_coroutine_threadsafe(send_my_message_async(message), client.loop)
 
     def send_my_message_with_mention(self, message):
         global client
-        for user in channel.guild.members:
-            if message.find('@' + user.name) != -1:
-                message = message.replace('@' + user.name, user.mention)
-        asyncio.run_coroutine_threadsafe(send_my_message_async(message), client.loop)
+        message = mention_index.rewrite(message)
+        return asyncio.run_coroutine_threadsafe(send_my_message_async(message), client.loop)
 
     def send_my_file(self, path):
         global client
@@ -52,30 +64,28 @@ class DiscordConnector:
     def send_promote_message(self, message, gametype):
         global client
         role_name:str = "player_" + gametype
-        role = discord.utils.get(channel.guild.roles, name=role_name)
+        role = role_cache.get(role_name)
         if role:
-            message = role.mention + " " + (message)
+            message = role.mention + " " + strip_irc_colors(message).strip()
             asyncio.run_coroutine_threadsafe(send_my_message_async(message), client.loop)
 
     def give_role(self, username, gametype):
         global client
-        user = discord.utils.get(channel.guild.members, name=username)
+        user = member_cache.get(username)
         rolename = "player_" + gametype
         asyncio.run_coroutine_threadsafe(give_role_async(user, rolename), client.loop)        
 
     def take_role(self, username, gametype):
         global client
-        user = discord.utils.get(channel.guild.members, name=username)
+        user = member_cache.get(username)
         rolename = "player_" + gametype
         asyncio.run_coroutine_threadsafe(take_role_async(user, rolename), client.loop)  
 
     def get_online_members(self):
-        online_members = []
-        for user in channel.guild.members:
-            if str(user.status) != "offline":
-                online_members.append(user.name)
-        online_members.sort()
-        return online_members
+        return list(online_members.snapshot())
+
+    def is_online_member(self, name) -> bool:
+        return online_members.is_online(name)
     
     def run(self):
         global settings
@@ -90,29 +100,40 @@ class DiscordConnector:
         asyncio.run_coroutine_threadsafe(client.close(), client.loop)
 
 async def send_my_message_async(message):
-    colorless_message = strip_irc_colors(message)
-    await channel.send(colorless_message.strip())
+    #message is already rendered for discord (irc colours stripped, see BroadcastMessage.get_discord)
+    await channel.send(message)
 
 async def send_my_file_async(path):
     await channel.send(file=discord.File(path))
 
 async def give_role_async(user, rolename):
-    role = discord.utils.get(channel.guild.roles, name=rolename)
-    if role:
+    role = role_cache.get(rolename)
+    try:
+        if not role:
+            role = await channel.guild.create_role(name=rolename)
+            role_cache.put(role)
         await user.add_roles(role)
-    else:
-        try:
-            await channel.guild.create_role(name=rolename)
-            role = discord.utils.get(channel.guild.roles, name=rolename)
-            await user.add_roles(role)
-        except Exception as e:
-            logger.error("Error in give_role_async: ", e)
+    except Exception as e:
+        logger.error("Error in give_role_async: %s", e)
 
 async def take_role_async(user, rolename):
-    role = discord.utils.get(channel.guild.roles, name=rolename)
+    role = role_cache.get(rolename)
     if role:
         await user.remove_roles(role)
     
+async def create_gametype_roles_async(titles):
+    #creates the missing player_<gametype> roles, so promote and subscribe only need cache lookups
+    for title in titles:
+        rolename = "player_" + title
+        if role_cache.get(rolename) is None:
+            try:
+                role_cache.put(await server.create_role(name=rolename))
+                logger.info("[Discord] Created role %s", rolename)
+            except Exception as e:
+                #try the other roles anyway, the missing one is created on the next start
+                logger.error("Error in create_gametype_roles_async: role %s: %s", rolename, e)
+                continue
+    
 @client.event
 async def on_message(message):
     global settings
@@ -148,20 +169,59 @@ async def on_message(message):
 
     if message.content.startswith('!'):
         if settings["modrole"] in [y.name.lower() for y in message.author.roles]:
-            bot.send_command(message.author, message.content, ChatType.DISCORD.value, True)
+            await bot.send_command_async(message.author, message.content, ChatType.DISCORD.value, True)
         else:
-            bot.send_command(message.author, message.content, ChatType.DISCORD.value, False)
+            await bot.send_command_async(message.author, message.content, ChatType.DISCORD.value, False)
 
 @client.event
 async def on_presence_update(before, after):
     global settings
+    if after.guild == server:
+        online_members.update(after.name, after.status.name != "offline")
     if after.status.name == "offline":
-        bot.remove_user_on_exit(after, "discord")
+        await bot.dbexecutor.run(bot.remove_user_on_exit, after, "discord")
         if settings["presence-update"]:
             bot.send_all(message="- @%s (%s) is now offline -" % (after.name, after.display_name), chattype=ChatType.DISCORD.value)
     if before.status.name == "offline" and settings["presence-update"]:
         bot.send_all(message="- @%s (%s) is now online -" % (after.name, after.display_name), chattype=ChatType.DISCORD.value)
 
+@client.event
+async def on_member_join(member):
+    if member.guild == server:
+        mention_index.add(member.name, member.mention)
+        online_members.update(member.name, str(member.status) != "offline")
+        member_cache.put(member)
+
+@client.event
+async def on_member_remove(member):
+    if member.guild == server:
+        mention_index.remove(member.name)
+        online_members.update(member.name, False)
+        member_cache.remove(member)
+
+@client.event
+async def on_user_update(before, after):
+    if before.name != after.name and server is not None and server.get_member(after.id) is not None:
+        mention_index.remove(before.name)
+        mention_index.add(after.name, after.mention)
+        online_members.rename(before.name, after.name)
+        member_cache.rename(before.name, server.get_member(after.id))
+
+@client.event
+async def on_guild_role_create(role):
+    if role.guild == server:
+        role_cache.put(role)
+
+@client.event
+async def on_guild_role_delete(role):
+    if role.guild == server:
+        role_cache.remove(role)
+
+@client.event
+async def on_guild_role_update(before, after):
+    if after.guild == server:
+        role_cache.rename(before.name, after)
+
 @client.event
 async def on_ready():
     global server
@@ -225,3 +285,10 @@ async def on_ready():
         return
     
     channel = findChannel[0]
+    mention_index.load(server.members)
+    online_members.load(server.members)
+    member_cache.load(server.members)
+    role_cache.load(server.roles)
+    logger.info("[Discord] Indexed %d members for mentions, %d online, %d roles", len(mention_index), len(online_members), len(role_cache))
+    await create_gametype_roles_async(await bot.dbexecutor.run(bot.dbconnect.get_gametype_list))
+    bot.post_restored_state(ChatType.DISCORD.value)
@@ -0,0 +1,128 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+from utils import create_logger
+
+scheduler_logger = create_logger("expiryScheduler")
+
+class VirtualClock:
+    # Clock for tests and benchmarks, time only moves with advance()
+    def __init__(self, start: datetime = None):
+        self.current = start if start is not None else datetime(2024, 1, 1)
+
+    def now(self) -> datetime:
+        return self.current
+
+    def advance(self, seconds: float) -> datetime:
+        self.current += timedelta(seconds=seconds)
+        return self.current
+
+class ExpiryScheduler:
+    """
+    Min-heap of the warn and expire deadlines of all active pickup entries.
+        Every (re)schedule pushes new deadlines and bumps the generation of the entry,
+        outdated heap items are skipped when they reach the top (lazy invalidation),
+        so adds, renews and removes cost O(log n) and a tick only looks at due deadlines.
+        Entries need the attributes id, addedDate and isWarned (see pickupstate.ActiveEntry).
+        The listener is called whenever the earliest deadline changed, so a sleeping timer can wake up.
+    """
+    WARN = 0
+    EXPIRE = 1
+
+    def __init__(self, warntime: int, deletetime: int, clock=datetime.now):
+        self.warntime = timedelta(seconds=warntime)
+        self.deletetime = timedelta(seconds=deletetime)
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.heap: list[tuple] = []
+        self.entries: dict[int, tuple[int, object]] = {}
+        self.generation: int = 0
+        self.listener = None
+
+    def set_listener(self, listener):
+        #listener() is called from the thread that changed the schedule, it must not block
+        self.listener = listener
+
+    def now(self) -> datetime:
+        return self.clock()
+
+    def schedule(self, entry):
+        #(re)schedules the deadlines of an entry, called on add and renew
+        with self.lock:
+            earliest = self.next_deadline()
+            self.generation += 1
+            self.entries[entry.id] = (self.generation, entry)
+            if not entry.isWarned:
+                heapq.heappush(self.heap, (entry.addedDate + self.warntime, self.WARN, self.generation, entry.id))
+            heapq.heappush(self.heap, (entry.addedDate + self.deletetime, self.EXPIRE, self.generation, entry.id))
+            self.__compact()
+            #a new entry or a renew of the entry at the top can move the earliest deadline
+            if self.next_deadline() != earliest:
+                self.__notify()
+
+    def unschedule(self, entry_id: int):
+        with self.lock:
+            is_first = bool(self.heap) and self.heap[0][3] == entry_id
+            if self.entries.pop(entry_id, None) is not None and is_first:
+                self.__notify()
+
+    def clear(self):
+        with self.lock:
+            self.heap.clear()
+            self.entries.clear()
+            self.__notify()
+
+    def next_deadline(self) -> datetime:
+        #earliest valid deadline or None if nothing is scheduled
+        with self.lock:
+            while self.heap and not self.__is_valid(self.heap[0]):
+                heapq.heappop(self.heap)
+            return self.heap[0][0] if self.heap else None
+
+    def seconds_until_next(self) -> float:
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        return max((deadline - self.now()).total_seconds(), 0)
+
+    def pop_due(self, now: datetime = None) -> tuple[list, list]:
+        #returns (entries to warn, entries to expire) whose deadlines passed, oldest first
+        now = self.now() if now is None else now
+        warn_entries = []
+        expire_entries = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                item = heapq.heappop(self.heap)
+                if not self.__is_valid(item):
+                    continue
+                generation, entry = self.entries[item[3]]
+                if item[1] == self.EXPIRE:
+                    del self.entries[entry.id]
+                    expire_entries.append(entry)
+                else:
+                    warn_entries.append(entry)
+        #an entry that expires in the same tick doesn't need a warning anymore
+        if expire_entries and warn_entries:
+            expired = set(entry.id for entry in expire_entries)
+            warn_entries = [entry for entry in warn_entries if entry.id not in expired]
+        return warn_entries, expire_entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __notify(self):
+        if self.listener is not None:
+            try:
+                self.listener()
+            except Exception as e:
+                scheduler_logger.error("Something wrong with expiry listener: %s", e)
+
+    def __is_valid(self, item: tuple) -> bool:
+        scheduled = self.entries.get(item[3])
+        return scheduled is not None and scheduled[0] == item[2]
+
+    def __compact(self):
+        #rebuild the heap once outdated items dominate it (many renews/removes)
+        if len(self.heap) > 64 and len(self.heap) > 4 * len(self.entries):
+            self.heap = [item for item in self.heap if self.__is_valid(item)]
+            heapq.heapify(self.heap)
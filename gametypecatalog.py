@@ -0,0 +1,71 @@
+import threading
+from model import GameTypes
+from utils import create_logger
+
+catalog_logger = create_logger("gametypeCatalog")
+
+class GametypeCatalog:
+    """
+    In-process copy of the GameTypes table, indexed by title and id.
+        Loaded once at startup and only changed through add/remove (!addgametype, !removegametype).
+        Listeners are called with ("added" | "removed", gametype) after every change.
+    """
+    ADDED = "added"
+    REMOVED = "removed"
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.by_title: dict[str, GameTypes] = {}
+        self.by_id: dict[int, GameTypes] = {}
+        self.listeners: list = []
+
+    def load(self):
+        #(re)reads all gametypes, needs an open connection
+        with self.lock:
+            self.by_title.clear()
+            self.by_id.clear()
+            if not GameTypes.table_exists():
+                return
+            for gametype in GameTypes.select().order_by(GameTypes.id):
+                self.__index(gametype)
+            catalog_logger.info("Loaded %d gametypes", len(self.by_id))
+
+    def get(self, title: str) -> GameTypes:
+        return self.by_title.get(title)
+
+    def get_by_id(self, gametype_id: int) -> GameTypes:
+        return self.by_id.get(gametype_id)
+
+    def get_all(self) -> list[GameTypes]:
+        #in order of creation, like iterating the table
+        with self.lock:
+            return list(self.by_id.values())
+
+    def get_titles(self) -> list[str]:
+        return [gametype.title for gametype in self.get_all()]
+
+    def add(self, gametype: GameTypes):
+        with self.lock:
+            self.__index(gametype)
+        self.__notify(self.ADDED, gametype)
+
+    def remove(self, gametype: GameTypes):
+        with self.lock:
+            self.by_title.pop(gametype.title, None)
+            self.by_id.pop(gametype.id, None)
+        self.__notify(self.REMOVED, gametype)
+
+    def add_listener(self, listener):
+        #listener(event, gametype), for example to keep discord roles in sync
+        self.listeners.append(listener)
+
+    def __index(self, gametype: GameTypes):
+        self.by_title[gametype.title] = gametype
+        self.by_id[gametype.id] = gametype
+
+    def __notify(self, event: str, gametype: GameTypes):
+        for listener in self.listeners:
+            try:
+                listener(event, gametype)
+            except Exception as e:
+                catalog_logger.error("Error in gametype listener: %s", e)
@@ -2,13 +2,16 @@ from chattype import ChatType
 import threading
 import random
 from datetime import datetime
-import time
 from ircconnection import IrcConnector
 from discordconnection import DiscordConnector, client
 from dbconnection import DatabaseConnector
+from dbexecutor import DatabaseExecutor, DatabaseProxy
+from outbox import Outbox, merge_lines
 from matrixconnection import MatrixConnector
+from broadcast import BroadcastMessage
 from xonotic.utils import get_quote
 from utils import create_logger, sanitize_ip_and_port, is_ipv4_address, is_ipv6_address
+from functools import partial
 import asyncio
 
 logger = create_logger(__name__)
@@ -16,6 +19,7 @@ logger = create_logger(__name__)
 class Greedybot:
     def __init__(self, settings, cmdresults, xonotic):
         self.pickupText = "Pickups: "
+        self.pickupTextVersion = None
         self.picktimer = None
         self.settings = settings
         self.cmdresults = cmdresults
@@ -23,17 +27,42 @@ class Greedybot:
         self.ircconnect = None
         self.discordconnect = None
         self.topic = ""
-        self.dbconnect = DatabaseConnector(self.settings["database"]["filename"])        
+        self.outboxes: dict[str, Outbox] = {}
+        self.dbexecutor = DatabaseExecutor()
+        self.warmStart: bool = self.settings["database"].get("warmstart", False)
+        self.dbconnect = DatabaseProxy(self.dbexecutor, DatabaseConnector, self.settings["database"]["filename"], self.settings["database"].get("archiveage", 0), self.warmStart)
+        self.restoredPlayers: list[str] = []
+        self.restoredPosted: set[str] = set()
+        if self.warmStart:
+            self.restoredPlayers = self.dbconnect.restore_active_games(self.settings["bot"]["pugtimeout"])
+            self.pickupTextVersion, pickuptext = self.dbconnect.get_pickuptext_version()
+            if pickuptext:
+                self.pickupText = "Pickups: " + pickuptext
+        self.dbconnect.start_expiry_scheduler(self.settings["bot"]["pugtimewarning"], self.settings["bot"]["pugtimeout"])
         self.muted_discord_users = []
         self.muted_irc_users = []
         self.muted_matrix_users = []
         self.muted_discord_users, self.muted_irc_users, self.muted_matrix_users = self.dbconnect.get_unbridged_players()
 
     async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.pugtimer_wakeup = asyncio.Event()
+        self.dbconnect.set_expiry_listener(self.wake_pugtimer)
+        self.picktimer = asyncio.create_task(self.start_pugtimer())
         self.irc_enabled: bool = ChatType.IRC.value in self.settings
         self.discord_enabled: bool = ChatType.DISCORD.value in self.settings
         self.matrix_enabled: bool = ChatType.MATRIX.value in self.settings
-        
+
+        #every chat gets its own outbox with a sender task on this loop, send_all only queues the messages
+        outboxsize = self.settings["bot"].get("outboxsize", 100)
+        if self.irc_enabled:
+            self.outboxes[ChatType.IRC.value] = Outbox(ChatType.IRC.value, self.deliver_irc, outboxsize)
+        if self.discord_enabled:
+            self.outboxes[ChatType.DISCORD.value] = Outbox(ChatType.DISCORD.value, self.deliver_discord, outboxsize, merge_lines(2000))
+        if self.matrix_enabled:
+            #lines are merged into html events by the room queue of the matrix connector
+            self.outboxes[ChatType.MATRIX.value] = Outbox(ChatType.MATRIX.value, self.deliver_matrix, outboxsize)
+
         if self.irc_enabled:
             self.ircconnect = IrcConnector(self.settings[ChatType.IRC.value], self)
             t1 = threading.Thread(target=self.ircconnect.run)
@@ -48,72 +77,113 @@ class Greedybot:
             self.matrixconnect = MatrixConnector(self.settings[ChatType.MATRIX.value], self)
             self.matrix_task = asyncio.create_task(self.matrixconnect.start())
 
-        if self.discord_enabled and self.matrix_enabled:
-            await asyncio.gather(self.discord_task, self.matrix_task)
-            # await self.discord_task
-            # await self.matrix_task
-        elif self.discord_enabled:
-            await self.discord_task
-        elif self.matrix_enabled:
-            await self.matrix_task
+        #one timer service for the whole runtime, keeps the bot alive in irc-only mode as well
+        tasks = [self.picktimer]
+        if self.discord_enabled:
+            tasks.append(self.discord_task)
+        if self.matrix_enabled:
+            tasks.append(self.matrix_task)
+        await asyncio.gather(*tasks)
 
     def close(self):
+        if self.picktimer is not None:
+            self.picktimer.cancel()
         if self.discord_enabled:
             self.discord_task.cancel()
         if self.matrix_enabled:
             self.matrix_task.cancel()
         if self.irc_enabled:
             self.ircconnect.close()
+        for outbox in self.outboxes.values():
+            outbox.close()
+        self.dbexecutor.shutdown(wait=False)
     
-    def start_pugtimer(self):
-        #background timer to warn players of expiring pickup games or deletes old pickup games
-        warntime = self.settings["bot"]["pugtimewarning"]
-        deletetime = self.settings["bot"]["pugtimeout"]
+    async def start_pugtimer(self):
+        #timer service on the event loop, sleeps until the next warn or expire deadline of the expiry scheduler
+        #or until the schedule changes (see wake_pugtimer)
         while True:
-            mindiff = warntime
-            currenttime = datetime.now()      
-            if self.dbconnect.has_active_games(): #pugentries.exists():
+            self.pugtimer_wakeup.clear()
+            try:
+                delay = await self.dbexecutor.run(self.pugtimer_tick)
+            except Exception as e:
+                logger.error("Something wrong with pugtimer: %s", e)
+                delay = None
+            try:
+                await asyncio.wait_for(self.pugtimer_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
 
-                mindiff, has_break, has_new_text, warn_user = self.dbconnect.pugtimer_step(mindiff, currenttime, deletetime, warntime)
-                
-                #player was over the time and got remove from game
-                if has_new_text:
-                    self.build_pickuptext()
+    def wake_pugtimer(self):
+        #listener of the expiry scheduler, called from the database thread
+        self.loop.call_soon_threadsafe(self.pugtimer_wakeup.set)
 
-                #player gets notified: "Your added games will expire in 20 minutes, type !renew to renew your games"
-                if warn_user:
-                    if warn_user["chattype"] == ChatType.IRC.value:
-                        self.send_notice(warn_user["user"], warn_user["user"] + " " + self.cmdresults["misc"]["pugtimewarn"], warn_user["chattype"])
-                    elif warn_user["chattype"] == ChatType.DISCORD.value:
-                        self.send_notice(None, warn_user["user"] + " " + self.cmdresults["misc"]["pugtimewarn"], warn_user["chattype"])
-                    elif warn_user["chattype"] == ChatType.MATRIX.value:
-                        self.send_notice(None, warn_user["user"] + " " + self.cmdresults["misc"]["pugtimewarn"], warn_user["chattype"])
-                        pass
-                    else:
-                        logger.error("Unknown chattype: ", warn_user["chattype"])
-                if has_break:
-                    break
-                if not self.dbconnect.has_active_games():
-                    return
-                else:
-                    time.sleep(mindiff)
+    def pugtimer_tick(self) -> float:
+        #warns players of expiring pickup games or deletes old pickup entries, returns seconds until the next deadline
+        delay, has_new_text, warn_users, expired_players = self.dbconnect.pugtimer_step()
+
+        #players were over the time and got removed from their games, announced in one message
+        if expired_players:
+            self.send_all(self.cmdresults["misc"]["pugtimeout"].format(", ".join(expired_players)))
+        if has_new_text:
+            self.build_pickuptext()
+
+        #players get notified together, one message per chat: "@a @b Your added games will expire in 20 minutes, type !renew to renew your games"
+        warned_users = {ChatType.IRC.value: [], ChatType.DISCORD.value: [], ChatType.MATRIX.value: []}
+        for warn_user in warn_users:
+            if warn_user["chattype"] in warned_users:
+                warned_users[warn_user["chattype"]].append(warn_user["user"])
             else:
-                return
+                logger.error("Unknown chattype: %s", warn_user["chattype"])
+        if warned_users[ChatType.IRC.value]:
+            self.send_group_notice(warned_users[ChatType.IRC.value], self.cmdresults["misc"]["pugtimewarn"])
+        for chattype in (ChatType.DISCORD.value, ChatType.MATRIX.value):
+            if warned_users[chattype]:
+                self.send_notice(None, " ".join(warned_users[chattype]) + " " + self.cmdresults["misc"]["pugtimewarn"], chattype)
+        return delay
 
     def set_irc_topic(self):
         #sets the current pickups as irc topic
         logger.info("set_irc_topic")
         try:
             if  self.pickupText != "Pickups: ":
-                self.ircconnect.connection.topic(self.settings[ChatType.IRC.value]["channel"], new_topic=self.pickupText)
+                self.ircconnect.set_topic(self.pickupText)
             else:
-                self.ircconnect.connection.topic(self.settings[ChatType.IRC.value]["channel"], new_topic=self.topic)
+                self.ircconnect.set_topic(self.topic)
         except Exception as e:
             logger.error("Something wrong with topic: ", e)
     
+    def post_restored_state(self, chattype):
+        #after a warm start every chat gets the restored pickups once, called by the connectors when they are ready
+        if not self.warmStart or chattype in self.restoredPosted:
+            return
+        self.restoredPosted.add(chattype)
+        logger.info("post_restored_state: chattype=%s", chattype)
+        messages = []
+        if self.pickupText != "Pickups: ":
+            messages.append(self.cmdresults["misc"]["pugrestored"].format(self.pickupText))
+        if self.restoredPlayers:
+            messages.append(self.cmdresults["misc"]["pugtimeout"].format(", ".join(self.restoredPlayers)))
+        for message in messages:
+            if chattype == ChatType.IRC.value and self.irc_enabled:
+                self.post_irc(message)
+            elif chattype == ChatType.DISCORD.value and self.discord_enabled:
+                self.post_discord(message)
+            elif chattype == ChatType.MATRIX.value and self.matrix_enabled:
+                self.post_matrix(message)
+        if chattype == ChatType.IRC.value and messages:
+            self.set_irc_topic()
+
     def send_command(self, user, argument, chattype, isadmin):
-        #forwards commands from irc/discord to bot specific command
-        logger.info("send_command: user=%s, argument=%s, chattype=%s, isadmin=%s", user, argument, chattype, isadmin)
+        #forwards commands from irc to the database writer thread and waits for them
+        self.dbexecutor.call(self.run_command, user, argument, chattype, isadmin)
+
+    async def send_command_async(self, user, argument, chattype, isadmin):
+        #forwards commands from discord/matrix to the database writer thread without blocking the event loop
+        await self.dbexecutor.run(self.run_command, user, argument, chattype, isadmin)
+
+    def run_command(self, user, argument, chattype, isadmin):
+        #runs the bot specific command, always on the database writer thread
+        logger.info("run_command: user=%s, argument=%s, chattype=%s, isadmin=%s", user, argument, chattype, isadmin)
         argument = argument.split()
         method_name = 'command_' + str(argument[0][1:].lower())
         method = getattr(self, method_name, self.wrong_command)
@@ -123,58 +193,86 @@ class Greedybot:
             self.send_notice(user, "Sorry, something went wrong", chattype)
             logger.error("Error in command:", e)
 
+    def post_irc(self, message, messagehead = None):
+        self.post_irc_action(self.ircconnect.send_my_message, message, messagehead)
+
+    def post_irc_action(self, action, *args):
+        #irc messages are queued as calls of the irc connector, they can't be merged
+        self.outboxes[ChatType.IRC.value].post(partial(action, *args))
+
+    def post_discord(self, message, mention = False):
+        #message: str or BroadcastMessage, queued rendered for discord
+        if not isinstance(message, BroadcastMessage):
+            message = BroadcastMessage(message)
+        self.outboxes[ChatType.DISCORD.value].post((message.get_discord(), mention))
+
+    def post_matrix(self, message, html = False):
+        #message: str or BroadcastMessage (which brings its own html flag), queued with body and formatted body
+        if not isinstance(message, BroadcastMessage):
+            message = BroadcastMessage(message, matrix_html=html)
+        body, formatted = message.get_matrix()
+        self.outboxes[ChatType.MATRIX.value].post((body, message.matrix_html, formatted))
+
+    async def deliver_irc(self, action):
+        #only queues the lines, the irc reactor sends them (see IrcConnector.flush_lines)
+        action()
+
+    async def deliver_discord(self, item):
+        #waits for the message to be sent, so the outbox keeps the order and fills up if discord is slow
+        message, mention = item
+        if mention:
+            await asyncio.wrap_future(self.discordconnect.send_my_message_with_mention(message))
+        else:
+            await asyncio.wrap_future(self.discordconnect.send_my_message(message))
+
+    async def deliver_matrix(self, item):
+        #waits until the room queue accepted the message, the queue itself keeps the order and handles rate limits
+        message, html, formatted = item
+        await self.matrixconnect.send_my_message_async(message, html, formatted)
+
+    def get_outbox_stats(self) -> dict:
+        #queue depth and counters per chat, e.g. {"irc": {"depth": 0, "sent": 12, "merged": 0, "waited": 0, "failed": 0}}
+        return {chattype: outbox.get_stats() for chattype, outbox in self.outboxes.items()}
+
     def send_notice(self, user, message, chattype):
         #sends message to only discord or to specific irc-user (for future: send direct message to discord-user)
         logger.info("send_notice: user=%s, message=%s, chattype=%s", user, message, chattype)
         if chattype == ChatType.IRC.value and self.irc_enabled:
-            self.ircconnect.send_single_message(user,message)
+            self.post_irc_action(self.ircconnect.send_single_message, user, message)
         elif chattype == ChatType.DISCORD.value and self.discord_enabled:
-            self.discordconnect.send_my_message(message)
+            self.post_discord(message)
         elif chattype == ChatType.MATRIX.value and self.matrix_enabled:
-            self.matrixconnect.send_my_message(message, True)
+            self.post_matrix(message, True)
         else:
             logger.error("Unknown chattype: ", chattype)
 
+    def send_group_notice(self, users: list[str], message):
+        #sends one notice to several irc-users
+        logger.info("send_group_notice: users=%s, message=%s", users, message)
+        if self.irc_enabled:
+            self.post_irc_action(self.ircconnect.send_group_notice, users, message)
+
     def send_all(self, message:str, ircmessage:str = None, matrixmessage:str = None, chattype:str = None, messagehead:str = None, discordmention:bool = False, matrix_html: bool = False):
         logger.info("send_all: message=%s, ircmessage=%s, matrixmessage=%s, chattype=%s, messagehead=%s, discordmention=%s", 
                     message, ircmessage, matrixmessage, chattype, messagehead, discordmention)
-        
-        if messagehead:
-            if self.irc_enabled and chattype != ChatType.IRC.value:
-                if ircmessage is not None:
-                    self.ircconnect.send_my_message(ircmessage, messagehead)
-                else:
-                    self.ircconnect.send_my_message(message, messagehead)
-                    
-            if self.matrix_enabled and chattype != ChatType.MATRIX.value:
-                if matrixmessage is not None:
-                    self.matrixconnect.send_my_message(messagehead + matrixmessage, matrix_html)
-                else:
-                    self.matrixconnect.send_my_message(messagehead + message, matrix_html)
-            
-            if self.discord_enabled and chattype != ChatType.DISCORD.value:
-                if discordmention:
-                    self.discordconnect.send_my_message_with_mention(messagehead + message)
-                else:
-                    self.discordconnect.send_my_message(messagehead + message)
+        #rendered once per chat format, the chats without an own variant use message
+        broadcast = BroadcastMessage(message, {ChatType.IRC.value: ircmessage, ChatType.MATRIX.value: matrixmessage}, messagehead, matrix_html)
+
+        if self.irc_enabled and chattype != ChatType.IRC.value:
+            self.post_irc(broadcast.get_text(ChatType.IRC.value), messagehead)
+
+        if self.matrix_enabled and chattype != ChatType.MATRIX.value:
+            self.post_matrix(broadcast)
+
+        if self.discord_enabled and chattype != ChatType.DISCORD.value:
+            self.post_discord(broadcast, discordmention)
+
+    def send_found_match(self, found_match: dict):
+        #announces a ready game, team games come as a list of lines per chat
+        if found_match["has_teams"]:
+            self.send_all("\n".join(found_match[ChatType.DISCORD.value]), "\n".join(found_match[ChatType.IRC.value]), "\n".join(found_match[ChatType.MATRIX.value]), matrix_html=True)
         else:
-            if self.irc_enabled and chattype != ChatType.IRC.value:
-                if ircmessage is not None:
-                    self.ircconnect.send_my_message(ircmessage)
-                else:
-                    self.ircconnect.send_my_message(message)
-                    
-            if self.matrix_enabled and chattype != ChatType.MATRIX.value:
-                if matrixmessage is not None:
-                    self.matrixconnect.send_my_message(matrixmessage, matrix_html)
-                else:
-                    self.matrixconnect.send_my_message(message, matrix_html)
-            
-            if self.discord_enabled and chattype != ChatType.DISCORD.value:
-                if discordmention:
-                    self.discordconnect.send_my_message_with_mention(message)
-                else:
-                    self.discordconnect.send_my_message(message)
+            self.send_all(found_match[ChatType.DISCORD.value], found_match[ChatType.IRC.value], found_match[ChatType.MATRIX.value], matrix_html=True)
 
     def wrong_command(self, user, argument, chattype, isadmin):
         #if user inputs wrong command
@@ -204,21 +302,19 @@ class Greedybot:
         #sends current pickup games to all channels
         #result: "Pickups: duel (1/2) 2v2tdm (1/4)"        
         logger.info("build_pickuptext")   
-        games_exists = self.dbconnect.has_active_games()
-        pickuptext_new = self.dbconnect.get_pickuptext()
-        if not games_exists and self.pickupText == "Pickups: ":
-            self.set_irc_topic()
-            return
-
-        if not games_exists and self.pickupText != "Pickups: ":            
-            self.pickupText = "Pickups: " 
-            self.send_all(self.pickupText)
-            self.set_irc_topic()  
-        else:
-            self.pickupText = "Pickups: "
-            self.pickupText += pickuptext_new
-            self.send_all(self.pickupText)
-            self.set_irc_topic()
+        version, pickuptext_new = self.dbconnect.get_pickuptext_version()
+        if version == self.pickupTextVersion:
+            return self.pickupText
+        self.pickupTextVersion = version
+
+        #skip broadcast and topic if the rendered text is the same (e.g. player left and joined again)
+        pickuptext_new = "Pickups: " + pickuptext_new
+        if pickuptext_new == self.pickupText:
+            return self.pickupText
+
+        self.pickupText = pickuptext_new
+        self.send_all(self.pickupText)
+        self.set_irc_topic()
         return self.pickupText
     """
     Commands for IRC, Discord, and Matrix
@@ -274,16 +370,8 @@ class Greedybot:
         if result:
             # match found ready to notify player 
             if found_match:
-                # match with teams and captains
-                if found_match["has_teams"]:
-                    self.send_all("\n".join(found_match[ChatType.DISCORD.value]), "\n".join(found_match[ChatType.IRC.value]), "\n".join(found_match[ChatType.MATRIX.value]), matrix_html=True)
-                else:
-                    self.send_all(found_match[ChatType.DISCORD.value], found_match[ChatType.IRC.value], found_match[ChatType.MATRIX.value], matrix_html=True)
+                self.send_found_match(found_match)
 
-            #start the background timer to delete old pickup games
-            if self.picktimer is None or not self.picktimer.is_alive():
-                self.picktimer = threading.Thread(target=self.start_pugtimer, daemon=True)
-                self.picktimer.start()
             self.build_pickuptext()
         
         for error_message in error_messages:
@@ -324,16 +412,8 @@ class Greedybot:
             if result:
                 # match found ready to notify player 
                 if found_match:
-                    # match with teams and captains
-                    if found_match["has_teams"]:
-                        self.send_all("\n".join(found_match[ChatType.DISCORD.value]), "\n".join(found_match[ChatType.IRC.value]), "\n".join(found_match[ChatType.MATRIX.value]), matrix_html=True)
-                    else:
-                        self.send_all(found_match[ChatType.DISCORD.value], found_match[ChatType.IRC.value], found_match[ChatType.MATRIX.value], matrix_html=True)
+                    self.send_found_match(found_match)
 
-                #start the background timer to delete old pickup games
-                if self.picktimer is None or not self.picktimer.is_alive():
-                    self.picktimer = threading.Thread(target=self.start_pugtimer, daemon=True)
-                    self.picktimer.start()
                 self.build_pickuptext()
             
             for error_message in error_messages:
@@ -523,10 +603,8 @@ class Greedybot:
                 #victim is real user
                 is_real_irc_user = victim in irc_users
             if self.discord_enabled and not is_real_irc_user:
-                #fill user list with discord
-                discord_users = self.discordconnect.get_online_members()
                 #victim is real user
-                is_real_discord_user = victim in discord_users
+                is_real_discord_user = self.discordconnect.is_online_member(victim)
             if self.matrix_enabled and not is_real_discord_user:
                 #victim is real user
                 is_real_matrix_user = self.matrixconnect.found_user_in_room(victim)                
@@ -540,15 +618,15 @@ class Greedybot:
             else:
                 message:str = random.choice(self.xonotic["kills"]).format(killer, victim)
                 if self.irc_enabled:
-                    self.ircconnect.send_my_message(message)                
+                    self.post_irc(message)                
                 if self.discord_enabled:       
                     if is_real_discord_user:
                         discord_message = message.replace(victim, "@" + victim)
-                        self.discordconnect.send_my_message_with_mention(discord_message)
+                        self.post_discord(discord_message, True)
                     else:
-                        self.discordconnect.send_my_message_with_mention(message)
+                        self.post_discord(message, True)
                 if self.matrix_enabled:
-                    self.matrixconnect.send_my_message(message)
+                    self.post_matrix(message)
         else:
             self.send_all(random.choice(self.xonotic["suicides"]).format(killer))
 
@@ -601,14 +679,14 @@ class Greedybot:
         logger.info("command_online: user=%s, argument=%s, chattype=%s, isadmin=%s", user, argument, chattype, isadmin)
 
         if chattype == ChatType.IRC.value and self.discord_enabled:
-            self.ircconnect.send_my_message("On Discord are online: " + ", ".join(self.discordconnect.get_online_members()))
+            self.post_irc("On Discord are online: " + ", ".join(self.discordconnect.get_online_members()))
         elif chattype == ChatType.DISCORD.value and self.irc_enabled:
-            self.discordconnect.send_my_message("On IRC are online: " + ", ".join(self.ircconnect.get_online_users()))
+            self.post_discord("On IRC are online: " + ", ".join(self.ircconnect.get_online_users()))
         elif chattype == ChatType.MATRIX.value:
             if self.discord_enabled:
-                self.matrixconnect.send_my_message("On Discord are online: " + ", ".join(self.discordconnect.get_online_members()))
+                self.post_matrix("On Discord are online: " + ", ".join(self.discordconnect.get_online_members()))
             if self.irc_enabled:
-                self.matrixconnect.send_my_message("On IRC are online: " + ", ".join(self.ircconnect.get_online_users()))
+                self.post_matrix("On IRC are online: " + ", ".join(self.ircconnect.get_online_users()))
         else:
             logger.error("Unknown chattype: ", chattype)
 
@@ -768,10 +846,7 @@ class Greedybot:
         if gametype:
             result, error_message, found_match = self.dbconnect.start_pickupgame(gametype)
             if result:
-                if found_match["has_teams"]:
-                    self.send_all("\n".join(found_match[ChatType.DISCORD.value]), "\n".join(found_match[ChatType.IRC.value]), "\n".join(found_match[ChatType.MATRIX.value]), matrix_html=True)
-                else:
-                    self.send_all(found_match[ChatType.DISCORD.value], found_match[ChatType.IRC.value], found_match[ChatType.MATRIX.value], matrix_html=True)
+                self.send_found_match(found_match)
                 self.build_pickuptext()
             else:
                 self.send_notice(user, error_message, chattype)
@@ -1,5 +1,8 @@
 import irc.bot
+import re
+import threading
 import time
+from collections import deque
 from chattype import ChatType
 from utils import create_logger
 
@@ -7,12 +10,122 @@ logger = create_logger(__name__)
 
 # Based on ircc.py from https://github.com/milandamen/Discord-IRC-Python
 
+#mIRC formatting: colour (\x03 with optional fg[,bg]), bold, monospace, reverse, italic, strikethrough, underline, reset
+IRC_FORMAT_PATTERN = re.compile(r"\x03(?:\d{1,2}(?:,\d{1,2})?)?|[\x02\x11\x16\x1d\x1e\x1f\x0f]")
+IRC_ATOM_PATTERN = re.compile(IRC_FORMAT_PATTERN.pattern + "|.", re.DOTALL)
+IRC_TRAILING_FORMAT_PATTERN = re.compile("(?:" + IRC_FORMAT_PATTERN.pattern + ")+$")
+IRC_TOGGLES = "\x02\x11\x16\x1d\x1e\x1f"
+IRC_LINE_BYTES = 512
+#queued lines are sent by the reactor thread, at most this many seconds after they were queued
+IRC_FLUSH_INTERVAL = 0.1
+
+class IrcFormatState:
+    # formatting that is active at a position of a message, used to continue it on the next line
+    def __init__(self):
+        self.toggles: list[str] = []
+        self.foreground: str = None
+        self.background: str = None
+
+    def apply(self, code: str):
+        if code == "\x0f":
+            self.__init__()
+        elif code in IRC_TOGGLES:
+            if code in self.toggles:
+                self.toggles.remove(code)
+            else:
+                self.toggles.append(code)
+        elif code == "\x03":
+            self.foreground = self.background = None
+        else:
+            colours = code[1:].split(",")
+            self.foreground = "%02d" % int(colours[0])
+            if len(colours) > 1:
+                self.background = "%02d" % int(colours[1])
+
+    def prefix(self) -> str:
+        result = "".join(self.toggles)
+        if self.foreground is not None:
+            result += "\x03" + self.foreground
+            if self.background is not None:
+                result += "," + self.background
+        return result
+
+def split_irc_message(text: str, max_bytes: int) -> list[str]:
+    #splits text into lines of at most max_bytes (UTF-8) at spaces, words longer than a line are split between characters
+    #formatting codes are never cut and every continuation line starts with the formatting that was active
+    if len(text.encode("utf-8")) <= max_bytes:
+        return [text]
+    lines = []
+    state = IrcFormatState()
+    line = ""
+    line_bytes = 0
+    has_text = False
+
+    def next_line():
+        nonlocal line, line_bytes, has_text
+        if has_text:
+            #formatting at the end of a line is carried by the prefix of the next one
+            lines.append(IRC_TRAILING_FORMAT_PATTERN.sub("", line))
+        line = state.prefix()
+        line_bytes = len(line.encode("utf-8"))
+        has_text = False
+
+    for word in text.split(" "):
+        if has_text and line_bytes + 1 + len(word.encode("utf-8")) > max_bytes:
+            next_line()
+        if has_text:
+            line += " "
+            line_bytes += 1
+        for atom in IRC_ATOM_PATTERN.findall(word):
+            atom_bytes = len(atom.encode("utf-8"))
+            if has_text and line_bytes + atom_bytes > max_bytes:
+                next_line()
+            if not has_text and atom[0] == "," and state.foreground is not None and state.background is None:
+                #the comma would be read as background colour of the carried colour code, two bolds are a no-op
+                line += "\x02\x02"
+                line_bytes += 2
+            line += atom
+            line_bytes += atom_bytes
+            if IRC_FORMAT_PATTERN.fullmatch(atom):
+                state.apply(atom)
+            else:
+                has_text = True
+    if has_text:
+        lines.append(line)
+    return lines
+
+class TokenBucket:
+    # allows burst lines at once, afterwards rate lines per second
+    def __init__(self, burst: int, rate: float, clock=time.monotonic):
+        self.capacity = max(burst, 1)
+        self.rate = rate
+        self.clock = clock
+        self.tokens = float(self.capacity)
+        self.updated = clock()
+
+    def take(self) -> bool:
+        self.__refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def __refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
 class IrcConnector(irc.bot.SingleServerIRCBot):    
     def __init__(self, settings, fbot):
         self.settings = settings
         self.bot = fbot        
         self.running = True
         self.connection = None
+        self.userhost = None
+        #flood control: lines wait in pending until the bucket has a token
+        self.bucket = TokenBucket(settings.get("floodburst", 5), settings.get("floodrate", 2))
+        self.pending: deque = deque()
+        self.pending_lock = threading.Lock()
 
         irc.client.ServerConnection.buffer_class.encoding = "utf-8"
         irc.bot.SingleServerIRCBot.__init__(self, [\
@@ -20,43 +133,41 @@ class IrcConnector(irc.bot.SingleServerIRCBot):
             int(settings["port"]))],\
             settings["nickname"],\
             settings["nickname"])
+        #the reactor is not thread-safe: other threads only queue lines, the reactor thread sends them
+        #registered before the reactor thread runs, adding to its scheduler later would need the reactor mutex
+        self.reactor.scheduler.execute_every(IRC_FLUSH_INTERVAL, self.flush_lines)
         
-    def __split_text_into_chunks(self, text, max_chunk_size=400):
-        # Split the text into words
-        words = text.split()
-        chunks = []
-        current_chunk = ""
-
-        for word in words:
-            # Check if adding the next word exceeds the max_chunk_size
-            if len(current_chunk) + len(word) + 1 <= max_chunk_size:  
-                if current_chunk: 
-                    current_chunk += " "
-                current_chunk += word
-            else:
-                # If it exceeds, save the current_chunk and reset
-                chunks.append(current_chunk)
-                current_chunk = word  
+    def __line_budget(self, command, target) -> int:
+        #bytes left for the text in ":nick!user@host COMMAND target :text\r\n", the server prepends our full mask when relaying
+        #until our own join told us user@host, the longest usual ident and hostname are assumed
+        nickname = self.connection.get_nickname() or self.settings["nickname"]
+        userhost = self.userhost or "~" + nickname[:10] + "@" + "x" * 63
+        overhead = len((":" + nickname + "!" + userhost + " " + command + " " + target + " :\r\n").encode("utf-8"))
+        return IRC_LINE_BYTES - overhead
 
-        if current_chunk:
-            chunks.append(current_chunk)
-
-        return chunks
-    
     def __flood_control(self, message, messagehead = None):
-        if isinstance(message, str) and len(message) > 400:
-            result = self.__split_text_into_chunks(message)
-            for chunk in result:
-                if messagehead:
-                    self.connection.privmsg(self.settings["channel"], messagehead + chunk)
-                else:
-                    self.connection.privmsg(self.settings["channel"], chunk)
-                time.sleep(0.5)
-        else:
-            if messagehead:
-                self.connection.privmsg(self.settings["channel"], messagehead + message)
-            else:
-                self.connection.privmsg(self.settings["channel"], message)
+        messagehead = messagehead or ""
+        channel = self.settings["channel"]
+        budget = max(self.__line_budget("PRIVMSG", channel) - len(messagehead.encode("utf-8")), 64)
+        for chunk in split_irc_message(message, budget):
+            self.__queue_line(self.connection.privmsg, channel, messagehead + chunk)
+
+    def __queue_line(self, send, target, message):
+        #called from any thread (usually the outbox sender)
+        with self.pending_lock:
+            self.pending.append((send, target, message))
+
+    def flush_lines(self):
+        #runs on the reactor thread, sends as many lines as the bucket allows, the rest waits for the next run
+        with self.pending_lock:
+            lines = []
+            while self.pending and self.bucket.take():
+                lines.append(self.pending.popleft())
+        for send, target, message in lines:
+            try:
+                send(target, message)
+            except Exception as e:
+                logger.error("[IRC] Something wrong with sending: %s", e)
 
     def get_online_users(self):
         online_users = list(self.channels[self.settings["channel"]]._users.keys())
@@ -74,7 +185,30 @@ class IrcConnector(irc.bot.SingleServerIRCBot):
             self.__flood_control(clean_message, messagehead)
 
     def send_single_message(self, user, message):
-        self.connection.notice(user, message)
+        self.__queue_notice(user, message)
+
+    def set_topic(self, topic):
+        self.__queue_line(self.connection.topic, self.settings["channel"], topic)
+
+    def send_group_notice(self, users, message):
+        # one NOTICE for several users (nick1,nick2,...), as many targets as the server allows (ISUPPORT TARGMAX/MAXTARGETS)
+        # and as fit into the byte budget of the relayed line together with the message
+        features = self.connection.features
+        max_targets = getattr(features, "targmax", {}).get("NOTICE") or getattr(features, "maxtargets", 1) or 1
+        message_bytes = len(message.encode("utf-8"))
+        targets = []
+        for user in users:
+            if targets and (len(targets) >= max_targets or self.__line_budget("NOTICE", ",".join(targets + [user])) < message_bytes):
+                self.__queue_notice(",".join(targets), message)
+                targets = []
+            targets.append(user)
+        if targets:
+            self.__queue_notice(",".join(targets), message)
+
+    def __queue_notice(self, target, message):
+        #a message that is too long for one line even with a single target is split like channel messages
+        for chunk in split_irc_message(message, max(self.__line_budget("NOTICE", target), 64)):
+            self.__queue_line(self.connection.notice, target, chunk)
         
     def close(self):
         self.running = False
@@ -86,24 +220,25 @@ class IrcConnector(irc.bot.SingleServerIRCBot):
     def on_nick(self, connection, event):
         before = event.source.nick
         after = event.target
-        self.bot.change_name(before, after)
+        #database and pickup text work runs on the writer thread like every command
+        self.bot.dbexecutor.call(self.bot.change_name, before, after)
         if self.settings["presence-update"]:
             self.bot.send_all(message=before + " now known as " + after + ".", chattype=ChatType.IRC.value)
     
     def on_kick(self, connection, event):
         if event.arguments[0]:
-            self.bot.remove_user_on_exit(event.arguments[0], ChatType.IRC.value)
+            self.bot.dbexecutor.call(self.bot.remove_user_on_exit, event.arguments[0], ChatType.IRC.value)
             if self.settings["presence-update"]:
                 self.bot.send_all(message=event.arguments[0] + " got kicked.", chattype=ChatType.IRC.value)
 
     def on_part(self, connection, event):
-        self.bot.remove_user_on_exit(event.source.nick, ChatType.IRC.value)
+        self.bot.dbexecutor.call(self.bot.remove_user_on_exit, event.source.nick, ChatType.IRC.value)
         if self.settings["presence-update"]:
             self.bot.send_all(message=event.source.nick + " left.", chattype=ChatType.IRC.value)
             
 
     def on_quit(self, connection, event):
-        self.bot.remove_user_on_exit(event.source.nick, ChatType.IRC.value)
+        self.bot.dbexecutor.call(self.bot.remove_user_on_exit, event.source.nick, ChatType.IRC.value)
         if self.settings["presence-update"]:            
             self.bot.send_all(message=event.source.nick + " left.", chattype=ChatType.IRC.value)
     
@@ -129,10 +264,13 @@ class IrcConnector(irc.bot.SingleServerIRCBot):
         logger.info("[IRC] Connected to server")
     
     def on_join(self, connection, event):
-        if event.source.nick != connection.get_nickname() and self.settings["presence-update"]:
-            self.bot.send_all(message=event.source.nick + " joined.", chattype=ChatType.IRC.value)
-        else:
+        if event.source.nick == connection.get_nickname():
+            #our user@host as the server relays it, needed for the length of outgoing lines
+            self.userhost = event.source.userhost
             logger.info("[IRC] Connected to channel")
+            self.bot.post_restored_state(ChatType.IRC.value)
+        elif self.settings["presence-update"]:
+            self.bot.send_all(message=event.source.nick + " joined.", chattype=ChatType.IRC.value)
     
     def on_pubmsg(self, connection, event):
         message = event.arguments[0].strip()
@@ -1,12 +1,131 @@
 import asyncio
+import html
+import json
+import os
 import time
 from chattype import ChatType
-from nio import AsyncClient, MatrixRoom, RoomMessageText, LoginResponse
+from nio import AsyncClient, MatrixRoom, RoomMessageText, LoginResponse, RoomSendError, SyncResponse, UploadFilterResponse, WhoamiResponse
 from utils import create_logger
 import re
 
 logger = create_logger(__name__)
 
+#events of the configured room only, members are lazy loaded and the timeline is kept short
+SYNC_TIMELINE_LIMIT = 10
+
+#<font> spans from matrix_colors are trusted html, everything else gets escaped
+FONT_TAG_PATTERN = re.compile(r'<font[^>]*>.*?</font>', re.DOTALL)
+FONT_TAG_EDGE_PATTERN = re.compile(r'<font[^>]*>|</font>')
+
+def escape_matrix_text(text: str) -> str:
+    #str.replace runs in C and is faster than a translate table with multi-character replacements
+    return text.replace("<", "&lt;").replace(">", "&gt;").replace("\n", "<br>")
+
+def escape_matrix_html(text: str) -> str:
+    #one pass over the font spans: escapes < and > outside of them and turns newlines into <br>
+    if "<font" not in text:
+        return escape_matrix_text(text)
+    parts = []
+    position = 0
+    for match in FONT_TAG_PATTERN.finditer(text):
+        parts.append(escape_matrix_text(text[position:match.start()]))
+        parts.append(match.group(0).replace("\n", "<br>"))
+        position = match.end()
+    parts.append(escape_matrix_text(text[position:]))
+    return "".join(parts)
+
+def matrix_plain_text(message: str) -> str:
+    #body of an html message for clients, notifications and bridges that don't render html
+    return FONT_TAG_EDGE_PATTERN.sub("", message)
+
+def format_matrix_message(message: str, is_html: bool) -> str:
+    #formatted_body of a message, html messages may contain the <font> spans of matrix_colors
+    if is_html:
+        return escape_matrix_html(message)
+    return html.escape(message, quote=False).replace("\n", "<br>")
+
+class MatrixRoomQueue:
+    """
+    Ordered send queue of one room, a single worker task sends one event at a time.
+        Consecutive queued messages are merged into one HTML event up to max_chars.
+        Every message is formatted once when it is queued (or comes formatted, see BroadcastMessage).
+        nio waits retry_after_ms on M_LIMIT_EXCEEDED and retries the same transaction, the queue is held meanwhile,
+        the retries are counted through a response callback (see MatrixConnector.start).
+    """
+    def __init__(self, client: AsyncClient, room: str, max_chars: int = 4000, maxsize: int = 100):
+        self.client = client
+        self.room = room
+        self.max_chars = max_chars
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.carry = None
+        self.worker: asyncio.Task = None
+        self.metrics = {"events": 0, "messages": 0, "merged": 0, "retries": 0, "retry_wait_ms": 0, "failed": 0,
+                        "latency_last": 0.0, "latency_max": 0.0, "latency_total": 0.0}
+
+    async def put(self, message: str, is_html: bool, formatted: str = None):
+        #message is the plain text body when formatted is given (see BroadcastMessage.get_matrix),
+        #otherwise both are made from message here; waits while the queue is full
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.__run())
+        if formatted is None:
+            formatted = format_matrix_message(message, is_html)
+            if is_html:
+                message = matrix_plain_text(message)
+        await self.queue.put((message, is_html, formatted, time.monotonic()))
+
+    async def join(self):
+        await self.queue.join()
+
+    def count_retry(self, retry_after_ms: int):
+        self.metrics["retries"] += 1
+        self.metrics["retry_wait_ms"] += retry_after_ms or 0
+
+    def get_metrics(self) -> dict:
+        metrics = dict(self.metrics)
+        metrics["depth"] = self.queue.qsize()
+        metrics["latency_avg"] = metrics["latency_total"] / metrics["events"] if metrics["events"] else 0.0
+        return metrics
+
+    async def __run(self):
+        while True:
+            batch = [self.carry if self.carry is not None else await self.queue.get()]
+            self.carry = None
+            size = len(batch[0][2])
+            #take the following lines as long as they fit into the event
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                item_size = len(item[2])
+                if size + len("<br>") + item_size > self.max_chars:
+                    self.carry = item
+                    break
+                batch.append(item)
+                size += len("<br>") + item_size
+            try:
+                await self.__send(batch)
+            except Exception as e:
+                self.metrics["failed"] += 1
+                logger.error("Something wrong with matrix send: %s", e)
+            for item in batch:
+                self.queue.task_done()
+
+    async def __send(self, batch: list[tuple]):
+        queued = batch[0][3]
+        #the body is always plain text, the html version only comes along if a line has html
+        content = {"msgtype": "m.text", "body": "\n".join(item[0] for item in batch)}
+        if any(item[1] for item in batch):
+            content["format"] = "org.matrix.custom.html"
+            content["formatted_body"] = "<br>".join(item[2] for item in batch)
+        response = await self.client.room_send(room_id=self.room, message_type="m.room.message", content=content)
+        if isinstance(response, RoomSendError):
+            raise Exception(response.message)
+        latency = time.monotonic() - queued
+        self.metrics["events"] += 1
+        self.metrics["messages"] += len(batch)
+        self.metrics["merged"] += len(batch) - 1
+        self.metrics["latency_last"] = latency
+        self.metrics["latency_max"] = max(self.metrics["latency_max"], latency)
+        self.metrics["latency_total"] += latency
+
 class MatrixConnector:
 
     def __init__(self, settings: dict, bot):
@@ -16,53 +135,121 @@ class MatrixConnector:
         self.botname = settings["botname"]
         self.password = settings["password"]        
         self.room = settings["room"]
-
-
-    def __replace_tags(self, text):
-        # Step 1: Use regex to find all font tags and temporarily replace them with placeholders
-        placeholders = []
-        def replace_font_tag(match):
-            placeholders.append(match.group(0))
-            return f'__FONT_TAG_{len(placeholders) - 1}__'
-        
-        text = re.sub(r'<font[^>]*>.*?</font>', replace_font_tag, text, flags=re.DOTALL)
-        
-        # Step 2: Escape all remaining < and > with &lt; and &gt;
-        text = re.sub(r'<', '&lt;', text)
-        text = re.sub(r'>', '&gt;', text)
-        
-        # Step 3: Restore the font tags from placeholders
-        def restore_font_tag(match):
-            index = int(match.group(1))
-            return placeholders[index]
-        
-        text = re.sub(r'__FONT_TAG_(\d+)__', restore_font_tag, text)
-
-        text = text.replace("\n", "<br>")
-        
-        return text
+        self.room_queues: dict[str, MatrixRoomQueue] = {}
+        #access token, device, sync token and filter id of the last run
+        self.statefile = settings.get("statefile", "matrix_state.json")
+        self.state: dict = {}
+        self.members_requested = False
 
     async def start(self) -> None:
-        self.client: AsyncClient = AsyncClient(self.server, self.botname)
-        self.client.add_event_callback(self.message_callback, RoomMessageText)
+        self.attach_client(AsyncClient(self.server, self.botname))
         try:
             self.loop = asyncio.get_event_loop()
         except RuntimeError:
             self.loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self.loop)
-        
-        response = await self.client.login(self.password)
-        
-        if isinstance(response, LoginResponse):
-            logger.info("Matrix log in successfully")
+
+        sync_filter = await self.prepare_session()
+        if sync_filter is not None:
             # Set the start time as the current time
             self.start_time = time.time()
-            
-            # Start listening for messages
-            await self.client.sync_forever(timeout=30000)
-        else:
-            logger.info("Failed to log in:", response)
-    
+            self.bot.post_restored_state(ChatType.MATRIX.value)
+
+            # Start listening for messages, continues after the stored sync token
+            # full_state on the first sync restores the room state (power levels) that an incremental sync leaves out
+            await self.client.sync_forever(timeout=30000, sync_filter=sync_filter, since=self.state.get("next_batch"), full_state=True)
+
+    async def prepare_session(self):
+        #restores the stored login or logs in, returns the sync filter (filter id, or the filter itself if the upload failed)
+        #returns None if the bot could not log in
+        self.state = self.__load_state()
+        if not await self.__restore_login() and not await self.__login():
+            return None
+        return await self.__get_sync_filter()
+
+    def get_sync_filter(self) -> dict:
+        return {"room": {"rooms": [self.room],
+                         "timeline": {"limit": SYNC_TIMELINE_LIMIT},
+                         "state": {"lazy_load_members": True},
+                         "ephemeral": {"not_types": ["*"]},
+                         "account_data": {"not_types": ["*"]}},
+                "presence": {"not_types": ["*"]},
+                "account_data": {"not_types": ["*"]}}
+
+    async def __restore_login(self) -> bool:
+        if not self.state.get("access_token"):
+            return False
+        self.client.restore_login(self.state["user_id"], self.state["device_id"], self.state["access_token"])
+        response = await self.client.whoami()
+        if isinstance(response, WhoamiResponse):
+            logger.info("Matrix login restored for %s", response.user_id)
+            return True
+        logger.info("Stored matrix login is not valid anymore: %s", response)
+        self.client.access_token = ""
+        self.state = {}
+        return False
+
+    async def __login(self) -> bool:
+        response = await self.client.login(self.password)
+        if not isinstance(response, LoginResponse):
+            logger.info("Failed to log in: %s", response)
+            return False
+        logger.info("Matrix log in successfully")
+        #a new login starts a new sync, the old sync token and filter belong to the old session
+        self.state = {"user_id": response.user_id, "device_id": response.device_id, "access_token": response.access_token}
+        self.__save_state()
+        return True
+
+    async def __get_sync_filter(self):
+        sync_filter = self.get_sync_filter()
+        if self.state.get("filter") == sync_filter and self.state.get("filter_id"):
+            return self.state["filter_id"]
+        response = await self.client.upload_filter(presence=sync_filter["presence"], account_data=sync_filter["account_data"], room=sync_filter["room"])
+        if not isinstance(response, UploadFilterResponse):
+            #nio also accepts the filter inline with every sync
+            logger.info("Failed to upload sync filter: %s", response)
+            return sync_filter
+        self.state["filter"] = sync_filter
+        self.state["filter_id"] = response.filter_id
+        self.__save_state()
+        return response.filter_id
+
+    async def __on_sync(self, response: SyncResponse):
+        if response.next_batch and response.next_batch != self.state.get("next_batch"):
+            self.state["next_batch"] = response.next_batch
+            self.__save_state()
+        room = self.client.rooms.get(self.room)
+        if room is not None and not room.members_synced and not self.members_requested:
+            #lazy loading only sends the members of the synced events, found_user_in_room needs all of them (once, then kept by the member events)
+            self.members_requested = True
+            await self.client.joined_members(self.room)
+
+    def __load_state(self) -> dict:
+        try:
+            with open(self.statefile, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error("Could not read matrix state file %s: %s", self.statefile, e)
+            return {}
+
+    def __save_state(self):
+        #written to a temporary file and replaced, the file holds the access token and is only readable by the owner
+        temp = self.statefile + ".tmp"
+        try:
+            with os.fdopen(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+                json.dump(self.state, file)
+            os.replace(temp, self.statefile)
+        except OSError as e:
+            logger.error("Could not write matrix state file %s: %s", self.statefile, e)
+
+    def attach_client(self, client: AsyncClient):
+        self.client: AsyncClient = client
+        self.client.add_event_callback(self.message_callback, RoomMessageText)
+        self.client.add_response_callback(self.__on_send_error, RoomSendError)
+        self.client.add_response_callback(self.__on_sync, SyncResponse)
+
     async def message_callback(self, room: MatrixRoom, event: RoomMessageText) -> None:
         logger.info(f"Message received in {room.display_name} : {event.sender} : {event.body}")
         if event.sender == self.botname:
@@ -93,24 +280,26 @@ class MatrixConnector:
         # TODO: use specific powerlevel from setttings.yaml
         isAdmin = room.power_levels.can_user_kick(event.sender)
         if event.body.startswith("!"):
-            self.bot.send_command(event.sender, event.body, ChatType.MATRIX.value, isAdmin)
-
-    async def send_my_message_async(self,message, html):
-        if html:
-            formatted_message = self.__replace_tags(message)
-            await self.client.room_send(
-                room_id=self.room,
-                message_type="m.room.message",
-                content={"msgtype": "m.text", "body": formatted_message, "format": "org.matrix.custom.html", "formatted_body": formatted_message})
-        else:
-            await self.client.room_send(
-                room_id=self.room,
-                message_type="m.room.message",
-                content={"msgtype": "m.text", "body": message})
+            await self.bot.send_command_async(event.sender, event.body, ChatType.MATRIX.value, isAdmin)
+
+    async def send_my_message_async(self, message, html, formatted=None):
+        #queues the message for the room, returns when it is queued
+        await self.get_room_queue(self.room).put(message, html, formatted)
+
+    def get_room_queue(self, room: str) -> MatrixRoomQueue:
+        if room not in self.room_queues:
+            self.room_queues[room] = MatrixRoomQueue(self.client, room)
+        return self.room_queues[room]
+
+    def get_send_metrics(self) -> dict:
+        #per room: events, messages, merged, retries, retry_wait_ms, failed, depth and latency in seconds
+        return {room: queue.get_metrics() for room, queue in self.room_queues.items()}
+
+    async def __on_send_error(self, response: RoomSendError):
+        #called by nio for every M_LIMIT_EXCEEDED before it sleeps retry_after_ms and retries
+        if response.status_code == "M_LIMIT_EXCEEDED" and response.room_id in self.room_queues:
+            self.room_queues[response.room_id].count_retry(response.retry_after_ms)
 
-    def send_my_message(self, message, html=False):
-        asyncio.run_coroutine_threadsafe(self.send_my_message_async(message, html), self.loop)
-    
     def found_user_in_room(self, username) -> bool:
         room: MatrixRoom = self.client.rooms.get(self.room)
         if room is None:
@@ -0,0 +1,150 @@
+import threading
+from collections import Counter
+
+class MentionIndex:
+    """
+    Name to mention lookup of the guild members, used to turn "@name" in bridged messages into discord mentions.
+        rewrite() only looks at the '@' positions of a message and tries the known name lengths there (longest first),
+        so it costs time proportional to the message and not to the number of members.
+        Kept current by the member join/remove and user update events.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mentions: dict[str, str] = {}
+        self.lengths: Counter = Counter()
+        self.sorted_lengths: list[int] = []
+
+    def load(self, members):
+        #members: objects with name and mention (discord.Member)
+        with self.lock:
+            self.mentions.clear()
+            self.lengths.clear()
+            for member in members:
+                self.__add(member.name, member.mention)
+            self.__sort_lengths()
+
+    def add(self, name: str, mention: str):
+        with self.lock:
+            self.__add(name, mention)
+            self.__sort_lengths()
+
+    def remove(self, name: str):
+        with self.lock:
+            if self.mentions.pop(name, None) is not None:
+                self.lengths[len(name)] -= 1
+                if not self.lengths[len(name)]:
+                    del self.lengths[len(name)]
+                self.__sort_lengths()
+
+    def rewrite(self, message: str) -> str:
+        #"hi @Alpha" -> "hi <@1234>", the longest known name wins at every '@'
+        with self.lock:
+            mentions = self.mentions
+            lengths = self.sorted_lengths
+        parts = []
+        start = 0
+        position = message.find("@")
+        while position != -1:
+            next_search = position + 1
+            for length in lengths:
+                mention = mentions.get(message[position + 1:position + 1 + length])
+                if mention is not None:
+                    parts.append(message[start:position])
+                    parts.append(mention)
+                    start = next_search = position + 1 + length
+                    break
+            position = message.find("@", next_search)
+        parts.append(message[start:])
+        return "".join(parts)
+
+    def __len__(self) -> int:
+        return len(self.mentions)
+
+    def __add(self, name: str, mention: str):
+        if name not in self.mentions:
+            self.lengths[len(name)] += 1
+        self.mentions[name] = mention
+
+    def __sort_lengths(self):
+        #replaced instead of changed in place, rewrite() may still iterate the old list
+        self.sorted_lengths = sorted(self.lengths, reverse=True)
+
+class OnlineMembers:
+    """
+    Names of the guild members that are not offline.
+        Updated by presence and member events, so membership tests are O(1).
+        The sorted list for !online is only built when it is asked for after a change.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names: set[str] = set()
+        self.sorted_names: tuple[str] = None
+
+    def load(self, members):
+        #members: objects with name and status (discord.Member)
+        with self.lock:
+            self.names = set(member.name for member in members if str(member.status) != "offline")
+            self.sorted_names = None
+
+    def update(self, name: str, online: bool):
+        with self.lock:
+            if online and name not in self.names:
+                self.names.add(name)
+                self.sorted_names = None
+            elif not online and name in self.names:
+                self.names.discard(name)
+                self.sorted_names = None
+
+    def rename(self, before: str, after: str):
+        with self.lock:
+            if before in self.names:
+                self.names.discard(before)
+                self.names.add(after)
+                self.sorted_names = None
+
+    def is_online(self, name: str) -> bool:
+        return name in self.names
+
+    def snapshot(self) -> tuple[str]:
+        with self.lock:
+            if self.sorted_names is None:
+                self.sorted_names = tuple(sorted(self.names))
+            return self.sorted_names
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+class NameCache:
+    """
+    Guild objects (roles or members) by name, replaces the linear discord.utils.get scans.
+        Loaded in on_ready and kept current by the create/delete/update events of the guild.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_name: dict[str, object] = {}
+
+    def load(self, items):
+        with self.lock:
+            self.by_name = {item.name: item for item in items}
+
+    def put(self, item):
+        with self.lock:
+            self.by_name[item.name] = item
+
+    def remove(self, item):
+        #only if the name still belongs to this object (same discord id)
+        with self.lock:
+            cached = self.by_name.get(item.name)
+            if cached is not None and cached.id == item.id:
+                del self.by_name[item.name]
+
+    def rename(self, before_name: str, item):
+        with self.lock:
+            self.by_name.pop(before_name, None)
+            self.by_name[item.name] = item
+
+    def get(self, name: str):
+        return self.by_name.get(name)
+
+    def __len__(self) -> int:
+        return len(self.by_name)
@@ -0,0 +1,26 @@
+import peewee as pw
+from peewee_migrate import Migrator
+from contextlib import suppress
+
+with suppress(ImportError):
+    pass
+
+def migrate(migrator: Migrator, database: pw.Database, *, fake=False):
+  # entry lookups by player and game (add, remove, renew) and the covering index for the top10 join
+  migrator.add_index('pickupentries', 'playerId', 'gameId')
+  migrator.add_index('pickupentries', 'gameId', 'playerId')
+  # expiry of old entries by addedDate
+  migrator.add_index('pickupentries', 'addedDate')
+  # subscription checks by player and gametype
+  migrator.add_index('subscriptions', 'playerId', 'gametypeId')
+  # partial indexes: the few active games by gametype and the played history by date (!lastgame, !top10)
+  migrator.sql('CREATE INDEX IF NOT EXISTS "pickupgames_active_gametypeId_id" ON "pickupgames" ("gametypeId_id") WHERE "isPlayed" = 0')
+  migrator.sql('CREATE INDEX IF NOT EXISTS "pickupgames_played_createdDate" ON "pickupgames" ("createdDate") WHERE "isPlayed" = 1')
+  
+def rollback(migrator: Migrator, database: pw.Database, *, fake=False):
+  migrator.sql('DROP INDEX IF EXISTS "pickupgames_played_createdDate"')
+  migrator.sql('DROP INDEX IF EXISTS "pickupgames_active_gametypeId_id"')
+  migrator.drop_index('subscriptions', 'playerId', 'gametypeId')
+  migrator.drop_index('pickupentries', 'addedDate')
+  migrator.drop_index('pickupentries', 'gameId', 'playerId')
+  migrator.drop_index('pickupentries', 'playerId', 'gameId')
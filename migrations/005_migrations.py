@@ -0,0 +1,58 @@
+import peewee as pw
+from peewee_migrate import Migrator
+from contextlib import suppress
+
+with suppress(ImportError):
+    pass
+
+def migrate(migrator: Migrator, database: pw.Database, *, fake=False):
+  Players = migrator.orm['players']
+  GameTypes = migrator.orm['gametypes']
+
+  # compact copies of old played games
+  @migrator.create_model
+  class ArchivedGames(pw.Model):
+    originalId = pw.IntegerField()
+    createdDate = pw.DateTimeField(index=True)
+    gametypeId = pw.ForeignKeyField(GameTypes, backref='archivedgames', on_delete='CASCADE')
+
+  @migrator.create_model
+  class ArchivedEntries(pw.Model):
+    gameId = pw.ForeignKeyField(ArchivedGames, backref='archivedplayers', on_delete='CASCADE')
+    playerId = pw.ForeignKeyField(Players, backref='archivedgames', on_delete='CASCADE')
+    addedFrom = pw.CharField(default='irc')
+
+  # played games per day, player and gametype for !top10
+  @migrator.create_model
+  class PlayerDailyCounts(pw.Model):
+    day = pw.DateField()
+    playerId = pw.ForeignKeyField(Players, backref='dailycounts', on_delete='CASCADE')
+    gametypeId = pw.ForeignKeyField(GameTypes, backref='dailycounts', on_delete='CASCADE')
+    gameCount = pw.IntegerField(default=0)
+
+    class Meta:
+      indexes = (
+        (('day', 'playerId', 'gametypeId'), True),
+      )
+
+  # roll up the existing history once, afterwards the counts are updated when a match starts
+  migrator.sql('INSERT INTO "playerdailycounts" ("day", "playerId_id", "gametypeId_id", "gameCount") '
+               'SELECT date("g"."createdDate"), "e"."playerId_id", "g"."gametypeId_id", COUNT(*) '
+               'FROM "pickupentries" AS "e" JOIN "pickupgames" AS "g" ON "g"."id" = "e"."gameId_id" '
+               'WHERE "g"."isPlayed" = 1 '
+               'GROUP BY date("g"."createdDate"), "e"."playerId_id", "g"."gametypeId_id"')
+
+def rollback(migrator: Migrator, database: pw.Database, *, fake=False):
+  # move archived games back, the played history must not get lost
+  def restore_archive():
+    games = database.execute_sql('SELECT "id", "createdDate", "gametypeId_id" FROM "archivedgames" ORDER BY "id"').fetchall()
+    for archived_id, created_date, gametype_id in games:
+      game_id = database.execute_sql('INSERT INTO "pickupgames" ("createdDate", "gametypeId_id", "isPlayed") VALUES (?, ?, 1)',
+                                     (created_date, gametype_id)).lastrowid
+      database.execute_sql('INSERT INTO "pickupentries" ("addedDate", "addedFrom", "playerId_id", "gameId_id", "isWarned") '
+                           'SELECT ?, "addedFrom", "playerId_id", ?, 0 FROM "archivedentries" WHERE "gameId_id" = ? ORDER BY "id"',
+                           (created_date, game_id, archived_id))
+  migrator.run(restore_archive)
+  migrator.remove_model('playerdailycounts')
+  migrator.remove_model('archivedentries')
+  migrator.remove_model('archivedgames')
@@ -44,7 +44,7 @@ class PickupGames(Model):
         database = db
 
 class PickupEntries(Model):
-    addedDate = DateTimeField(default=datetime.datetime.now)
+    addedDate = DateTimeField(default=datetime.datetime.now, index=True)
     addedFrom = CharField(default='irc')
     playerId = ForeignKeyField(Players, backref='addedgames', on_delete='CASCADE')
     gameId = ForeignKeyField(PickupGames, backref='addedplayers', on_delete='CASCADE')
@@ -52,6 +52,10 @@ class PickupEntries(Model):
 
     class Meta:
         database = db
+        indexes = (
+            (('playerId', 'gameId'), False),
+            (('gameId', 'playerId'), False),
+        )
 
 class Subscriptions(Model):
     playerId = ForeignKeyField(Players, backref='playersubscription', on_delete='CASCADE')
@@ -59,3 +63,36 @@ class Subscriptions(Model):
 
     class Meta:
         database = db
+        indexes = (
+            (('playerId', 'gametypeId'), False),
+        )
+
+class ArchivedGames(Model):
+    # played PickupGames older than the archive age (settings: database/archiveage)
+    originalId = IntegerField()
+    createdDate = DateTimeField(index=True)
+    gametypeId = ForeignKeyField(GameTypes, backref='archivedgames', on_delete='CASCADE')
+
+    class Meta:
+        database = db
+
+class ArchivedEntries(Model):
+    gameId = ForeignKeyField(ArchivedGames, backref='archivedplayers', on_delete='CASCADE')
+    playerId = ForeignKeyField(Players, backref='archivedgames', on_delete='CASCADE')
+    addedFrom = CharField(default='irc')
+
+    class Meta:
+        database = db
+
+class PlayerDailyCounts(Model):
+    # roll-up of played games per day, player and gametype (!top10)
+    day = DateField()
+    playerId = ForeignKeyField(Players, backref='dailycounts', on_delete='CASCADE')
+    gametypeId = ForeignKeyField(GameTypes, backref='dailycounts', on_delete='CASCADE')
+    gameCount = IntegerField(default=0)
+
+    class Meta:
+        database = db
+        indexes = (
+            (('day', 'playerId', 'gametypeId'), True),
+        )
@@ -0,0 +1,130 @@
+import asyncio
+from collections import deque
+from utils import create_logger
+
+outbox_logger = create_logger("outbox")
+
+def merge_lines(limit: int):
+    #merge function for (text, flag) items: joins adjacent messages with the same flag as lines of one message up to limit characters
+    def merge(previous: tuple, item: tuple) -> tuple:
+        if previous[1] == item[1] and len(previous[0]) + 1 + len(item[0]) <= limit:
+            return (previous[0] + "\n" + item[0], item[1])
+        return None
+    return merge
+
+class Outbox:
+    """
+    Bounded message queue of one transport with its own sender task on the event loop.
+        The sender awaits deliver(item) for one message after the other, so the order is kept.
+        A new message is merged into the last queued one if merge(previous, item) allows it.
+        Nothing is dropped: put() waits while the queue is full (backpressure), producers are served in order.
+        post() is for synchronous callers: another thread waits until its message is queued,
+        on the event loop the put is scheduled as a task (the loop must never wait).
+        Must be created on the running event loop.
+    """
+    def __init__(self, name: str, deliver, maxsize: int = 100, merge=None, timeout: float = 30):
+        self.name = name
+        self.deliver = deliver
+        self.maxsize = maxsize
+        self.merge = merge
+        self.timeout = timeout
+        self.loop = asyncio.get_running_loop()
+        self.queue: deque = deque()
+        self.condition = asyncio.Condition()
+        #asyncio.Lock is fair, waiting producers get their turn in order
+        self.put_lock = asyncio.Lock()
+        self.posting: set[asyncio.Task] = set()
+        self.running = True
+        self.sending = False
+        self.sent: int = 0
+        self.failed: int = 0
+        self.merged: int = 0
+        self.waited: int = 0
+        self.task = self.loop.create_task(self.__run())
+
+    async def put(self, item) -> bool:
+        #False only if the outbox is closed
+        async with self.put_lock:
+            async with self.condition:
+                if not self.running:
+                    return False
+                if self.__merge(item):
+                    return True
+                if len(self.queue) >= self.maxsize:
+                    self.waited += 1
+                    await self.condition.wait_for(lambda: len(self.queue) < self.maxsize or not self.running)
+                    if not self.running:
+                        return False
+                self.queue.append(item)
+                self.condition.notify_all()
+                return True
+
+    def post(self, item):
+        if self.__on_event_loop():
+            task = self.loop.create_task(self.put(item))
+            self.posting.add(task)
+            task.add_done_callback(self.posting.discard)
+        else:
+            asyncio.run_coroutine_threadsafe(self.put(item), self.loop).result()
+
+    def get_depth(self) -> int:
+        return len(self.queue)
+
+    def get_stats(self) -> dict:
+        #waited: puts that had to wait for a full queue
+        return {"depth": len(self.queue), "sent": self.sent, "merged": self.merged, "waited": self.waited, "failed": self.failed}
+
+    async def join(self):
+        #waits until all posted and queued messages are delivered (for tests and shutdown)
+        while self.posting:
+            await asyncio.gather(*self.posting)
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.queue and not self.sending)
+
+    def close(self):
+        #callable from any thread, waiting producers return False
+        try:
+            self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self.__close()))
+        except RuntimeError:
+            #loop already closed
+            self.running = False
+
+    async def __close(self):
+        async with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.task.cancel()
+
+    def __merge(self, item) -> bool:
+        if self.queue and self.merge is not None:
+            merged = self.merge(self.queue[-1], item)
+            if merged is not None:
+                self.queue[-1] = merged
+                self.merged += 1
+                return True
+        return False
+
+    async def __run(self):
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.queue or not self.running)
+                if not self.running:
+                    return
+                item = self.queue.popleft()
+                self.sending = True
+                self.condition.notify_all()
+            try:
+                await asyncio.wait_for(self.deliver(item), self.timeout)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                outbox_logger.error("Something wrong with outbox %s: %s", self.name, e)
+            async with self.condition:
+                self.sending = False
+                self.condition.notify_all()
+
+    def __on_event_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
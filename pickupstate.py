@@ -0,0 +1,216 @@
+import threading
+from model import *
+from utils import create_logger
+
+state_logger = create_logger("pickupState")
+
+class ActiveEntry:
+    # In-memory copy of an unplayed PickupEntries row, field names follow the model
+    def __init__(self, entry_id: int, player: Players, game, added_from: str, added_date, is_warned: bool = False):
+        self.id = entry_id
+        self.playerId = player
+        self.gameId = game
+        self.addedFrom = added_from
+        self.addedDate = added_date
+        self.isWarned = is_warned
+
+class ActiveGame:
+    # In-memory copy of an unplayed PickupGames row with its entries (keyed by player id, in order of adding)
+    def __init__(self, game_id: int, gametype: GameTypes, created_date):
+        self.id = game_id
+        self.gametypeId = gametype
+        self.createdDate = created_date
+        self.addedplayers: dict[int, ActiveEntry] = {}
+
+    @property
+    def title(self) -> str:
+        return self.gametypeId.title
+
+    def get_entries(self) -> list[ActiveEntry]:
+        return list(self.addedplayers.values())
+
+class PickupState:
+    """
+    Authoritative copy of all active (not yet played) pickup games.
+        Games are indexed by gametype title, entries additionally by player id.
+        The DatabaseConnector writes every change to the database first and mirrors it here afterwards,
+        so all reads for active pickups are answered without touching the database.
+        The status text is kept per game and only re-rendered for the game that changed,
+        version is increased whenever the rendered text changes.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.games: dict[str, ActiveGame] = {}
+        self.player_entries: dict[int, dict[str, ActiveEntry]] = {}
+        self.segments: dict[str, str] = {}
+        self.pickuptext: str = ""
+        self.version: int = 0
+        self.scheduler = None
+
+    def attach_scheduler(self, scheduler):
+        #keeps the warn/expire deadlines of the scheduler in sync with every entry change
+        with self.lock:
+            self.scheduler = scheduler
+            scheduler.clear()
+            for entry in self.get_entries():
+                scheduler.schedule(entry)
+
+    def load(self):
+        #(re)builds the state from the database, needs an open connection
+        with self.lock:
+            self.clear()
+            if not PickupGames.table_exists():
+                return
+            games = (PickupGames
+                     .select(PickupGames, GameTypes)
+                     .join(GameTypes)
+                     .where(PickupGames.isPlayed == False)
+                     .order_by(PickupGames.id))
+            for game in games:
+                self.add_game(game, game.gametypeId)
+
+            entries = (PickupEntries
+                       .select(PickupEntries, Players)
+                       .join(Players)
+                       .switch(PickupEntries)
+                       .join(PickupGames)
+                       .where(PickupGames.isPlayed == False)
+                       .order_by(PickupEntries.id))
+            games_by_id = {game.id: game for game in self.games.values()}
+            for entry in entries:
+                game = games_by_id.get(entry.gameId_id)
+                if game is not None:
+                    self.add_entry(entry, entry.playerId, game.title)
+            state_logger.info("Loaded %d active games", len(self.games))
+
+    def clear(self):
+        with self.lock:
+            self.games.clear()
+            self.player_entries.clear()
+            if self.scheduler is not None:
+                self.scheduler.clear()
+            if self.segments:
+                self.segments.clear()
+                self.pickuptext = ""
+                self.version += 1
+
+    def has_active_games(self) -> bool:
+        return len(self.games) > 0
+
+    def get_game(self, title: str) -> ActiveGame:
+        return self.games.get(title)
+
+    def get_games(self) -> list[ActiveGame]:
+        with self.lock:
+            return list(self.games.values())
+
+    def get_empty_games(self) -> list[ActiveGame]:
+        with self.lock:
+            return [game for game in self.games.values() if not game.addedplayers]
+
+    def get_entry(self, player_id: int, title: str) -> ActiveEntry:
+        with self.lock:
+            return self.player_entries.get(player_id, {}).get(title)
+
+    def get_player_ids(self) -> list[int]:
+        with self.lock:
+            return list(self.player_entries.keys())
+
+    def get_player_entries(self, player_id: int) -> list[ActiveEntry]:
+        with self.lock:
+            return list(self.player_entries.get(player_id, {}).values())
+
+    def get_entries(self) -> list[ActiveEntry]:
+        #all active entries, oldest first
+        with self.lock:
+            entries = [entry for game in self.games.values() for entry in game.addedplayers.values()]
+        entries.sort(key=lambda entry: entry.addedDate)
+        return entries
+
+    def add_game(self, game: PickupGames, gametype: GameTypes) -> ActiveGame:
+        with self.lock:
+            active_game = ActiveGame(game.id, gametype, game.createdDate)
+            self.games[gametype.title] = active_game
+            self.__render(gametype.title)
+            return active_game
+
+    def remove_game(self, title: str) -> ActiveGame:
+        with self.lock:
+            game = self.games.pop(title, None)
+            if game is not None:
+                for player_id, entry in game.addedplayers.items():
+                    self.__unindex_entry(player_id, title)
+                    self.__unschedule(entry)
+                self.__render(title)
+            return game
+
+    def add_entry(self, entry: PickupEntries, player: Players, title: str) -> ActiveEntry:
+        with self.lock:
+            game = self.games[title]
+            active_entry = ActiveEntry(entry.id, player, game, entry.addedFrom, entry.addedDate, entry.isWarned)
+            game.addedplayers[player.id] = active_entry
+            self.player_entries.setdefault(player.id, {})[title] = active_entry
+            if self.scheduler is not None:
+                self.scheduler.schedule(active_entry)
+            self.__render(title)
+            return active_entry
+
+    def remove_entry(self, player_id: int, title: str) -> ActiveEntry:
+        with self.lock:
+            game = self.games.get(title)
+            if game is None:
+                return None
+            entry = game.addedplayers.pop(player_id, None)
+            self.__unindex_entry(player_id, title)
+            self.__unschedule(entry)
+            self.__render(title)
+            return entry
+
+    def renew_entry(self, entry: ActiveEntry, added_date):
+        with self.lock:
+            entry.addedDate = added_date
+            entry.isWarned = False
+            if self.scheduler is not None:
+                self.scheduler.schedule(entry)
+
+    def warn_entry(self, entry: ActiveEntry):
+        with self.lock:
+            entry.isWarned = True
+
+    def update_player(self, player: Players):
+        #replace the player snapshot after names or bridge settings changed
+        with self.lock:
+            for entry in self.player_entries.get(player.id, {}).values():
+                entry.playerId = player
+
+    def get_pickuptext(self) -> str:
+        #example: "duel (1/2) 2v2tdm (3/4)"
+        return self.pickuptext
+
+    def get_pickuptext_version(self) -> tuple[int, str]:
+        with self.lock:
+            return self.version, self.pickuptext
+
+    def __render(self, title: str):
+        #re-renders the segment of one game, the full text is only joined again if the segment changed
+        game = self.games.get(title)
+        if game is None:
+            changed = self.segments.pop(title, None) is not None
+        else:
+            segment = game.title + " (" + str(len(game.addedplayers)) + "/" + str(game.gametypeId.playerCount) + ")"
+            changed = self.segments.get(title) != segment
+            self.segments[title] = segment
+        if changed:
+            self.pickuptext = " ".join(self.segments.values())
+            self.version += 1
+
+    def __unschedule(self, entry: ActiveEntry):
+        if entry is not None and self.scheduler is not None:
+            self.scheduler.unschedule(entry.id)
+
+    def __unindex_entry(self, player_id: int, title: str):
+        entries = self.player_entries.get(player_id)
+        if entries is not None:
+            entries.pop(title, None)
+            if not entries:
+                del self.player_entries[player_id]
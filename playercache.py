@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+from model import Players
+from utils import create_logger
+
+cache_logger = create_logger("playerCache")
+
+class PlayerCache:
+    """
+    Identity cache for player lookups, keyed by (chattype, name).
+        chattype None stands for the combined irc/discord lookup. Unknown names are cached as None too,
+        so unregistered users typing commands don't hit the database either. The names come from user input
+        (!info foo, !pull foo), so only the max_unknown most recently used ones are kept.
+        Every write to Players has to invalidate the affected names and player ids.
+    """
+    def __init__(self, max_unknown: int = 1024):
+        self.lock = threading.RLock()
+        self.players: dict[tuple[str, str], Players] = {}
+        self.unknown: OrderedDict[tuple[str, str], None] = OrderedDict()
+        self.max_unknown = max_unknown
+        self.keys_by_player: dict[int, set[tuple[str, str]]] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def lookup(self, chattype: str, name: str) -> tuple[bool, Players]:
+        #returns (found in cache, player or None)
+        with self.lock:
+            key = (chattype, name)
+            if key in self.players:
+                self.hits += 1
+                return True, self.players[key]
+            if key in self.unknown:
+                self.unknown.move_to_end(key)
+                self.hits += 1
+                return True, None
+            self.misses += 1
+            return False, None
+
+    def store(self, chattype: str, name: str, player: Players):
+        with self.lock:
+            key = (chattype, name)
+            if player is None:
+                self.unknown[key] = None
+                self.unknown.move_to_end(key)
+                if len(self.unknown) > self.max_unknown:
+                    self.unknown.popitem(last=False)
+                return
+            self.players[key] = player
+            self.keys_by_player.setdefault(player.id, set()).add(key)
+
+    def invalidate_name(self, chattype: str, name: str):
+        #drops the name for its chattype and for the combined lookup, including all other names of a cached player
+        with self.lock:
+            for key in ((chattype, name), (None, name)):
+                self.unknown.pop(key, None)
+                player = self.players.pop(key, None)
+                self.invalidate_player(player)
+
+    def invalidate_player(self, player: Players):
+        #drops every name that points to the player
+        if player is None or player.id is None:
+            return
+        with self.lock:
+            for key in self.keys_by_player.pop(player.id, set()):
+                self.players.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.players.clear()
+            self.unknown.clear()
+            self.keys_by_player.clear()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.players), "unknown": len(self.unknown),
+                    "hitrate": self.hits / total if total else 0.0}
@@ -0,0 +1,33 @@
+from dbconnection import DatabaseConnector
+from model import db, Players
+import pytest
+import os
+
+def create_player(name: str, **fields) -> Players:
+    #registered player whose stats names are the chat name
+    return Players.create(statsName=name, statsIRCName=name, statsDiscordName=name, statsMatrixName=name, **fields)
+
+@pytest.fixture(scope="module")
+def database():
+    #factory for test databases, database("test_x.db", irc=["Alpha"], discord=["Bravo"], archive_age=90)
+    #opens a DatabaseConnector and registers the players, the files are removed after the module
+    filenames: list[str] = []
+
+    def open_database(filename: str, irc=(), discord=(), matrix=(), **kwargs) -> DatabaseConnector:
+        connector = DatabaseConnector(filename, **kwargs)
+        filenames.append(filename)
+        for name in irc:
+            create_player(name, ircName=name)
+        for name in discord:
+            create_player(name, discordName=name, discordMention="@" + name)
+        for name in matrix:
+            create_player(name, matrixName=name)
+        return connector
+
+    yield open_database
+    if not db.is_closed():
+        db.close()
+    for filename in set(filenames):
+        for path in (filename, filename + "-wal", filename + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
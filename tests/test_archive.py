@@ -0,0 +1,50 @@
+from dbconnection import DatabaseConnector
+from model import GameTypes, PickupGames, PickupEntries, ArchivedGames, ArchivedEntries, PlayerDailyCounts
+from datetime import datetime, timedelta
+import pytest
+from chattype import ChatType
+
+@pytest.fixture(scope="module")
+def dbconnect(database):
+    return database("test_archive.db", irc=["Alpha", "Bravo"], archive_age=90)
+
+def test_rollup_updated_on_match(dbconnect:DatabaseConnector):
+    dbconnect.add_player_to_games("Alpha", ["duel"], ChatType.IRC.value)
+    result, error_messages, found_match = dbconnect.add_player_to_games("Bravo", ["duel"], ChatType.IRC.value)
+    assert found_match
+    assert [count.gameCount for count in PlayerDailyCounts.select()] == [1, 1]
+    assert dbconnect.get_top_ten(["duel"]) == "Top 10 players for last 30 days (duel): Alpha: 1 Bravo: 1"
+
+def test_rollup_counts_same_day(dbconnect:DatabaseConnector):
+    dbconnect.add_player_to_games("Bravo", ["duel"], ChatType.IRC.value)
+    dbconnect.add_player_to_games("Alpha", ["duel"], ChatType.IRC.value)
+    assert PlayerDailyCounts.select().count() == 2
+    assert dbconnect.get_top_ten([]) == "Top 10 players for last 30 days (all games): Alpha: 2 Bravo: 2"
+
+def test_archive_old_games(dbconnect:DatabaseConnector):
+    PickupGames.update(createdDate=datetime.now() - timedelta(days=100)).execute()
+    assert dbconnect.archive_played_games() == 2
+    assert PickupGames.select().count() == 0
+    assert PickupEntries.select().count() == 0
+    assert ArchivedGames.select().count() == 2
+    assert ArchivedEntries.select().count() == 4
+    assert dbconnect.get_lastgame(ChatType.IRC.value).startswith("duel, played on")
+
+def test_archive_keeps_recent_games(dbconnect:DatabaseConnector):
+    dbconnect.add_player_to_games("Alpha", ["duel"], ChatType.IRC.value)
+    dbconnect.add_player_to_games("Bravo", ["duel"], ChatType.IRC.value)
+    assert dbconnect.archive_played_games() == 0
+    assert PickupGames.select().where(PickupGames.isPlayed == True).count() == 1
+    assert dbconnect.get_lastgame(ChatType.IRC.value) == "duel, played on " + datetime.now().strftime("%Y-%m-%d") + " was played with: Alpha (Alpha) Bravo (Bravo) "
+
+def test_archive_runs_from_pugtimer(dbconnect:DatabaseConnector):
+    # matches don't archive on the command path, the pugtimer does once a day
+    PickupGames.update(createdDate=datetime.now() - timedelta(days=100)).execute()
+    dbconnect.add_player_to_games("Alpha", ["duel"], ChatType.IRC.value)
+    dbconnect.add_player_to_games("Bravo", ["duel"], ChatType.IRC.value)
+    assert ArchivedGames.select().count() == 2
+    dbconnect.start_expiry_scheduler(2400, 3600)
+    dbconnect.last_archive = datetime.now() - timedelta(days=2)
+    delay, has_new_text, warn_users, expired_players = dbconnect.pugtimer_step()
+    assert ArchivedGames.select().count() == 3
+    assert 86000 < delay <= 86400
@@ -0,0 +1,22 @@
+import broadcast
+from broadcast import BroadcastMessage
+from chattype import ChatType
+
+def test_render_once_per_chat(monkeypatch):
+    calls = []
+    strip_irc_colors = broadcast.strip_irc_colors
+    monkeypatch.setattr(broadcast, "strip_irc_colors", lambda text: calls.append(text) or strip_irc_colors(text))
+    message = BroadcastMessage("\x0304duel\x0f ready ", head="<alpha> ")
+    assert message.get_discord() == "<alpha> duel ready"
+    assert message.get_discord() is message.get_discord()
+    assert calls == ["<alpha> \x0304duel\x0f ready "]
+
+def test_chat_variants():
+    message = BroadcastMessage("plain", {ChatType.IRC.value: "\x0304irc", ChatType.MATRIX.value: "<font color=\"red\">matrix</font> <b>"}, matrix_html=True)
+    assert message.get_text(ChatType.IRC.value) == "\x0304irc"
+    assert message.get_discord() == "plain"
+    assert message.get_matrix() == ("matrix <b>", "<font color=\"red\">matrix</font> &lt;b&gt;")
+
+def test_matrix_plain_body():
+    message = BroadcastMessage("gg & <3\nnext", head="<alpha> ")
+    assert message.get_matrix() == ("<alpha> gg & <3\nnext", "&lt;alpha&gt; gg &amp; &lt;3<br>next")
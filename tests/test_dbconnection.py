@@ -19,7 +19,9 @@ class DiscordTestUser:
 
 @pytest.fixture(scope="module")
 def dbconnect():
-    yield DatabaseConnector("test.db")
+    connector = DatabaseConnector("test.db")
+    yield connector
+    connector.close()
     os.remove("test.db") 
 
 ####### Register/Stats Tests ######
@@ -0,0 +1,53 @@
+from dbexecutor import DatabaseExecutor, DatabaseProxy
+from dbconnection import DatabaseConnector
+from model import db
+import asyncio
+import threading
+import pytest
+import os
+
+@pytest.fixture(scope="module")
+def executor():
+    executor = DatabaseExecutor()
+    yield executor
+    executor.shutdown()
+
+def test_executor_runs_on_writer_thread(executor:DatabaseExecutor):
+    assert not executor.in_writer_thread()
+    assert executor.call(threading.get_ident) != threading.get_ident()
+    assert executor.call(executor.in_writer_thread)
+
+def test_executor_keeps_submit_order(executor:DatabaseExecutor):
+    results = []
+    futures = [executor.submit(results.append, index) for index in range(50)]
+    for future in futures:
+        future.result()
+    assert results == list(range(50))
+
+def test_executor_nested_call_runs_inline(executor:DatabaseExecutor):
+    def outer():
+        return executor.call(lambda: "inner")
+    assert executor.call(outer) == "inner"
+
+def test_executor_raises_in_caller(executor:DatabaseExecutor):
+    def failing():
+        raise ValueError("failed")
+    with pytest.raises(ValueError):
+        executor.call(failing)
+
+def test_executor_awaitable(executor:DatabaseExecutor):
+    async def main():
+        return await executor.run(threading.get_ident)
+    assert asyncio.run(main()) != threading.get_ident()
+
+def test_proxy_uses_writer_connection(executor:DatabaseExecutor):
+    dbconnect = DatabaseProxy(executor, DatabaseConnector, "test_executor.db")
+    try:
+        assert not dbconnect.has_active_games()
+        assert dbconnect.add_gametypes("1v1v1", 3, 0, "dm") == "Gametype 1v1v1 added."
+        assert "1v1v1" in dbconnect.get_gametype_list()
+        #the connection was opened on the writer thread and is reused there
+        assert dbconnect.executor.call(lambda: not db.is_closed())
+    finally:
+        dbconnect.close()
+        os.remove("test_executor.db")
@@ -0,0 +1,12 @@
+from dbconnection import DatabaseConnector
+from model import db
+import pytest
+
+@pytest.fixture(scope="module")
+def dbconnect(database):
+    return database("test_pragmas.db")
+
+def test_pragmas(dbconnect:DatabaseConnector):
+    assert db.execute_sql("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.execute_sql("PRAGMA foreign_keys").fetchone()[0] == 1
+    assert db.execute_sql("PRAGMA busy_timeout").fetchone()[0] > 0
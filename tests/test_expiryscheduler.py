@@ -0,0 +1,101 @@
+from dbconnection import DatabaseConnector
+from expiryscheduler import ExpiryScheduler, VirtualClock
+from pickupstate import ActiveEntry
+from model import Players
+import pytest
+import os
+from chattype import ChatType
+
+def make_entry(entry_id: int, clock: VirtualClock) -> ActiveEntry:
+    return ActiveEntry(entry_id, None, None, ChatType.IRC.value, clock.now())
+
+def test_scheduler_warn_then_expire():
+    clock = VirtualClock()
+    scheduler = ExpiryScheduler(60, 120, clock.now)
+    entry = make_entry(1, clock)
+    scheduler.schedule(entry)
+    assert scheduler.seconds_until_next() == 60
+    assert scheduler.pop_due() == ([], [])
+    clock.advance(60)
+    assert scheduler.pop_due() == ([entry], [])
+    assert scheduler.seconds_until_next() == 60
+    clock.advance(60)
+    assert scheduler.pop_due() == ([], [entry])
+    assert scheduler.seconds_until_next() is None
+
+def test_scheduler_renew_and_remove():
+    clock = VirtualClock()
+    scheduler = ExpiryScheduler(60, 120, clock.now)
+    first, second = make_entry(1, clock), make_entry(2, clock)
+    scheduler.schedule(first)
+    scheduler.schedule(second)
+    clock.advance(50)
+    first.addedDate = clock.now()
+    scheduler.schedule(first)
+    scheduler.unschedule(second.id)
+    clock.advance(20)
+    assert scheduler.pop_due() == ([], [])
+    assert scheduler.seconds_until_next() == 40
+    assert len(scheduler) == 1
+
+def test_scheduler_skips_warning_when_expired():
+    clock = VirtualClock()
+    scheduler = ExpiryScheduler(60, 120, clock.now)
+    entry = make_entry(1, clock)
+    scheduler.schedule(entry)
+    clock.advance(500)
+    assert scheduler.pop_due() == ([], [entry])
+
+def test_scheduler_listener_on_earliest_change():
+    clock = VirtualClock()
+    scheduler = ExpiryScheduler(60, 120, clock.now)
+    wakeups = []
+    scheduler.set_listener(lambda: wakeups.append(clock.now()))
+    first = make_entry(1, clock)
+    scheduler.schedule(first)
+    assert len(wakeups) == 1
+    clock.advance(10)
+    second = make_entry(2, clock)
+    scheduler.schedule(second)
+    # a later deadline doesn't change the next wakeup
+    assert len(wakeups) == 1
+    first.addedDate = clock.advance(10)
+    scheduler.schedule(first)
+    assert len(wakeups) == 2
+    scheduler.unschedule(first.id)
+    assert len(wakeups) == 2
+    scheduler.unschedule(second.id)
+    assert len(wakeups) == 3
+
+@pytest.fixture(scope="module")
+def dbconnect():
+    connector = DatabaseConnector("test_expiry.db")
+    Players.create(ircName="Alpha", statsName="Alpha", statsIRCName="Alpha", statsDiscordName="Alpha", statsMatrixName="Alpha")
+    Players.create(discordName="Bravo", discordMention="@Bravo", statsName="Bravo", statsIRCName="Bravo", statsDiscordName="Bravo", statsMatrixName="Bravo")
+    yield connector
+    connector.close()
+    os.remove("test_expiry.db")
+
+def test_pugtimer_step_with_virtual_clock(dbconnect:DatabaseConnector):
+    clock = VirtualClock()
+    dbconnect.start_expiry_scheduler(2400, 3600, clock.now)
+    dbconnect.add_player_to_games("Alpha", ["duel", "2v2tdm"], ChatType.IRC.value)
+    dbconnect.add_player_to_games("Bravo", ["2v2tdm"], ChatType.DISCORD.value)
+    # entries were added at the real time, move the virtual clock to the last one
+    clock.current = dbconnect.state.get_entries()[-1].addedDate
+    delay, has_new_text, warn_users, expired_players = dbconnect.pugtimer_step()
+    assert delay == pytest.approx(2400, abs=1)
+    assert not has_new_text
+    clock.advance(2400)
+    delay, has_new_text, warn_users, expired_players = dbconnect.pugtimer_step()
+    assert not has_new_text
+    assert warn_users == [{"user": "Alpha", "chattype": ChatType.IRC.value}, {"user": "@Bravo", "chattype": ChatType.DISCORD.value}]
+    assert delay == pytest.approx(1200, abs=1)
+    dbconnect.withdraw_player_from_pickup("Bravo", chattype=ChatType.DISCORD.value)
+    clock.advance(1200)
+    delay, has_new_text, warn_users, expired_players = dbconnect.pugtimer_step()
+    assert has_new_text
+    assert warn_users == []
+    assert expired_players == ["Alpha"]
+    assert delay is None
+    assert not dbconnect.has_active_games()
@@ -0,0 +1,41 @@
+from dbconnection import DatabaseConnector
+from gametypecatalog import GametypeCatalog
+from model import db
+from chattype import ChatType
+import pytest
+
+@pytest.fixture(scope="module")
+def dbconnect(database):
+    return database("test_catalog.db", irc=["caplayer"])
+
+def test_catalog_loaded_at_startup(dbconnect:DatabaseConnector):
+    duel = dbconnect.gametypes.get("duel")
+    assert duel.playerCount == 2
+    assert dbconnect.gametypes.get_by_id(duel.id) is duel
+    assert dbconnect.get_gametype_list()[:3] == ["duel", "2v2tdm", "4v4tdm"]
+
+def test_catalog_lookups_skip_database(dbconnect:DatabaseConnector, monkeypatch):
+    statements = []
+    execute_sql = db.execute_sql
+    monkeypatch.setattr(db, "execute_sql", lambda sql, *args, **kwargs: statements.append(sql) or execute_sql(sql, *args, **kwargs))
+    dbconnect.get_gametype_list()
+    dbconnect.get_subscribed_players("WrongGameType")
+    assert statements == []
+
+def test_catalog_admin_changes(dbconnect:DatabaseConnector):
+    events = []
+    dbconnect.gametypes.add_listener(lambda event, gametype: events.append((event, gametype.title)))
+    assert dbconnect.add_gametypes("1v1v1", 3, 0, "dm") == "Gametype 1v1v1 added."
+    assert "1v1v1" in dbconnect.get_gametype_list()
+    assert dbconnect.delete_gametypes(["1v1v1"]) == ["1v1v1 deleted."]
+    assert dbconnect.gametypes.get("1v1v1") is None
+    assert events == [(GametypeCatalog.ADDED, "1v1v1"), (GametypeCatalog.REMOVED, "1v1v1")]
+
+def test_catalog_counts_from_command(dbconnect:DatabaseConnector):
+    #!addgametype passes the raw string arguments
+    assert dbconnect.add_gametypes("2v2v2ca", "6", "3", "ca") == "Gametype 2v2v2ca added."
+    gametype = dbconnect.gametypes.get("2v2v2ca")
+    assert gametype.playerCount == 6 and gametype.teamCount == 3
+    result, _, _ = dbconnect.add_player_to_games("caplayer", ["2v2v2ca"], ChatType.IRC.value)
+    assert result
+    dbconnect.delete_gametypes(["2v2v2ca"])
@@ -0,0 +1,152 @@
+from ircconnection import IrcConnector, TokenBucket, split_irc_message
+from irc.features import FeatureSet
+from irc.client import Event, NickMask
+from dbexecutor import DatabaseExecutor
+import pytest
+
+class RecordingConnection:
+    # records outgoing notices instead of sending them
+    def __init__(self, features: list[str]):
+        self.features = FeatureSet()
+        for feature in features:
+            self.features.load_feature(feature)
+        self.notices = []
+        self.messages = []
+
+    def notice(self, target, message):
+        self.notices.append((target, message))
+
+    def privmsg(self, target, message):
+        self.messages.append((target, message))
+
+    def get_nickname(self):
+        return "greedybot"
+
+class FakeClock:
+    def __init__(self):
+        self.current = 0.0
+
+    def __call__(self) -> float:
+        return self.current
+
+def irc_connector(features: list[str]) -> IrcConnector:
+    connector = IrcConnector({"server": "localhost", "port": "6667", "nickname": "greedybot", "channel": "#pickup"}, None)
+    connector.connection = RecordingConnection(features)
+    connector.bucket = TokenBucket(100, 1)
+    return connector
+
+@pytest.mark.parametrize("features, targets", [(["TARGMAX=PRIVMSG:4,NOTICE:3"], ["a,b,c", "d,e"]),
+                                               (["MAXTARGETS=20"], ["a,b,c,d,e"]),
+                                               ([], ["a", "b", "c", "d", "e"])])
+def test_group_notice_targets(features, targets):
+    connector = irc_connector(features)
+    connector.send_group_notice(["a", "b", "c", "d", "e"], "expires soon")
+    connector.flush_lines()
+    assert connector.connection.notices == [(target, "expires soon") for target in targets]
+
+def test_group_notice_line_length():
+    connector = irc_connector(["MAXTARGETS=20"])
+    nicks = ["player%02d" % index for index in range(20)]
+    connector.send_group_notice(nicks, "x" * 300)
+    connector.flush_lines()
+    assert len(connector.connection.notices) > 1
+    # without our own join yet the longest usual user@host is assumed
+    assert all(len((":greedybot!~greedybot@" + "x" * 63 + " NOTICE " + target + " :" + message + "\r\n").encode("utf-8")) <= 512
+               for target, message in connector.connection.notices)
+    assert ",".join(target for target, message in connector.connection.notices).split(",") == nicks
+
+def test_group_notice_byte_budget():
+    connector = irc_connector(["MAXTARGETS=20"])
+    connector.userhost = "~greedybot@example.org"
+    nicks = ["spieler_ä%02d" % index for index in range(20)]
+    message = "Deine Spiele laufen in 20 Minuten ab, schreibe !renew – " * 4
+    connector.send_group_notice(nicks, message)
+    connector.flush_lines()
+    notices = connector.connection.notices
+    assert len(notices) > 1
+    for target, text in notices:
+        assert len((":greedybot!~greedybot@example.org NOTICE " + target + " :" + text + "\r\n").encode("utf-8")) <= 512
+    assert ",".join(target for target, text in notices).split(",") == nicks
+    assert all(text == message for target, text in notices)
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(2, 4, clock)
+    assert bucket.take() and bucket.take()
+    assert not bucket.take()
+    clock.current = 0.25
+    assert bucket.take()
+
+def test_flood_control_sends_on_reactor():
+    connector = irc_connector([])
+    clock = FakeClock()
+    connector.bucket = TokenBucket(3, 2, clock)
+    connector.send_my_message("\n".join("line %d" % index for index in range(5)))
+    # queuing never sends, the reactor thread does in flush_lines
+    assert connector.connection.messages == []
+    connector.flush_lines()
+    assert connector.connection.messages == [("#pickup", "line 0"), ("#pickup", "line 1"), ("#pickup", "line 2")]
+    connector.flush_lines()
+    assert len(connector.connection.messages) == 3
+    clock.current = 1.0
+    connector.flush_lines()
+    assert [message for target, message in connector.connection.messages] == ["line %d" % index for index in range(5)]
+
+def test_split_short_message_unchanged():
+    assert split_irc_message("duel  (1/2)", 100) == ["duel  (1/2)"]
+
+def test_split_counts_utf8_bytes():
+    text = " ".join(["äöü"] * 20)
+    lines = split_irc_message(text, 30)
+    assert all(len(line.encode("utf-8")) <= 30 for line in lines)
+    assert " ".join(lines) == text
+
+def test_split_long_word_and_colour_state():
+    text = "\x02\x0304" + "é" * 30 + "\x0f end"
+    lines = split_irc_message(text, 20)
+    assert all(len(line.encode("utf-8")) <= 20 for line in lines)
+    assert all(line.startswith("\x02\x0304") for line in lines[:-1])
+    assert lines[-1] == "end"
+    assert "".join(line.replace("\x02\x0304", "") for line in lines[:-1]) == "é" * 30
+
+def test_split_never_cuts_colour_code():
+    lines = split_irc_message("ab\x0312,04cd", 7)
+    assert lines == ["ab", "\x0312,04c", "\x0312,04d"]
+
+def test_split_comma_after_carried_colour():
+    lines = split_irc_message("\x0304xxxxx,5", 8)
+    assert lines == ["\x0304xxxxx", "\x0304\x02\x02,5"]
+
+def test_flood_control_uses_line_budget():
+    connector = irc_connector([])
+    connector.userhost = "~greedybot@example.org"
+    connector.send_my_message(" ".join(["spieler"] * 200), "<someone> ")
+    connector.flush_lines()
+    for target, message in connector.connection.messages:
+        assert message.startswith("<someone> ")
+        assert len((":greedybot!~greedybot@example.org PRIVMSG " + target + " :" + message + "\r\n").encode("utf-8")) <= 512
+    assert len(connector.connection.messages) == 4
+
+class ExitRecordingBot:
+    # records on which thread the exit handlers reach the bot
+    def __init__(self):
+        self.dbexecutor = DatabaseExecutor()
+        self.calls = []
+
+    def remove_user_on_exit(self, user, chattype):
+        self.calls.append(("exit", user, self.dbexecutor.in_writer_thread()))
+
+    def change_name(self, oldnick, newnick):
+        self.calls.append(("nick", newnick, self.dbexecutor.in_writer_thread()))
+
+def test_exit_handlers_run_on_writer_thread():
+    bot = ExitRecordingBot()
+    connector = IrcConnector({"server": "localhost", "port": "6667", "nickname": "greedybot", "channel": "#pickup", "presence-update": False}, bot)
+    try:
+        connector.on_part(None, Event("part", NickMask("alice!~a@host"), "#pickup"))
+        connector.on_quit(None, Event("quit", NickMask("bob!~b@host"), None))
+        connector.on_kick(None, Event("kick", NickMask("op!~o@host"), "#pickup", ["carol"]))
+        connector.on_nick(None, Event("nick", NickMask("dave!~d@host"), "david"))
+    finally:
+        bot.dbexecutor.shutdown()
+    assert bot.calls == [("exit", "alice", True), ("exit", "bob", True), ("exit", "carol", True), ("nick", "david", True)]
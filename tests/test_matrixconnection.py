@@ -0,0 +1,155 @@
+from matrixconnection import MatrixConnector, escape_matrix_html
+from nio import AsyncClient
+from aiohttp import web
+import asyncio
+import json
+
+class MockHomeserver:
+    # answers login, room sends and a minimal sync, the first send is rate limited
+    def __init__(self):
+        self.events = []
+        self.limited = 1
+        self.logins = 0
+        self.filters = []
+        self.syncs = []
+        self.app = web.Application()
+        self.app.router.add_post("/_matrix/client/v3/login", self.login)
+        self.app.router.add_get("/_matrix/client/v3/account/whoami", self.whoami)
+        self.app.router.add_post("/_matrix/client/v3/user/{user}/filter", self.filter)
+        self.app.router.add_get("/_matrix/client/v3/sync", self.sync)
+        self.app.router.add_get("/_matrix/client/v3/rooms/{room}/joined_members", self.joined_members)
+        self.app.router.add_put("/_matrix/client/v3/rooms/{room}/send/{event_type}/{txn}", self.send)
+
+    async def login(self, request):
+        self.logins += 1
+        return web.json_response({"user_id": "@greedybot:localhost", "access_token": "token", "device_id": "DEVICE"})
+
+    async def whoami(self, request):
+        if "token" not in (request.query.get("access_token"), request.headers.get("Authorization", "")[len("Bearer "):]):
+            return web.json_response({"errcode": "M_UNKNOWN_TOKEN", "error": "Unknown token"}, status=401)
+        return web.json_response({"user_id": "@greedybot:localhost"})
+
+    async def filter(self, request):
+        self.filters.append(json.loads(await request.text()))
+        return web.json_response({"filter_id": str(len(self.filters))})
+
+    async def sync(self, request):
+        self.syncs.append(dict(request.query))
+        return web.json_response({"next_batch": "s%d" % len(self.syncs), "rooms": {"join": {"!pickup:localhost": {
+            "state": {"events": []}, "timeline": {"events": []}}}}})
+
+    async def joined_members(self, request):
+        return web.json_response({"joined": {"@alice:localhost": {"display_name": "alice"}}})
+
+    async def send(self, request):
+        if self.limited:
+            self.limited -= 1
+            return web.json_response({"errcode": "M_LIMIT_EXCEEDED", "error": "Too many requests", "retry_after_ms": 20}, status=429)
+        self.events.append((request.match_info["room"], json.loads(await request.text())))
+        return web.json_response({"event_id": "$event%d" % len(self.events)})
+
+async def start_mock_homeserver(homeserver: MockHomeserver) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(homeserver.app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, "http://127.0.0.1:%d" % site._server.sockets[0].getsockname()[1]
+
+async def send_through_mock_homeserver():
+    homeserver = MockHomeserver()
+    runner, server = await start_mock_homeserver(homeserver)
+    connector = MatrixConnector({"server": server, "botname": "greedybot", "password": "secret", "room": "!pickup:localhost"}, None)
+    connector.attach_client(AsyncClient(connector.server, connector.botname))
+    connector.loop = asyncio.get_running_loop()
+    await connector.client.login("secret")
+    try:
+        await connector.send_my_message_async("<a> hi", False)
+        await connector.send_my_message_async("Pickups: <font color=\"red\">duel</font> (1/2)", True)
+        await connector.send_my_message_async("plain & simple", False)
+        await connector.get_room_queue(connector.room).join()
+        await connector.send_my_message_async("second event", False)
+        await connector.get_room_queue(connector.room).join()
+        return homeserver.events, connector.get_send_metrics()[connector.room]
+    finally:
+        await connector.client.close()
+        await runner.cleanup()
+
+def test_room_queue_merges_and_retries():
+    events, metrics = asyncio.run(send_through_mock_homeserver())
+    assert len(events) == 2
+    room, content = events[0]
+    assert room == "!pickup:localhost"
+    assert content["formatted_body"] == "&lt;a&gt; hi<br>Pickups: <font color=\"red\">duel</font> (1/2)<br>plain &amp; simple"
+    assert content["body"] == "<a> hi\nPickups: duel (1/2)\nplain & simple"
+    assert events[1][1] == {"msgtype": "m.text", "body": "second event"}
+    assert metrics["events"] == 2 and metrics["messages"] == 4 and metrics["merged"] == 2
+    assert metrics["retries"] == 1 and metrics["retry_wait_ms"] == 20
+    assert metrics["depth"] == 0
+
+async def send_plain_batch():
+    homeserver = MockHomeserver()
+    homeserver.limited = 0
+    runner, server = await start_mock_homeserver(homeserver)
+    connector = MatrixConnector({"server": server, "botname": "greedybot", "password": "secret", "room": "!pickup:localhost"}, None)
+    connector.attach_client(AsyncClient(connector.server, connector.botname))
+    await connector.client.login("secret")
+    try:
+        # queued before the worker runs, so all lines go into one event
+        for line in ("first", "<a> hi", "x & y"):
+            await connector.send_my_message_async(line, False)
+        await connector.get_room_queue(connector.room).join()
+        return homeserver.events
+    finally:
+        await connector.client.close()
+        await runner.cleanup()
+
+def test_plain_batch_has_no_html():
+    events = asyncio.run(send_plain_batch())
+    assert [content for room, content in events] == [{"msgtype": "m.text", "body": "first\n<a> hi\nx & y"}]
+
+def test_escape_matrix_html():
+    assert escape_matrix_html("<a> 1 > 0") == "&lt;a&gt; 1 &gt; 0"
+    assert escape_matrix_html("<<font color=\"#f00\">Red\nteam</font>>\n<b>") == "&lt;<font color=\"#f00\">Red<br>team</font>&gt;<br>&lt;b&gt;"
+    assert escape_matrix_html("<font color=\"#f00\">open") == "&lt;font color=\"#f00\"&gt;open"
+
+async def sync_through_mock_homeserver(homeserver: MockHomeserver, statefile: str, runs: int = 1) -> list[MatrixConnector]:
+    # sessions like MatrixConnector.start, with a single sync instead of sync_forever
+    runner, server = await start_mock_homeserver(homeserver)
+    connectors = []
+    try:
+        for _ in range(runs):
+            connector = MatrixConnector({"server": server, "botname": "greedybot", "password": "secret", "room": "!pickup:localhost", "statefile": statefile}, None)
+            connector.attach_client(AsyncClient(connector.server, connector.botname))
+            connectors.append(connector)
+            try:
+                sync_filter = await connector.prepare_session()
+                response = await connector.client.sync(0, sync_filter, connector.state.get("next_batch"), True)
+                await connector.client.run_response_callbacks([response])
+            finally:
+                await connector.client.close()
+        return connectors
+    finally:
+        await runner.cleanup()
+
+def test_sync_state_persisted(tmp_path):
+    statefile = str(tmp_path / "matrix_state.json")
+    homeserver = MockHomeserver()
+    first, second = asyncio.run(sync_through_mock_homeserver(homeserver, statefile, 2))
+    assert homeserver.filters[0]["room"]["rooms"] == ["!pickup:localhost"]
+    assert homeserver.filters[0]["room"]["state"]["lazy_load_members"] is True
+    assert homeserver.syncs[0]["filter"] == "1" and "since" not in homeserver.syncs[0]
+    assert first.found_user_in_room("@alice:localhost")
+    # the second run neither logs in nor uploads the filter again and continues after the stored token
+    assert homeserver.logins == 1 and len(homeserver.filters) == 1
+    assert homeserver.syncs[1]["since"] == "s1" and homeserver.syncs[1]["full_state"] == "true"
+    with open(statefile) as file:
+        state = json.load(file)
+    assert state["access_token"] == "token" and state["next_batch"] == "s2" and state["filter_id"] == "1"
+
+def test_invalid_stored_login(tmp_path):
+    statefile = tmp_path / "matrix_state.json"
+    statefile.write_text(json.dumps({"user_id": "@greedybot:localhost", "device_id": "OLD", "access_token": "expired", "next_batch": "s9", "filter_id": "7"}))
+    homeserver = MockHomeserver()
+    asyncio.run(sync_through_mock_homeserver(homeserver, str(statefile)))
+    assert homeserver.logins == 1 and len(homeserver.filters) == 1
+    assert "since" not in homeserver.syncs[0]
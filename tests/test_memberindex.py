@@ -0,0 +1,50 @@
+from memberindex import MentionIndex, OnlineMembers, NameCache
+
+class Member:
+    def __init__(self, name: str, member_id: int):
+        self.name = name
+        self.id = member_id
+        self.mention = "<@%d>" % member_id
+
+def test_rewrite_mentions():
+    index = MentionIndex()
+    index.load([Member("bob", 1), Member("bobby", 2), Member("Dr. Who", 3)])
+    assert index.rewrite("@bob, @bobby and @Dr. Who: duel?") == "<@1>, <@2> and <@3>: duel?"
+    assert index.rewrite("mail@example.org @unknown @") == "mail@example.org @unknown @"
+
+def test_rewrite_after_member_updates():
+    index = MentionIndex()
+    index.load([Member("bob", 1)])
+    index.add("alice", "<@4>")
+    index.remove("bob")
+    assert len(index) == 1
+    assert index.rewrite("@bob @alice") == "@bob <@4>"
+
+class PresenceMember(Member):
+    def __init__(self, name: str, member_id: int, status: str):
+        super().__init__(name, member_id)
+        self.status = status
+
+def test_online_members():
+    online = OnlineMembers()
+    online.load([PresenceMember("carl", 1, "online"), PresenceMember("anna", 2, "idle"), PresenceMember("bert", 3, "offline")])
+    assert online.snapshot() == ("anna", "carl")
+    online.update("bert", True)
+    online.update("carl", False)
+    online.rename("anna", "anne")
+    assert online.is_online("bert") and not online.is_online("carl")
+    assert online.snapshot() == ("anne", "bert")
+    assert online.snapshot() is online.snapshot()
+
+def test_name_cache():
+    cache = NameCache()
+    duel, ctf = Member("player_duel", 1), Member("player_ctf", 2)
+    cache.load([duel, ctf])
+    assert cache.get("player_duel") is duel
+    renamed = Member("player_4v4ctf", 2)
+    cache.rename("player_ctf", renamed)
+    assert cache.get("player_ctf") is None and cache.get("player_4v4ctf") is renamed
+    cache.remove(Member("player_duel", 3))
+    assert cache.get("player_duel") is duel
+    cache.remove(duel)
+    assert len(cache) == 1
@@ -0,0 +1,86 @@
+from outbox import Outbox, merge_lines
+import asyncio
+import threading
+
+class BlockingSender:
+    # records delivered items, waits for release before every delivery
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.items = []
+
+    async def deliver(self, item):
+        await self.release.wait()
+        self.items.append(item)
+
+async def keep_order():
+    sender = BlockingSender()
+    sender.release.set()
+    outbox = Outbox("irc", sender.deliver)
+    for index in range(20):
+        assert await outbox.put(index)
+    await outbox.join()
+    outbox.close()
+    return sender.items, outbox.get_stats()
+
+def test_outbox_keeps_order():
+    items, stats = asyncio.run(keep_order())
+    assert items == list(range(20))
+    assert stats["sent"] == 20
+
+async def merge_while_busy():
+    sender = BlockingSender()
+    outbox = Outbox("discord", sender.deliver, merge=merge_lines(20))
+    await outbox.put(("first", False))
+    #let the sender take the first message
+    await asyncio.sleep(0)
+    for item in (("a", False), ("b", False), ("c", True), ("x" * 20, True)):
+        await outbox.put(item)
+    sender.release.set()
+    await outbox.join()
+    outbox.close()
+    return sender.items, outbox.get_stats()
+
+def test_outbox_merges_while_busy():
+    items, stats = asyncio.run(merge_while_busy())
+    assert items == [("first", False), ("a\nb", False), ("c", True), ("x" * 20, True)]
+    assert stats["merged"] == 1
+
+async def wait_when_full():
+    sender = BlockingSender()
+    outbox = Outbox("matrix", sender.deliver, maxsize=2)
+    await outbox.put(0)
+    await asyncio.sleep(0)
+    await outbox.put(1)
+    await outbox.put(2)
+    #the loop never waits: posted from the loop, the put waits in a task
+    outbox.post(3)
+    #another thread waits until its message is queued
+    thread = threading.Thread(target=outbox.post, args=(4,))
+    thread.start()
+    await asyncio.sleep(0.05)
+    full_stats = outbox.get_stats()
+    sender.release.set()
+    await outbox.join()
+    await asyncio.get_running_loop().run_in_executor(None, thread.join)
+    outbox.close()
+    return sender.items, full_stats
+
+def test_outbox_waits_when_full():
+    items, full_stats = asyncio.run(wait_when_full())
+    assert full_stats["depth"] == 2 and full_stats["waited"] == 1
+    assert items == [0, 1, 2, 3, 4]
+
+async def failing_delivery():
+    async def deliver(item):
+        if item == 1:
+            raise Exception("send failed")
+    outbox = Outbox("discord", deliver)
+    for index in range(3):
+        outbox.post(index)
+    await outbox.join()
+    outbox.close()
+    return outbox.get_stats()
+
+def test_outbox_counts_failures():
+    stats = asyncio.run(failing_delivery())
+    assert stats["sent"] == 2 and stats["failed"] == 1
@@ -0,0 +1,99 @@
+import dbconnection
+from dbconnection import DatabaseConnector
+from pickupstate import PickupState
+from model import db, Players, PickupEntries
+from peewee import IntegrityError
+import pytest
+from chattype import ChatType
+
+@pytest.fixture(scope="module")
+def dbconnect(database):
+    return database("test_state.db", irc=["Alpha"], discord=["Bravo"], matrix=["Charlie"])
+
+def reloaded_state() -> PickupState:
+    state = PickupState()
+    state.load()
+    return state
+
+def test_state_add_players(dbconnect:DatabaseConnector):
+    dbconnect.add_player_to_games("Alpha", ["2v2tdm", "4v4ctf"], ChatType.IRC.value)
+    dbconnect.add_player_to_games("Charlie", ["2v2tdm"], ChatType.MATRIX.value)
+    assert dbconnect.has_active_games()
+    assert dbconnect.get_pickuptext() == "2v2tdm (2/4) 4v4ctf (1/8)"
+    assert dbconnect.get_active_games_and_players()["2v2tdm"][ChatType.MATRIX.value] == ["Charlie"]
+
+def test_state_matches_database(dbconnect:DatabaseConnector):
+    state = reloaded_state()
+    assert state.get_pickuptext() == dbconnect.get_pickuptext()
+    assert sorted(state.get_player_ids()) == sorted(dbconnect.state.get_player_ids())
+
+def test_state_withdraw_player(dbconnect:DatabaseConnector):
+    assert dbconnect.withdraw_player_from_pickup("Alpha", ["4v4ctf"], ChatType.IRC.value)
+    assert dbconnect.get_pickuptext() == "2v2tdm (2/4)"
+    assert reloaded_state().get_pickuptext() == "2v2tdm (2/4)"
+
+def test_state_match_found(dbconnect:DatabaseConnector):
+    dbconnect.add_player_to_games("Bravo", ["duel"], ChatType.DISCORD.value)
+    result, error_messages, found_match = dbconnect.add_player_to_games("Alpha", ["duel"], ChatType.IRC.value)
+    assert result
+    assert found_match[ChatType.IRC.value].startswith("duel ready!")
+    assert dbconnect.get_pickuptext() == "2v2tdm (1/4)"
+    assert reloaded_state().get_pickuptext() == "2v2tdm (1/4)"
+
+def test_state_pickuptext_version(dbconnect:DatabaseConnector):
+    version, pickuptext = dbconnect.get_pickuptext_version()
+    assert pickuptext == "2v2tdm (1/4)"
+    dbconnect.renew_pickupentry("Charlie", [], ChatType.MATRIX.value)
+    assert dbconnect.get_pickuptext_version() == (version, pickuptext)
+    dbconnect.add_player_to_games("Alpha", ["2v2tdm"], ChatType.IRC.value)
+    new_version, pickuptext = dbconnect.get_pickuptext_version()
+    assert new_version > version
+    assert pickuptext == "2v2tdm (2/4)"
+    dbconnect.withdraw_player_from_pickup("Alpha", ["2v2tdm"], ChatType.IRC.value)
+    assert dbconnect.get_pickuptext_version()[1] == "2v2tdm (1/4)"
+
+def test_state_failed_add_rolled_back(dbconnect:DatabaseConnector, monkeypatch):
+    def failing_insert_many(*args, **kwargs):
+        raise IntegrityError("forced failure")
+    monkeypatch.setattr(PickupEntries, "insert_many", failing_insert_many)
+    result, error_messages, found_match = dbconnect.add_player_to_games("Charlie", ["duel", "4v4ctf"], ChatType.MATRIX.value)
+    assert not result
+    assert error_messages == ["Something went wrong, nothing was added. Please try again!"]
+    assert dbconnect.get_pickuptext() == "2v2tdm (1/4)"
+    assert reloaded_state().get_pickuptext() == "2v2tdm (1/4)"
+
+def test_state_failed_start_rolled_back(dbconnect:DatabaseConnector, monkeypatch):
+    def failing_count(*args, **kwargs):
+        raise IntegrityError("forced failure")
+    monkeypatch.setattr(DatabaseConnector, "_DatabaseConnector__count_played_game", failing_count)
+    result, error_message, found_match = dbconnect.start_pickupgame("2v2tdm")
+    assert not result and found_match == {}
+    assert error_message == "Something went wrong, the game was not started. Please try again!"
+    assert dbconnect.get_pickuptext() == "2v2tdm (1/4)"
+    assert reloaded_state().get_pickuptext() == "2v2tdm (1/4)"
+
+def test_state_delete_active_games(dbconnect:DatabaseConnector):
+    dbconnect.delete_active_games()
+    assert not dbconnect.has_active_games()
+    assert not reloaded_state().has_active_games()
+
+def test_team_elo_lookup_outside_transaction(dbconnect:DatabaseConnector, monkeypatch):
+    lookups = []
+    monkeypatch.setattr(dbconnection, "get_gamestats", lambda stats_id, gtype: lookups.append(db.in_transaction()) or stats_id * 100)
+    for index, name in enumerate(["Delta", "Echo", "Foxtrot", "Golf"], start=1):
+        Players.create(ircName=name, statsId=index, statsName=name, statsIRCName=name, statsDiscordName=name, statsMatrixName=name)
+        result, error_messages, found_match = dbconnect.add_player_to_games(name, ["2v2tdm"], ChatType.IRC.value)
+    assert found_match["has_teams"] and "teams" not in found_match
+    assert found_match[ChatType.IRC.value][0] == "2v2tdm ready! Players are: "
+    assert lookups == [False] * 4
+    assert not dbconnect.has_active_games()
+
+def test_add_all_skips_games_deleted_by_match(database):
+    # the duel match withdraws alpha from 2v2tdm, the now empty game is deleted before the loop reaches it
+    connector = database("test_state_match.db", irc=["alice", "bob"])
+    connector.add_player_to_games("alice", ["duel", "2v2tdm"], ChatType.IRC.value)
+    result, error_messages, found_match = connector.add_player_to_games("bob", [], ChatType.IRC.value)
+    assert result and error_messages == []
+    assert found_match[ChatType.IRC.value].startswith("duel ready!")
+    assert not connector.has_active_games()
+    assert reloaded_state().get_pickuptext() == ""
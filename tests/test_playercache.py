@@ -0,0 +1,42 @@
+from dbconnection import DatabaseConnector
+from model import Players
+from playercache import PlayerCache
+import pytest
+from chattype import ChatType
+
+@pytest.fixture(scope="module")
+def dbconnect(database):
+    return database("test_playercache.db", irc=["Alpha"], discord=["Bravo"])
+
+def test_cache_absorbs_repeated_lookups(dbconnect:DatabaseConnector):
+    for _ in range(5):
+        dbconnect.add_subscription("Alpha", "duel", ChatType.IRC.value)
+        dbconnect.get_subscriptions("Nobody", ChatType.IRC.value)
+    stats = dbconnect.get_player_cache_stats()
+    assert stats["misses"] == 2
+    assert stats["hits"] == 8
+
+def test_cache_nickname_change(dbconnect:DatabaseConnector):
+    assert dbconnect.get_subscriptions("Alpha", ChatType.IRC.value) == ["duel"]
+    assert dbconnect.get_subscriptions("Alpha2", ChatType.IRC.value) == []
+    dbconnect.set_irc_nickname("Alpha", "Alpha2")
+    assert dbconnect.get_subscriptions("Alpha2", ChatType.IRC.value) == ["duel"]
+    assert dbconnect.get_subscriptions("Alpha", ChatType.IRC.value) == []
+
+def test_cache_toggle_bridge(dbconnect:DatabaseConnector):
+    dbconnect.add_player_to_games("Bravo", ["duel"], ChatType.DISCORD.value)
+    dbconnect.toggle_player_bridge("Bravo", ChatType.DISCORD.value)
+    assert dbconnect.toggle_player_bridge("Bravo", None) == (None, "Bravo", None)
+    assert Players.get(Players.discordName == "Bravo").shouldBridge
+    dbconnect.withdraw_player_from_pickup("Bravo", chattype=ChatType.DISCORD.value)
+
+def test_cache_unknown_names_bounded():
+    cache = PlayerCache(max_unknown=2)
+    for name in ("foo", "bar", "baz"):
+        cache.store(ChatType.IRC.value, name, None)
+    assert cache.lookup(ChatType.IRC.value, "foo") == (False, None)
+    assert cache.lookup(ChatType.IRC.value, "baz") == (True, None)
+    assert cache.get_stats()["unknown"] == 2
+    #registering the name drops the cached miss
+    cache.invalidate_name(ChatType.IRC.value, "baz")
+    assert cache.lookup(ChatType.IRC.value, "baz") == (False, None)
@@ -0,0 +1,101 @@
+from dbconnection import DatabaseConnector
+from expiryscheduler import VirtualClock
+from model import db
+import pytest
+from chattype import ChatType
+
+class QueryCounter:
+    # counts all statements sent through the peewee database while active
+    def __init__(self):
+        self.statements: list[str] = []
+
+    def __enter__(self):
+        execute_sql = db.execute_sql
+        def counting_execute_sql(sql, params=None, *args, **kwargs):
+            self.statements.append(sql)
+            return execute_sql(sql, params, *args, **kwargs)
+        db.execute_sql = counting_execute_sql
+        return self
+
+    def __exit__(self, *args):
+        del db.execute_sql
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+@pytest.fixture(scope="module")
+def dbconnect(database):
+    return database("test_querycount.db", irc=["irc%d" % index for index in range(8)], discord=["disc"])
+
+def test_querycount_add_new_game(dbconnect:DatabaseConnector):
+    with QueryCounter() as counter:
+        dbconnect.add_player_to_games("irc0", ["4v4ctf"], ChatType.IRC.value)
+    assert counter.count <= 5, counter.statements
+
+def test_querycount_add_multiple_games(dbconnect:DatabaseConnector):
+    with QueryCounter() as counter:
+        dbconnect.add_player_to_games("irc1", ["duel", "2v2tdm", "4v4tdm", "4v4ctf"], ChatType.IRC.value)
+    assert counter.statements.count("BEGIN") == 1, counter.statements
+    assert counter.count <= 7, counter.statements
+
+def test_querycount_reads(dbconnect:DatabaseConnector):
+    with QueryCounter() as counter:
+        dbconnect.has_active_games()
+        dbconnect.get_pickuptext()
+        dbconnect.get_active_games_and_players()
+    assert counter.count == 0, counter.statements
+
+def test_querycount_team_match(dbconnect:DatabaseConnector):
+    for index in range(2, 6):
+        dbconnect.add_player_to_games("irc%d" % index, ["4v4ctf"], ChatType.IRC.value)
+    dbconnect.add_player_to_games("disc", ["4v4ctf"], ChatType.DISCORD.value)
+    with QueryCounter() as counter:
+        result, error_messages, found_match = dbconnect.add_player_to_games("irc7", ["4v4ctf"], ChatType.IRC.value)
+    assert found_match["has_teams"]
+    assert counter.count <= 7, counter.statements
+
+def test_querycount_lastgame(dbconnect:DatabaseConnector):
+    for chat in (ChatType.IRC.value, ChatType.DISCORD.value, ChatType.MATRIX.value):
+        with QueryCounter() as counter:
+            result = dbconnect.get_lastgame(chat)
+        assert result.startswith("4v4ctf, played on")
+        assert counter.count <= 2, counter.statements
+
+def test_querycount_subscriptions(dbconnect:DatabaseConnector):
+    for gametype in ("duel", "2v2tdm", "4v4ctf"):
+        dbconnect.add_subscription("irc0", gametype, ChatType.IRC.value)
+        dbconnect.add_subscription("irc1", gametype, ChatType.IRC.value)
+    with QueryCounter() as counter:
+        subscriptions = dbconnect.get_subscriptions("irc0", ChatType.IRC.value)
+    assert subscriptions == ["duel", "2v2tdm", "4v4ctf"]
+    assert counter.count <= 2, counter.statements
+    with QueryCounter() as counter:
+        players = dbconnect.get_subscribed_players("duel")
+    assert players == ["irc0", "irc1"]
+    assert counter.count <= 1, counter.statements
+
+def test_querycount_withdraw(dbconnect:DatabaseConnector):
+    dbconnect.add_player_to_games("irc0", ["duel", "2v2tdm", "4v4tdm"], ChatType.IRC.value)
+    with QueryCounter() as counter:
+        dbconnect.withdraw_player_from_pickup("irc0", chattype=ChatType.IRC.value)
+    assert not dbconnect.has_active_games()
+    assert counter.count <= 3, counter.statements
+
+def test_querycount_pugtimer_expiry(dbconnect:DatabaseConnector):
+    clock = VirtualClock()
+    dbconnect.start_expiry_scheduler(2400, 3600, clock.now)
+    for index in range(7):
+        dbconnect.add_player_to_games("irc%d" % index, ["4v4tdm", "4v4ctf", "5v5tdm"], ChatType.IRC.value)
+    clock.current = dbconnect.state.get_entries()[-1].addedDate
+    clock.advance(2400)
+    with QueryCounter() as counter:
+        delay, has_new_text, warn_users, expired_players = dbconnect.pugtimer_step()
+    assert len(warn_users) == 7
+    assert counter.count <= 3, counter.statements
+    clock.advance(1200)
+    with QueryCounter() as counter:
+        delay, has_new_text, warn_users, expired_players = dbconnect.pugtimer_step()
+    assert expired_players == ["irc%d" % index for index in range(7)]
+    assert not dbconnect.has_active_games()
+    assert counter.count <= 4, counter.statements
@@ -0,0 +1,32 @@
+from dbconnection import DatabaseConnector
+from model import PickupEntries, PickupGames
+from datetime import datetime, timedelta
+import pytest
+from chattype import ChatType
+
+@pytest.fixture(scope="module")
+def filename(database):
+    connector = database("test_warmstart.db", irc=["Alpha", "Bravo"])
+    connector.add_player_to_games("Alpha", ["duel", "2v2tdm"], ChatType.IRC.value)
+    connector.add_player_to_games("Bravo", ["2v2tdm"], ChatType.IRC.value)
+    # Alpha's entries timed out while the bot was offline
+    PickupEntries.update(addedDate=datetime.now() - timedelta(hours=2)).where(PickupEntries.playerId == 1).execute()
+    connector.close()
+    return "test_warmstart.db"
+
+def test_warm_start_restores_games(filename):
+    connector = DatabaseConnector(filename, warm_start=True)
+    assert connector.get_pickuptext() == "duel (1/2) 2v2tdm (2/4)"
+    assert connector.restore_active_games(3600) == ["Alpha"]
+    assert connector.get_pickuptext() == "2v2tdm (1/4)"
+    assert PickupGames.select().count() == 1
+    assert [entry.playerId.ircName for entry in connector.state.get_entries()] == ["Bravo"]
+    scheduler = connector.start_expiry_scheduler(2400, 3600)
+    assert scheduler.seconds_until_next() == pytest.approx(2400, abs=5)
+    connector.close()
+
+def test_cold_start_deletes_games(filename):
+    connector = DatabaseConnector(filename)
+    assert not connector.has_active_games()
+    assert PickupGames.select().count() == 0
+    connector.close()
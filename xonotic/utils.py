@@ -166,10 +166,13 @@ def matrix_colors(qstr: str) -> str:
     return result
 
 
+IRC_COLOR_CODE_PATTERN = re.compile('\x03(?:[0-9]{0,2}(?:,[0-9]{1,2})?)|\x0f')
+
 def strip_irc_colors(message: str) -> str:
-    color_code_pattern = re.compile('\x03(?:[0-9]{0,2}(?:,[0-9]{1,2})?)|\x0f')
-    message_stripped = color_code_pattern.sub('', message)
-    return message_stripped
+    #most bridged messages have no colour codes at all
+    if "\x03" not in message and "\x0f" not in message:
+        return message
+    return IRC_COLOR_CODE_PATTERN.sub('', message)
 
 def get_statsnames(id) -> tuple:
     #get xonstat player names